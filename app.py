@@ -1,12 +1,28 @@
-from flask import Flask, request, jsonify, send_from_directory
-from datetime import datetime, timezone
+import time
+
+# Startup is measured phase by phase so regressions show up in the logs
+_phase_started = time.perf_counter()
+startup_timings = {}
+
+from flask import Flask, request, jsonify, redirect, Response, g
 import json
 import os
-import threading
-import time
+import sys
+import asyncio
 import logging
 from dotenv import load_dotenv
 from llm_integration import LLMIntegration
+from event_log import HistoryCompacted, LIKE_TOGGLED, parse_timestamp, events_between, state_at
+from post_store import PostStore
+from change_feed import ChangeFeed
+from reply_scheduler import ReplyScheduler
+from storage import Storage
+from compaction import Compactor
+from search_index import SearchIndex
+from http_cache import StaticAssets, JSONCompressor, etag_matches
+from vault_lock import LeaderElection, Follower
+import workers
+import metrics
 
 # Load environment variables from .env file
 load_dotenv()
@@ -15,151 +31,197 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__, static_folder="static")
-
-DATA_FILE = "vault/posts.json"
-NOTIF_FILE = "vault/notifications.json"
-SETTINGS_FILE = "vault/settings.json"
-
-# Initialize LLM integration
+# With WORKERS > 1, `python app.py` only supervises that many worker
+# processes, which share the vault and the listening ports
+WORKERS = int(os.getenv("WORKERS", 1))
+SHARED_VAULT = WORKERS > 1
+if __name__ == "__main__" and SHARED_VAULT and not workers.is_worker():
+    sys.exit(workers.supervise(__file__, WORKERS))
+
+def startup_phase(name):
+    """Record how long the startup phase that just finished took"""
+    global _phase_started
+    now = time.perf_counter()
+    startup_timings[name] = round((now - _phase_started) * 1000, 1)
+    _phase_started = now
+
+startup_phase("imports")
+
+# Static files are served from memory by StaticAssets rather than Flask's own route
+app = Flask(__name__, static_folder=None)
+STATIC_FOLDER = os.path.join(app.root_path, "static")
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if SHARED_VAULT and request.method == "GET":
+        # Read your writes even when they were made through another worker
+        vault_follower.poll()
+
+@app.after_request
+def observe_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        # The route template, not the path, so post ids don't each become a series
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route,
+                                             method=request.method, status=response.status_code)
+    return response
+
+DATA_FILE = "vault/posts.json"  # legacy snapshot history, imported into the event log
+CHECKPOINT_INTERVAL = int(os.getenv("CHECKPOINT_INTERVAL", 1000))  # events between checkpoints
+NOTIF_FILE = "vault/notifications.json"  # legacy list, imported into the notification store
+NOTIF_RETENTION = int(os.getenv("NOTIFICATION_RETENTION", 500))
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")  # json or sqlite
+REPLY_QUEUE_FILE = "vault/reply_queue.jsonl"
+LEADER_LOCK_FILE = "vault/leader.lock"
+# How often each worker looks for writes made by the others
+VAULT_FOLLOW_INTERVAL = float(os.getenv("VAULT_FOLLOW_INTERVAL_MS", 50)) / 1000
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", 30))
+COMPACTION_INTERVAL = float(os.getenv("COMPACTION_INTERVAL", 3600))  # seconds, 0 disables
+COMPACTION_DROP_LEGACY = os.getenv("COMPACTION_DROP_LEGACY", "False").lower() == "true"
+# JSON responses of at least JSON_COMPRESS_MIN_BYTES are compressed at this gzip level
+JSON_COMPRESS_MIN_BYTES = int(os.getenv("JSON_COMPRESS_MIN_BYTES", 1024))
+JSON_COMPRESS_LEVEL = int(os.getenv("JSON_COMPRESS_LEVEL", 5))
+SEARCH_INDEX_FILE = "vault/search_index.brdv"
+SEARCH_SCAN_LIMIT = int(os.getenv("SEARCH_SCAN_LIMIT", 5000))  # postings scored per query
+SEARCH_SAVE_INTERVAL = int(os.getenv("SEARCH_SAVE_INTERVAL", 1000))  # new posts between index saves
+
+# Server-Sent Events are served from their own asyncio listener on STREAM_PORT
+STREAM_HOST = os.getenv("STREAM_HOST", "0.0.0.0")
+STREAM_PORT = int(os.getenv("STREAM_PORT", 5001))
+STREAM_URL = os.getenv("STREAM_URL")  # public URL of the stream, if proxied
+# Origins whose pages may read the stream; by default pages served from the same host
+STREAM_ALLOWED_ORIGINS = [o.strip() for o in os.getenv("STREAM_ALLOWED_ORIGINS", "").split(",") if o.strip()]
+# AI replies are pushed to clients while they are generated, at most one update per interval
+STREAM_AI_REPLIES = os.getenv("STREAM_AI_REPLIES", "True").lower() == "true"
+REPLY_DELTA_INTERVAL = float(os.getenv("REPLY_DELTA_INTERVAL_MS", 100)) / 1000
+
+# Initialize LLM integration; the provider is checked in the background so
+# startup never waits on the network
 try:
     llm = LLMIntegration()
-    logger.info(f"LLM Integration initialized successfully")
+    llm.start_validation(retry_interval=float(os.getenv("LLM_VALIDATION_RETRY_SECONDS", 60)))
+    logger.info(f"LLM Integration initialized, validating {llm.model} in the background")
 except Exception as e:
     logger.error(f"Failed to initialize LLM: {e}")
     llm = None
+startup_phase("llm_setup")
 
 # Ensure directories exist
 os.makedirs("vault", exist_ok=True)
 os.makedirs("static", exist_ok=True)
 
-if not os.path.exists(DATA_FILE):
-    with open(DATA_FILE, "w") as f:
-        json.dump([], f)
-
-if not os.path.exists(NOTIF_FILE):
-    with open(NOTIF_FILE, "w") as f:
-        json.dump([], f)
-
-if not os.path.exists(SETTINGS_FILE):
-    with open(SETTINGS_FILE, "w") as f:
-        json.dump({"notifications_enabled": True}, f)
+storage = Storage(
+    STORAGE_BACKEND,
+    "vault",
+    notification_retention=NOTIF_RETENTION,
+    commit_batch=int(os.getenv("COMMIT_MAX_BATCH", 256)),
+    commit_latency=float(os.getenv("COMMIT_MAX_LATENCY_MS", 2)) / 1000,
+    shared=SHARED_VAULT
+)
+event_log = storage.event_log
+with storage.lock:
+    # Another worker may have migrated it first
+    event_log.follow()
+    if event_log.is_empty() and os.path.exists(DATA_FILE):
+        logger.info(f"Migrating legacy history from {DATA_FILE} to the {STORAGE_BACKEND} event log")
+        event_log.import_history(DATA_FILE)
+checkpoints = storage.checkpoints
+startup_phase("storage")
+# With a shared vault only the leader writes checkpoints
+post_store = PostStore(event_log, checkpoints, CHECKPOINT_INTERVAL, write_checkpoints=not SHARED_VAULT)
+startup_phase("post_store")
+change_feed = ChangeFeed(allowed_origins=STREAM_ALLOWED_ORIGINS)
+
+def publish_post_change(event, post):
+    if event["type"] == LIKE_TOGGLED:
+        # Subscribers work out likedByMe for themselves from who toggled
+        change_feed.publish("like-changed", {
+            "revision": event["seq"],
+            "post": post,
+            "user": event["data"]["user"],
+            "liked": event["data"]["liked"]
+        })
+    else:
+        change_feed.publish("post-created", {"revision": event["seq"], "post": post})
+
+post_store.add_listener(publish_post_change)
+
+# The search index is saved in the vault, so only posts newer than the saved
+# copy are indexed at startup; with a shared vault only the leader saves it
+search_index = SearchIndex(SEARCH_INDEX_FILE, SEARCH_SCAN_LIMIT, SEARCH_SAVE_INTERVAL, write=not SHARED_VAULT)
+if search_index.load() and post_store.get(search_index.last_id) is None:
+    logger.warning(f"Search index reaches post {search_index.last_id}, which the feed does not have; reindexing")
+    search_index.clear()
+logger.info(f"Indexed {search_index.add_all(post_store.posts_after(search_index.last_id))} posts for search")
+
+def index_post(event, post):
+    if event["type"] != LIKE_TOGGLED:
+        search_index.add(post)
+
+post_store.add_listener(index_post)
+startup_phase("search_index")
+
+notification_store = storage.notification_store
+with storage.lock:
+    notification_store.follow()
+    if notification_store.last_id == 0 and os.path.exists(NOTIF_FILE):
+        logger.info(f"Migrating legacy notifications from {NOTIF_FILE}")
+        notification_store.import_legacy(NOTIF_FILE)
+
+def follow_vault():
+    """Apply what other workers wrote to this one's caches and tell this worker's subscribers"""
+    post_store.follow()
+    for notif in notification_store.follow():
+        change_feed.publish("notification-added", notif)
+
+vault_follower = None
+if SHARED_VAULT:
+    # Every write starts from the latest state, and idle workers poll for changes
+    storage.lock.on_acquire.append(follow_vault)
+    vault_follower = Follower(storage.lock, follow_vault, VAULT_FOLLOW_INTERVAL)
+startup_phase("vault_files")
 
 def load_settings():
-    try:
-        with open(SETTINGS_FILE, "r") as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"Error loading settings: {e}")
-        return {"notifications_enabled": True}
+    return storage.settings.get()
 
 def save_settings(settings):
     try:
-        with open(SETTINGS_FILE, "w") as f:
-            json.dump(settings, f, indent=2)
+        with metrics.STORAGE_SECONDS.time(operation="settings_save"):
+            storage.settings.save(settings)
     except Exception as e:
         logger.error(f"Error saving settings: {e}")
 
-def load_notifications():
-    try:
-        with open(NOTIF_FILE, "r") as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"Error loading notifications: {e}")
-        return []
-
-def save_notifications(notifs):
-    try:
-        with open(NOTIF_FILE, "w") as f:
-            json.dump(notifs, f, indent=2)
-    except Exception as e:
-        logger.error(f"Error saving notifications: {e}")
-
 def add_notification(message, post_id=None):
-    notifs = load_notifications()
-    notif = {
-        "id": max((n["id"] for n in notifs), default=0) + 1,
-        "message": message,
-        "post_id": post_id,
-        "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
-        "seen": False
-    }
-    notifs.append(notif)
-    save_notifications(notifs)
+    notif = notification_store.add(message, post_id)
+    change_feed.publish("notification-added", notif)
     logger.info(f"Added notification: {message}")
 
-# Load full history (list of snapshots)
-def load_history():
-    try:
-        with open(DATA_FILE, "r") as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error(f"Error loading history: {e}")
-        return []
-
-# Get latest snapshot (returns list of flat messages)
+# Get latest state (returns list of flat messages)
 def get_latest_state():
-    history = load_history()
-    return history[-1]["messages"] if history else []
+    return post_store.all_posts()
 
-# Save new snapshot of messages
-def save_snapshot(messages):
-    try:
-        history = load_history()
-        snapshot = {
-            "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
-            "messages": messages
-        }
-        history.append(snapshot)
-        with open(DATA_FILE, "w") as f:
-            json.dump(history, f, indent=2)
-    except Exception as e:
-        logger.error(f"Error saving snapshot: {e}")
-
-def get_conversation_context(parent_id, messages):
-    """Get conversation context for a thread"""
+def get_conversation_context(parent_id, exclude_id=None):
+    """Get the thread around a post, oldest first, and its root id"""
     if not parent_id:
-        return []
-    
-    # Find the root post and all replies in the thread
-    thread_messages = []
-    
-    # Find root post
-    root_post = None
-    for msg in messages:
-        if msg["id"] == parent_id:
-            root_post = msg
-            break
-        elif msg.get("parentId") == parent_id:
-            # This is a reply to the parent
-            continue
-    
-    # If parent_id is actually a reply, find the real root
-    if root_post and root_post.get("parentId"):
-        return get_conversation_context(root_post["parentId"], messages)
-    
-    # Collect all messages in this thread
-    def collect_thread(post_id):
-        thread = []
-        for msg in messages:
-            if msg["id"] == post_id or msg.get("parentId") == post_id:
-                thread.append(msg)
-        return thread
-    
-    if root_post:
-        thread_messages = collect_thread(root_post["id"])
-    
-    return sorted(thread_messages, key=lambda x: x["createdWhen"])
+        return [], None
+
+    root_id = post_store.root_of(parent_id)
+    if root_id is None:
+        return [], None
+
+    # Threads are kept in creation order, so there is nothing to sort
+    return [post for post in post_store.thread(root_id) if post["id"] != exclude_id], root_id
 
 def should_ai_reply(post, parent_id=None):
     """Determine if AI should reply based on new logic"""
-    if not llm:
+    if not llm or not llm.is_available:
         return False, None
     
     # If this is a reply to an AI post, only that AI should respond
     if parent_id:
-        messages = get_latest_state()
-        parent_post = next((msg for msg in messages if msg["id"] == parent_id), None)
+        parent_post = post_store.get(parent_id)
         if parent_post and parent_post.get("isAI"):
             # Only the same AI personality should respond
             target_personality = parent_post.get("createdBy")
@@ -177,8 +239,7 @@ def should_ai_reply(post, parent_id=None):
 
 def schedule_ai_reply(post_id, post_content, user_name, parent_id=None):
     """Schedule an AI reply with improved logic"""
-    messages = get_latest_state()
-    current_post = next((msg for msg in messages if msg["id"] == post_id), None)
+    current_post = post_store.get(post_id)
     if not current_post:
         return
     
@@ -190,52 +251,118 @@ def schedule_ai_reply(post_id, post_content, user_name, parent_id=None):
     delay = llm.get_shorter_delay()
     logger.info(f"Scheduling AI reply for post {post_id} by {personality.name} in {delay} seconds")
     
-    def create_delayed_reply():
-        time.sleep(delay)
-        try:
-            messages = get_latest_state()
-            
-            # Get conversation context
-            context = get_conversation_context(parent_id or post_id, messages)
-            
-            # Generate reply
-            reply_content = llm.generate_reply(
-                personality=personality,
-                post_content=post_content,
-                conversation_context=context,
-                user_name=user_name
-            )
-            
-            # Create the AI reply
-            new_id = max((m["id"] for m in messages), default=0) + 1
-            now = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
-            
-            ai_post = {
-                "id": new_id,
-                "parentId": parent_id or post_id,
-                "createdBy": personality.name,
-                "createdWhen": now,
-                "updatedWhen": now,
-                "content": reply_content,
-                "likes": [],
-                "isAI": True,
-                "aiPersonality": personality.style
-            }
-            
-            messages.append(ai_post)
-            save_snapshot(messages)
-            
-            # Add notification
-            add_notification(f"{personality.name} replied to your post", post_id)
-            
-            logger.info(f"AI reply created by {personality.name}: {reply_content}")
-            
-        except Exception as e:
-            logger.error(f"Error creating delayed AI reply: {e}")
+    # With several workers only the leader runs replies; the journal carries the job to it
+    reply_scheduler.schedule({
+        "post_id": post_id,
+        "parent_id": parent_id,
+        "post_content": post_content,
+        "user_name": user_name,
+        "personality": personality.name
+    }, delay)
+
+async def commit_ai_reply(content, personality, parent_id):
+    """Store a finished AI reply; file writes happen off the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(None, lambda: post_store.create_post(
+        content=content,
+        created_by=personality.name,
+        parent_id=parent_id,
+        ai_personality=personality.style
+    ))
+
+async def stream_ai_reply(job, personality, context, root_id):
+    """Generate a reply while pushing the text so far to clients as a draft, then commit it.
+
+    Only the finished reply is stored; the draft events (reply-started,
+    reply-delta and reply-done) exist only on the change feed.
+    """
+    parent_id = job["parent_id"] or job["post_id"]
+    draft_id = f"{job['post_id']}-{personality.name}-{time.time_ns()}"
+    change_feed.publish("reply-started", {
+        "draftId": draft_id,
+        "parentId": parent_id,
+        "createdBy": personality.name,
+        "aiPersonality": personality.style
+    })
+    parts = []
+    last_push = 0.0
+
+    def on_delta(delta):
+        nonlocal last_push
+        parts.append(delta)
+        now = time.monotonic()
+        # Each update carries the whole text so far, so a client that missed one is not out of step
+        if now - last_push >= REPLY_DELTA_INTERVAL:
+            last_push = now
+            change_feed.publish("reply-delta", {"draftId": draft_id, "content": "".join(parts)})
+
+    reply = None
+    try:
+        content = await llm.generate_reply_stream(
+            personality=personality,
+            post_content=job["post_content"],
+            on_delta=on_delta,
+            conversation_context=context,
+            user_name=job["user_name"],
+            thread_id=root_id
+        )
+        reply = await commit_ai_reply(content, personality, parent_id)
+    finally:
+        # The committed post has already gone out as post-created; this retires the draft
+        change_feed.publish("reply-done", {"draftId": draft_id, "postId": reply["id"] if reply else None})
+    return content
+
+async def create_ai_reply(job):
+    """Generate and commit a scheduled AI reply"""
+    if not llm:
+        logger.warning(f"Dropping AI reply for post {job['post_id']}: AI integration disabled")
+        return
+
+    personality = next((p for p in llm.personalities if p.name == job["personality"]), None)
+    if not personality:
+        logger.warning(f"Dropping AI reply for post {job['post_id']}: unknown personality {job['personality']}")
+        return
+
+    post_id = job["post_id"]
+    parent_id = job["parent_id"]
+
+    # Get conversation context; the post being answered is added to the prompt separately
+    context, root_id = get_conversation_context(parent_id or post_id, exclude_id=post_id)
+    
+    # Generate the reply; only the finished text is stored
+    if STREAM_AI_REPLIES:
+        reply_content = await stream_ai_reply(job, personality, context, root_id)
+    else:
+        reply_content = await llm.generate_reply_async(
+            personality=personality,
+            post_content=job["post_content"],
+            conversation_context=context,
+            user_name=job["user_name"],
+            thread_id=root_id
+        )
+        await commit_ai_reply(reply_content, personality, parent_id or post_id)
     
-    # Start the delayed reply in a separate thread
-    thread = threading.Thread(target=create_delayed_reply, daemon=True)
-    thread.start()
+    # Add notification
+    await asyncio.get_running_loop().run_in_executor(
+        None, add_notification, f"{personality.name} replied to your post", post_id
+    )
+    
+    logger.info(f"AI reply created by {personality.name}: {reply_content}")
+
+reply_scheduler = ReplyScheduler(
+    REPLY_QUEUE_FILE,
+    create_ai_reply,
+    max_concurrency=int(os.getenv("AI_REPLY_CONCURRENCY", 4)),
+    poll_interval=float(os.getenv("REPLY_QUEUE_POLL_MS", 500)) / 1000 if SHARED_VAULT else None
+)
+
+compactor = Compactor(
+    event_log,
+    checkpoints,
+    notification_store=notification_store,
+    reply_scheduler=reply_scheduler,
+    retention_days=HISTORY_RETENTION_DAYS,
+    legacy_files=[DATA_FILE, NOTIF_FILE] if COMPACTION_DROP_LEGACY else None
+)
 
 @app.route("/api/settings", methods=["GET"])
 def get_settings():
@@ -253,25 +380,163 @@ def update_settings():
 
 @app.route("/api/notifications", methods=["GET"])
 def get_notifications():
-    return jsonify(load_notifications())
+    """Get notifications for a reader.
+
+    With ``since_id`` only newer notifications are returned, together with
+    the reader's unread count and seen watermark; without it the full
+    retained list is returned.
+    """
+    reader = request.args.get("user", "anonymous")
+    since_id = request.args.get("since_id", type=int)
+    if since_id is None:
+        return jsonify(notification_store.since(0, reader))
+
+    return jsonify({
+        "notifications": notification_store.since(since_id, reader),
+        "unread": notification_store.unread_count(reader),
+        "seenUpTo": notification_store.seen_up_to(reader),
+        "lastId": notification_store.last_id
+    })
 
 @app.route("/api/notifications/mark-seen", methods=["POST"])
 def mark_notifications_seen():
     """Mark notifications as seen"""
     try:
-        notifs = load_notifications()
-        for notif in notifs:
-            notif["seen"] = True
-        save_notifications(notifs)
-        return jsonify({"success": True})
+        data = request.get_json(silent=True) or {}
+        watermark = notification_store.mark_seen(data.get("user", "anonymous"), data.get("upTo"))
+        return jsonify({"success": True, "seenUpTo": watermark})
     except Exception as e:
         logger.error(f"Error marking notifications as seen: {e}")
         return jsonify({"error": str(e)}), 500
 
+def mark_liked(posts, user):
+    """Add likedByMe for the requesting user to each post"""
+    liked = post_store.liked_by(user, [post["id"] for post in posts]) if user else set()
+    for post in posts:
+        post["likedByMe"] = post["id"] in liked
+    return posts
+
 @app.route("/api/posts", methods=["GET"])
 def get_posts():
-    messages = get_latest_state()
-    return jsonify(messages)
+    """Get posts: everything, changes since a revision, or a page of threads.
+
+    ``since=<revision>`` returns only posts created or changed after that
+    revision; ``limit`` (and ``cursor`` from a previous page) returns whole
+    threads, newest first. Both forms answer with the current revision so the
+    client can ask for deltas next time. Posts carry ``likeCount``, and
+    ``likedByMe`` for the ``user`` given in the query.
+    """
+    since = request.args.get("since", type=int)
+    limit = request.args.get("limit", type=int)
+    cursor = request.args.get("cursor", type=int)
+    user = request.args.get("user")
+
+    # The revision identifies the response for a given URL, so conditional
+    # requests can be answered before any posts are copied or encoded
+    revision = post_store.revision
+    etag = f"r{revision}"
+    if etag_matches(request, etag):
+        response = app.response_class(status=304)
+    elif since is not None:
+        posts = mark_liked(post_store.changes_since(since), user)
+        response = jsonify({"revision": revision, "posts": posts})
+    elif limit is not None or cursor is not None:
+        posts, next_cursor = post_store.thread_page(cursor, min(max(limit or 20, 1), 100))
+        response = jsonify({"revision": revision, "posts": mark_liked(posts, user), "nextCursor": next_cursor})
+    else:
+        response = jsonify(mark_liked(get_latest_state(), user))
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def mark_liked_tree(threads, user):
+    """mark_liked for nested threads, every reply included"""
+    posts, stack = [], list(threads)
+    while stack:
+        post = stack.pop()
+        posts.append(post)
+        stack.extend(post["replies"])
+    mark_liked(posts, user)
+    return threads
+
+@app.route("/api/threads", methods=["GET"])
+def get_threads():
+    """Get a page of threads, newest first, without their full replies.
+
+    Each thread is its root post with ``replyCount``, ``lastActivity`` and the
+    first ``replies`` replies (default 3) nested under their parents; fetch
+    ``/api/threads/<id>`` for the rest. ``cursor`` comes from ``nextCursor``
+    of the previous page.
+    """
+    limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
+    replies = min(max(request.args.get("replies", 3, type=int), 0), 100)
+    cursor = request.args.get("cursor", type=int)
+    user = request.args.get("user")
+
+    revision = post_store.revision
+    etag = f"r{revision}"
+    if etag_matches(request, etag):
+        response = app.response_class(status=304)
+    else:
+        threads, next_cursor = post_store.threads_page(cursor, limit, replies)
+        response = jsonify({"revision": revision, "threads": mark_liked_tree(threads, user),
+                            "nextCursor": next_cursor})
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/api/threads/<int:post_id>", methods=["GET"])
+def get_thread(post_id):
+    """Get the whole thread containing a post, nested from its root"""
+    revision = post_store.revision
+    etag = f"r{revision}"
+    if etag_matches(request, etag):
+        response = app.response_class(status=304)
+    else:
+        thread = post_store.thread_tree(post_id)
+        if thread is None:
+            return jsonify({"error": "Post not found"}), 404
+        mark_liked_tree([thread], request.args.get("user"))
+        response = jsonify({"revision": revision, "thread": thread})
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/api/search", methods=["GET"])
+def search_posts():
+    """Full-text search over post content and authors, best match first.
+
+    ``q`` is required; ``author``, ``isAI`` (true/false) and ``personality``
+    filter the results, and ``offset``/``limit`` page through them. Each post
+    carries its ``score``.
+    """
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "Query parameter 'q' is required"}), 400
+    is_ai = request.args.get("isAI")
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
+
+    hits, total = search_index.search(
+        query,
+        author=request.args.get("author"),
+        is_ai=is_ai.lower() == "true" if is_ai is not None else None,
+        personality=request.args.get("personality"),
+        offset=offset,
+        limit=limit
+    )
+    results = []
+    for post_id, score in hits:
+        post = post_store.get(post_id)
+        if post is not None:
+            post["score"] = score
+            results.append(post)
+    next_offset = offset + len(hits) if offset + len(hits) < total else None
+    return jsonify({"query": query, "total": total, "results": mark_liked(results, request.args.get("user")),
+                    "nextOffset": next_offset})
 
 @app.route("/api/posts", methods=["POST"])
 def create_post():
@@ -282,28 +547,20 @@ def create_post():
 
     if not content:
         return jsonify({"error": "Content is required"}), 400
+    if parent_id is not None and type(parent_id) is not int:
+        return jsonify({"error": "parentId must be a post id"}), 400
 
-    messages = get_latest_state()
-    new_id = max((m["id"] for m in messages), default=0) + 1
-    now = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
-
-    new_post = {
-        "id": new_id,
-        "parentId": parent_id,
-        "createdBy": created_by or "anonymous",
-        "createdWhen": now,
-        "updatedWhen": now,
-        "content": content,
-        "likes": [],
-        "isAI": False
-    }
-
-    messages.append(new_post)
-    save_snapshot(messages)
+    try:
+        new_post = post_store.create_post(content, created_by or "anonymous", parent_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error creating post: {e}")
+        return jsonify({"error": str(e)}), 500
     
     # Schedule potential AI reply
     if llm:
-        schedule_ai_reply(new_id, content, created_by, parent_id)
+        schedule_ai_reply(new_post["id"], content, created_by, parent_id)
     
     return jsonify(new_post), 201
 
@@ -313,52 +570,195 @@ def like_post(post_id):
     data = request.json
     user = data.get("user", "anonymous")
     
-    messages = get_latest_state()
-    
-    for message in messages:
-        if message["id"] == post_id:
-            likes = message.get("likes", [])
-            if user in likes:
-                likes.remove(user)
-                action = "unliked"
-            else:
-                likes.append(user)
-                action = "liked"
-            message["likes"] = likes
-            save_snapshot(messages)
-            return jsonify({"success": True, "action": action, "likes": len(likes)})
+    try:
+        result = post_store.toggle_like(post_id, user)
+    except Exception as e:
+        logger.error(f"Error toggling like: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    if result:
+        action, count = result
+        return jsonify({"success": True, "action": action, "likeCount": count, "likedByMe": action == "liked"})
     
     return jsonify({"error": "Post not found"}), 404
 
+@app.route("/api/posts/<int:post_id>/likes", methods=["GET"])
+def get_post_likes(post_id):
+    """Page through the users who liked a post, oldest like first"""
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = min(max(request.args.get("limit", 100, type=int), 1), 1000)
+    result = post_store.likers(post_id, offset, limit)
+    if result is None:
+        return jsonify({"error": "Post not found"}), 404
+
+    users, total = result
+    next_offset = offset + len(users) if offset + len(users) < total else None
+    return jsonify({"postId": post_id, "likeCount": total, "users": users, "nextOffset": next_offset})
+
+@app.route("/api/stream", methods=["GET"])
+def stream_changes():
+    """Point EventSource clients at the change feed listener"""
+    url = STREAM_URL or f"{request.scheme}://{request.host.rsplit(':', 1)[0]}:{STREAM_PORT}/api/stream"
+    if request.query_string:
+        url += "?" + request.query_string.decode("latin-1")
+    return redirect(url, code=307)
+
+def parse_time_arg(name):
+    """Parse an optional ISO 8601 query argument, raising ValueError if malformed"""
+    value = request.args.get(name)
+    return parse_timestamp(value) if value else None
+
 @app.route("/api/history", methods=["GET"])
 def get_history():
-    return jsonify(load_history())
+    """Stream the event history as NDJSON, optionally bounded by from/to timestamps"""
+    try:
+        start = parse_time_arg("from")
+        end = parse_time_arg("to")
+    except ValueError as e:
+        return jsonify({"error": f"Invalid timestamp: {e}"}), 400
+
+    def generate():
+        for event in events_between(event_log, checkpoints, start, end):
+            yield json.dumps(event, separators=(",", ":")) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+@app.route("/api/state", methods=["GET"])
+def get_state():
+    """Rebuild the feed as it was at a given moment"""
+    try:
+        at = parse_time_arg("at")
+    except ValueError as e:
+        return jsonify({"error": f"Invalid timestamp: {e}"}), 400
+    if at is None:
+        return jsonify({"error": "Query parameter 'at' is required"}), 400
+
+    try:
+        revision, posts = state_at(event_log, checkpoints, at)
+    except HistoryCompacted as e:
+        return jsonify({"error": str(e)}), 410
+    return jsonify({"at": request.args["at"], "revision": revision, "posts": posts})
+
+@app.route("/api/storage-status", methods=["GET"])
+def get_storage_status():
+    """Storage backend and group commit throughput"""
+    return jsonify({
+        "backend": storage.backend,
+        "revision": post_store.revision,
+        "search": search_index.stats(),
+        "commits": {
+            "events": event_log.commits.stats(),
+            "notifications": notification_store.commits.stats()
+        },
+        "workers": {
+            "count": WORKERS,
+            "pid": os.getpid(),
+            "leader": leader_election.is_leader,
+            "lock": storage.lock.stats() if SHARED_VAULT else None
+        }
+    })
 
 @app.route("/api/ai-status", methods=["GET"])
 def get_ai_status():
     """Get AI integration status"""
     return jsonify({
-        "enabled": llm is not None,
+        "enabled": llm is not None and llm.is_available,
+        "state": llm.status if llm else "not_configured",
+        "model": llm.model if llm else None,
+        "models": llm.models if llm else [],
+        "last_error": llm.last_error if llm else None,
+        "last_checked": llm.last_checked if llm else None,
         "personalities": [p.name for p in llm.personalities] if llm else [],
-        "provider": os.getenv("LLM_PROVIDER", "not_configured")
+        "provider": os.getenv("LLM_PROVIDER", "not_configured"),
+        "scheduler": reply_scheduler.status(),
+        "cache": llm.cache.stats() if llm else None,
+        "context": llm.context.stats() if llm else None,
+        "client": llm.client.stats() if llm else None,
+        "streaming": llm.stream_stats() if llm else None,
+        "routing": llm.router.stats() if llm else None
     })
 
+def collect_gauges():
+    """Refresh the gauges that are read on demand at scrape time"""
+    metrics.AI_REPLIES_PENDING.set(reply_scheduler.status()["pending"])
+    metrics.VAULT_FILE_BYTES.clear()
+    with os.scandir("vault") as entries:
+        for entry in entries:
+            if entry.is_file():
+                metrics.VAULT_FILE_BYTES.set(entry.stat().st_size, file=entry.name)
+            elif entry.is_dir():
+                # Directories (checkpoints, reply cache) are reported as one total
+                total = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                metrics.VAULT_FILE_BYTES.set(total, file=entry.name + "/")
+
+metrics.REGISTRY.add_collector(collect_gauges)
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Prometheus text exposition of request, storage and LLM metrics"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+static_assets = StaticAssets(STATIC_FOLDER, watch=os.getenv("FLASK_DEBUG", "False").lower() == "true")
+json_compressor = JSONCompressor(JSON_COMPRESS_MIN_BYTES, JSON_COMPRESS_LEVEL)
+startup_phase("static_assets")
+
+@app.after_request
+def compress_json(response):
+    return json_compressor(request, response)
+
 @app.route("/")
 def serve_frontend():
-    return send_from_directory(app.static_folder, "index.html")
+    return static_assets.response(request, "index.html") or ("index.html is missing", 404)
 
 @app.route("/static/<path:filename>")
 def serve_static(filename):
-    return send_from_directory(app.static_folder, filename)
+    """Static files by plain name (revalidated) or content-hashed name (cached for good)"""
+    return static_assets.response(request, filename) or ("Not found", 404)
+
+startup_phase("routes")
+logger.info(f"Startup took {sum(startup_timings.values()):.1f} ms: " +
+            ", ".join(f"{name}={ms} ms" for name, ms in startup_timings.items()))
+
+def start_leader_services():
+    """Start what must run in exactly one process per vault"""
+    post_store.write_checkpoints = True
+    search_index.write = True
+    reply_scheduler.start()
+    if COMPACTION_INTERVAL > 0:
+        compactor.start(COMPACTION_INTERVAL)
+
+leader_election = LeaderElection(LEADER_LOCK_FILE, start_leader_services)
+
+def start_background_services():
+    """Start the listeners and workers that run alongside the Flask app"""
+    started = time.perf_counter()
+    change_feed.start_server(STREAM_HOST, STREAM_PORT, reuse_port=SHARED_VAULT)
+    if SHARED_VAULT:
+        vault_follower.start()
+    # A single process is always the leader
+    leader_election.start()
+    startup_timings["background_services"] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info(f"Background services started in {startup_timings['background_services']} ms")
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5000))
     debug = os.getenv("FLASK_DEBUG", "False").lower() == "true"
     
+    # With the debug reloader only the child process serves requests
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_services()
+
     logger.info(f"Starting Flask app on port {port}")
     if llm:
-        logger.info("AI personalities ready to engage!")
+        logger.info("AI personalities will engage once the provider is validated")
     else:
         logger.warning("AI integration disabled - check your environment variables")
     
-    app.run(debug=debug, host="0.0.0.0", port=port)
\ No newline at end of file
+    if SHARED_VAULT:
+        from werkzeug.serving import make_server
+
+        # Every worker listens on the same port; the kernel balances connections between them
+        sock = workers.reuse_port_socket("0.0.0.0", port)
+        make_server("0.0.0.0", port, app, threaded=True, fd=sock.fileno()).serve_forever()
+    else:
+        app.run(debug=debug, host="0.0.0.0", port=port)
\ No newline at end of file
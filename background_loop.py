@@ -0,0 +1,27 @@
+import asyncio
+import threading
+import logging
+from concurrent.futures import Future
+from typing import Coroutine
+
+logger = logging.getLogger(__name__)
+
+_loop = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Get the shared asyncio loop, starting its thread on first use"""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="background-loop", daemon=True)
+            thread.start()
+            logger.info("Started background event loop")
+        return _loop
+
+
+def submit(coro: Coroutine) -> Future:
+    """Run a coroutine on the shared loop from any thread"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
@@ -0,0 +1,347 @@
+"""Load test for the feed and the AI reply pipeline against a seeded vault.
+
+Seeds a scratch vault with a legacy posts.json of --posts posts spread over
+--snapshots history snapshots (imported on startup, like a real upgrade),
+starts the app on a local port with the offline stub provider, and drives
+each scenario with --clients concurrent clients. Every scenario reports
+throughput, latency percentiles, memory and vault size, and the whole run is
+written as JSON so runs can be compared:
+
+    python benchmark.py --posts 5000 --output before.json
+    python benchmark.py --posts 5000 --output after.json --baseline before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.client import HTTPConnection
+from typing import Callable, Dict, List, Optional, Tuple
+
+SCENARIOS = ("get_posts", "search", "create_post", "like_post", "ai_reply")
+USERS = [f"user{i}" for i in range(50)]
+
+
+def seed_history(path: str, posts: int, snapshots: int, rng: random.Random):
+    """Write a legacy posts.json whose snapshots grow to ``posts`` posts with random likes"""
+    start = datetime.now(timezone.utc) - timedelta(days=7)
+    messages: List[Dict] = []
+    history = []
+    per_snapshot = max(1, posts // max(1, snapshots))
+    for index in range(max(1, snapshots)):
+        target = posts if index == snapshots - 1 else min(posts, (index + 1) * per_snapshot)
+        at = (start + timedelta(minutes=index)).isoformat().replace("+00:00", "Z")
+        while len(messages) < target:
+            post_id = len(messages) + 1
+            # About a third of posts are replies to a recent post
+            parent = rng.randint(max(1, post_id - 50), post_id - 1) if post_id > 1 and rng.random() < 0.3 else None
+            messages.append({
+                "id": post_id,
+                "parentId": parent,
+                "createdBy": rng.choice(USERS),
+                "createdWhen": at,
+                "updatedWhen": at,
+                "content": f"seeded post {post_id} " + " ".join(rng.choice(USERS) for _ in range(rng.randint(3, 30))),
+                "likes": [],
+                "isAI": False
+            })
+        for message in rng.sample(messages, min(len(messages), 10)):
+            message["likes"] = sorted(set(message["likes"]) | {rng.choice(USERS)})
+        history.append({"timestamp": at, "messages": [dict(m, likes=list(m["likes"])) for m in messages]})
+    with open(path, "w") as f:
+        json.dump(history, f)
+
+
+def rss_mb() -> float:
+    """Current resident memory, or the peak where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS bytes
+        return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def vault_sizes(vault: str) -> Dict[str, int]:
+    sizes = {}
+    for root, _, files in os.walk(vault):
+        for name in files:
+            path = os.path.join(root, name)
+            sizes[os.path.relpath(path, vault)] = os.path.getsize(path)
+    return sizes
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def summarize(name: str, latencies: List[float], errors: int, seconds: float, vault: str) -> Dict:
+    ordered = sorted(latencies)
+    sizes = vault_sizes(vault)
+    return {
+        "scenario": name,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "throughput_per_second": round(len(latencies) / seconds, 1) if seconds else 0.0,
+        "p50_ms": round(percentile(ordered, 0.5) * 1000, 2),
+        "p90_ms": round(percentile(ordered, 0.9) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        "rss_mb": rss_mb(),
+        "vault_bytes": sum(sizes.values()),
+        "files": sizes
+    }
+
+
+class Client:
+    """One keep-alive-less HTTP client per worker thread, like a browser tab"""
+
+    def __init__(self, port: int):
+        self.port = port
+
+    def request(self, method: str, path: str, body: Optional[Dict] = None) -> int:
+        conn = HTTPConnection("127.0.0.1", self.port, timeout=60)
+        try:
+            payload = json.dumps(body) if body is not None else None
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            conn.request(method, path, payload, headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
+
+
+def drive(port: int, clients: int, requests: int, make_request: Callable[[random.Random], Tuple[str, str, Optional[Dict]]],
+          seed: int) -> Tuple[List[float], int, float]:
+    """Send ``requests`` requests from ``clients`` threads; returns latencies, errors and wall time"""
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    per_client = [requests // clients + (1 if i < requests % clients else 0) for i in range(clients)]
+
+    def worker(index: int):
+        nonlocal errors
+        rng = random.Random(seed * 1000 + index)
+        client = Client(port)
+        mine = []
+        failed = 0
+        for _ in range(per_client[index]):
+            method, path, body = make_request(rng)
+            started = time.perf_counter()
+            try:
+                status = client.request(method, path, body)
+            except OSError:
+                status = 0
+            if 200 <= status < 300:
+                mine.append(time.perf_counter() - started)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors += failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(worker, range(clients)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def run_ai_replies(app_module, count: int, timeout: float) -> Tuple[List[float], int, float]:
+    """Schedule ``count`` replies due now and time each from scheduling to its committed post"""
+    post_ids = [p["id"] for p in app_module.post_store.all_posts() if not p.get("isAI")][-count:]
+    personalities = app_module.llm.personalities
+    scheduled: Dict[int, float] = {}
+    finished: Dict[int, float] = {}
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def on_post(event, post):
+        with lock:
+            if post.get("isAI") and post.get("parentId") in scheduled and post["parentId"] not in finished:
+                finished[post["parentId"]] = time.perf_counter()
+                if len(finished) == len(scheduled):
+                    done.set()
+
+    app_module.post_store.add_listener(on_post)
+    started = time.perf_counter()
+    for i, post_id in enumerate(post_ids):
+        post = app_module.post_store.get(post_id)
+        with lock:
+            scheduled[post_id] = time.perf_counter()
+        app_module.reply_scheduler.schedule({
+            "post_id": post_id,
+            "parent_id": None,
+            "post_content": post["content"],
+            "user_name": post["createdBy"],
+            "personality": personalities[i % len(personalities)].name
+        }, 0)
+    with lock:
+        if len(finished) == len(scheduled):
+            done.set()
+    done.wait(timeout)
+    seconds = time.perf_counter() - started
+    with lock:
+        latencies = [finished[i] - scheduled[i] for i in finished]
+    return latencies, len(scheduled) - len(latencies), seconds
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare(results: Dict, baseline_path: str):
+    """Print throughput and p99 changes against an earlier run"""
+    with open(baseline_path) as f:
+        baseline = {s["scenario"]: s for s in json.load(f)["scenarios"]}
+    for scenario in results["scenarios"]:
+        before = baseline.get(scenario["scenario"])
+        if not before:
+            continue
+        changes = []
+        for key in ("throughput_per_second", "p50_ms", "p99_ms", "rss_mb", "vault_bytes"):
+            if before[key]:
+                changes.append(f"{key} {(scenario[key] - before[key]) / before[key] * 100:+.1f}%")
+        print(f"{scenario['scenario']:<12} " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the feed and AI reply pipeline on a seeded vault")
+    parser.add_argument("--posts", type=int, default=1000, help="posts in the seeded vault (default: 1000)")
+    parser.add_argument("--snapshots", type=int, default=20, help="legacy history snapshots to seed (default: 20)")
+    parser.add_argument("--backend", default="json", help="storage backend: json or sqlite (default: json)")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients (default: 8)")
+    parser.add_argument("--requests", type=int, default=500, help="requests per HTTP scenario (default: 500)")
+    parser.add_argument("--replies", type=int, default=50, help="AI replies in the ai_reply scenario (default: 50)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated scenarios to run")
+    parser.add_argument("--llm-latency-ms", type=float, default=200, help="stub provider latency (default: 200)")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0, help="stub provider failure rate (default: 0)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default: 1)")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="earlier --output file to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch vault directory")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    # The app runs in the scratch directory, so resolve paths first
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="birdieee-bench-")
+    vault = os.path.join(workdir, "vault")
+    os.makedirs(vault)
+    seed_history(os.path.join(vault, "posts.json"), args.posts, args.snapshots, rng)
+    legacy_bytes = os.path.getsize(os.path.join(vault, "posts.json"))
+
+    # The app reads its configuration and the vault path when imported
+    os.environ.update({
+        "STORAGE_BACKEND": args.backend,
+        "LLM_STUB": "true",
+        "LLM_STUB_LATENCY_MS": str(args.llm_latency_ms),
+        "LLM_STUB_FAILURE_RATE": str(args.llm_failure_rate),
+        "LLM_STUB_SEED": str(args.seed),
+        "COMPACTION_INTERVAL": "0"
+    })
+    for name in ("LITELLM_MODEL", "LLM_MODELS"):
+        os.environ.pop(name, None)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    random.seed(args.seed)
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    import app as app_module
+    import_seconds = time.perf_counter() - started
+    app_module.start_background_services()
+    from werkzeug.serving import make_server
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="benchmark-server", daemon=True).start()
+    port = server.server_port
+    # Organic AI replies are scheduled 5-30 s out and would leak into later scenarios
+    app_module.llm.should_reply_randomly = lambda: False
+
+    post_count = len(app_module.post_store.all_posts())
+    results = {
+        "config": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "git_revision": git_revision(),
+            "started": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        },
+        "startup": {
+            "seconds": round(import_seconds, 3),
+            "phases_ms": dict(app_module.startup_timings),
+            "posts_loaded": post_count,
+            "legacy_history_bytes": legacy_bytes,
+            "rss_mb": rss_mb(),
+            "rss_growth_mb": round(rss_mb() - rss_before, 1)
+        },
+        "scenarios": []
+    }
+
+    def random_post_id(r: random.Random) -> int:
+        return r.randint(1, max(1, post_count))
+
+    requests = {
+        "get_posts": lambda r: ("GET", f"/api/posts?limit=20&user={r.choice(USERS)}", None),
+        # Seeded posts mention users, so user names make queries of every frequency
+        "search": lambda r: ("GET", f"/api/search?q={r.choice(USERS)}+{r.choice(USERS)}&user={r.choice(USERS)}", None),
+        "create_post": lambda r: ("POST", "/api/posts", {
+            "content": f"benchmark post {r.random():.6f}",
+            "createdBy": r.choice(USERS),
+            "parentId": random_post_id(r) if r.random() < 0.3 else None
+        }),
+        "like_post": lambda r: ("POST", f"/api/posts/{random_post_id(r)}/like", {"user": r.choice(USERS)})
+    }
+    try:
+        for name in scenarios:
+            if name == "ai_reply":
+                latencies, errors, seconds = run_ai_replies(app_module, args.replies, timeout=300)
+            else:
+                latencies, errors, seconds = drive(port, args.clients, args.requests, requests[name], args.seed)
+            summary = summarize(name, latencies, errors, seconds, vault)
+            results["scenarios"].append(summary)
+            print(f"{name:<12} {summary['throughput_per_second']:>8.1f}/s  p50 {summary['p50_ms']:>8.2f} ms  "
+                  f"p99 {summary['p99_ms']:>8.2f} ms  errors {errors}  rss {summary['rss_mb']} MB  "
+                  f"vault {summary['vault_bytes']} B")
+        results["ai"] = {
+            "client": app_module.llm.client.stats(),
+            "scheduler": app_module.reply_scheduler.status()
+        }
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+    if baseline:
+        compare(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import os
+import threading
+import logging
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+from background_loop import get_loop
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15
+MAX_REQUEST_BYTES = 8192
+
+
+class ChangeFeed:
+    """Buffer of recent change events, pushed to Server-Sent Events clients.
+
+    Every client connection is a coroutine on the shared background loop, so
+    idle subscribers cost a socket and a little memory rather than a thread.
+    The last ``buffer_size`` events are kept so clients that reconnect with
+    Last-Event-ID can resume; anyone further behind is told to reset.
+
+    Event ids carry a per-process prefix, so a client that reconnects to a
+    different worker (or after a restart) is told to reset rather than
+    resuming from a number that meant something else there.
+
+    The feed runs on its own port, so the page reads it cross-origin. Only
+    ``allowed_origins`` get CORS headers; without any, only pages served
+    from the same host as the feed do.
+    """
+
+    def __init__(self, buffer_size: int = 1000, allowed_origins: Optional[List[str]] = None):
+        self.instance = os.urandom(4).hex()
+        self.allowed_origins = set(allowed_origins or [])
+        self._events: deque = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self.last_id = 0
+        self.clients = 0
+        self._loop = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def publish(self, event_type: str, data: Dict):
+        """Record an event and wake up every connected client; safe from any thread"""
+        payload = json.dumps(data, separators=(",", ":"))
+        with self._lock:
+            self.last_id += 1
+            self._events.append((self.last_id, event_type, payload))
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._notify)
+
+    def _notify(self):
+        wakeup, self._wakeup = self._wakeup, asyncio.Event()
+        wakeup.set()
+
+    def since(self, last_id: int) -> Optional[List[Tuple[int, str, str]]]:
+        """Events after last_id, or None if they are no longer buffered"""
+        with self._lock:
+            if last_id > self.last_id:
+                # The client saw ids from before a restart
+                return None
+            oldest = self._events[0][0] if self._events else self.last_id + 1
+            if last_id < oldest - 1:
+                return None
+            newer = []
+            for event in reversed(self._events):
+                if event[0] <= last_id:
+                    break
+                newer.append(event)
+            newer.reverse()
+            return newer
+
+    def allows(self, origin: Optional[str], host: Optional[str]) -> bool:
+        """Whether a page from origin may read the feed, reached through the given Host header"""
+        if not origin:
+            return False
+        if self.allowed_origins:
+            return origin in self.allowed_origins
+        return bool(host) and urlsplit(origin).hostname == urlsplit(f"//{host}").hostname
+
+    def start_server(self, host: str, port: int, reuse_port: bool = False):
+        """Start serving /api/stream on the background loop; reuse_port lets several workers share the port"""
+        loop = get_loop()
+
+        async def start():
+            self._wakeup = asyncio.Event()
+            await asyncio.start_server(self._handle, host, port, reuse_port=reuse_port or None)
+
+        asyncio.run_coroutine_threadsafe(start(), loop).result()
+        # Set only once the wakeup event exists, since publish() schedules _notify on it from then on
+        self._loop = loop
+        logger.info(f"Change feed streaming on {host}:{port}")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=10)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        if len(head) > MAX_REQUEST_BYTES:
+            writer.close()
+            return
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            writer.close()
+            return
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        url = urlsplit(target)
+        origin = headers.get("origin")
+        cors = (f"Access-Control-Allow-Origin: {origin}\r\nVary: Origin\r\n"
+                if self.allows(origin, headers.get("host")) else "Vary: Origin\r\n")
+
+        if url.path != "/api/stream":
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        elif method == "OPTIONS":
+            writer.write((
+                "HTTP/1.1 204 No Content\r\n"
+                f"{cors}"
+                "Access-Control-Allow-Headers: Last-Event-ID, Cache-Control\r\n"
+                "Content-Length: 0\r\nConnection: close\r\n\r\n"
+            ).encode("latin-1"))
+        else:
+            last_event_id = headers.get("last-event-id") or parse_qs(url.query).get("lastEventId", [None])[0]
+            await self._stream(reader, writer, cors, last_event_id)
+        try:
+            writer.close()
+        except Exception:
+            pass
+
+    async def _stream(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, cors: str, last_event_id: Optional[str]):
+        writer.write((
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: text/event-stream\r\n"
+            "Cache-Control: no-cache\r\n"
+            "X-Accel-Buffering: no\r\n"
+            f"{cors}"
+            "Connection: close\r\n\r\n"
+            "retry: 3000\n\n"
+        ).encode("latin-1"))
+
+        last_id = self.last_id
+        if last_event_id:
+            instance, _, number = last_event_id.rpartition("-")
+            # An id from another process can't be resumed from; -1 makes since() ask for a reset
+            last_id = int(number) if instance == self.instance and number.isdigit() else -1
+
+        # EventSource never sends a body, so any read completing means the client went away
+        disconnected = asyncio.ensure_future(reader.read(1))
+        self.clients += 1
+        try:
+            while True:
+                wakeup = self._wakeup
+                events = self.since(last_id)
+                if events is None:
+                    # Too far behind to resume; the client reloads from the REST API
+                    last_id = self.last_id
+                    writer.write(f"id: {self.instance}-{last_id}\nevent: reset\ndata: {{}}\n\n".encode("utf-8"))
+                elif events:
+                    chunk = "".join(f"id: {self.instance}-{i}\nevent: {t}\ndata: {d}\n\n" for i, t, d in events)
+                    writer.write(chunk.encode("utf-8"))
+                    last_id = events[-1][0]
+                else:
+                    waiter = asyncio.ensure_future(wakeup.wait())
+                    done, _ = await asyncio.wait({waiter, disconnected}, timeout=HEARTBEAT_SECONDS,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    waiter.cancel()
+                    if disconnected in done:
+                        break
+                    if waiter in done:
+                        continue
+                    writer.write(b": keepalive\n\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            disconnected.cancel()
+            self.clients -= 1
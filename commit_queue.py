@@ -0,0 +1,158 @@
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+from metrics import STORAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Window over which mutations_per_second is measured
+RATE_WINDOW_SECONDS = 60
+
+
+class CommitQueue:
+    """Single writer thread that persists queued records in group commits.
+
+    Callers submit records in the order they must reach disk and get a
+    Future that resolves once ``flush`` has made the record durable (for
+    files: written and fsynced). The writer takes up to ``max_batch``
+    records per flush and waits at most ``max_latency`` seconds after the
+    oldest queued record for more to arrive, so one fsync covers every
+    mutation that queued up meanwhile.
+
+    Guarantees: records are flushed in submission order, a resolved Future
+    means the record and every record submitted before it are durable, and
+    if a flush fails every Future in that batch gets the exception.
+
+    Records queued behind a failed batch were numbered after it, so they
+    fail with it, and so does everything submitted until the owner has
+    rolled back to what is durable and calls reset().
+    """
+
+    def __init__(self, name: str, flush: Callable[[List], None], max_batch: int = 256, max_latency: float = 0.002):
+        self.name = name
+        self.flush = flush
+        # "events.jsonl" and the SQLite "events" queue report as the same operation
+        self._operation = f"{name.split('.')[0]}_commit"
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self._queue: deque = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        # The failure that stopped the queue, until reset()
+        self.error: Optional[Exception] = None
+        self.mutations = 0
+        self.batches = 0
+        self.failed = 0
+        self.largest_batch = 0
+        self._flush_seconds = 0.0
+        self._ack_seconds = 0.0
+        self._max_ack_seconds = 0.0
+        self._recent: deque = deque()
+        self._first_flush: Optional[float] = None
+
+    def submit(self, record) -> Future:
+        """Queue a record; the Future resolves when it is durable"""
+        future = Future()
+        with self._cond:
+            if self.error is not None:
+                future.set_exception(self.error)
+                return future
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"commit {self.name}", daemon=True)
+                self._thread.start()
+            self._queue.append((record, future, time.monotonic()))
+            self._cond.notify()
+        return future
+
+    def sync(self):
+        """Block until everything submitted so far is durable"""
+        with self._cond:
+            if not self._queue and self._thread is None:
+                return
+        # A barrier carries no record, so it resolves once the batches before it are flushed
+        self.submit(None).result()
+
+    def reset(self):
+        """Accept records again after a failed flush, once the owner has rolled back to what is durable"""
+        with self._cond:
+            self.error = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                deadline = self._queue[0][2] + self.max_latency
+                while len(self._queue) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+
+            records = [record for record, _, _ in batch if record is not None]
+            started = time.monotonic()
+            error = None
+            behind = []
+            if records:
+                try:
+                    self.flush(records)
+                except Exception as e:
+                    error = e
+                    with self._cond:
+                        self.error = e
+                        behind = list(self._queue)
+                        self._queue.clear()
+                    logger.error(f"Group commit of {len(records)} records to {self.name} failed, "
+                                 f"failing {len(behind)} queued behind it: {e}")
+            finished = time.monotonic()
+            if records:
+                STORAGE_SECONDS.observe(finished - started, operation=self._operation)
+
+            for record, future, queued in batch:
+                if record is not None:
+                    ack = finished - queued
+                    self._ack_seconds += ack
+                    self._max_ack_seconds = max(self._max_ack_seconds, ack)
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+            for _, future, _ in behind:
+                future.set_exception(error)
+            if records:
+                if self._first_flush is None:
+                    self._first_flush = started
+                self.batches += 1
+                self.mutations += len(records)
+                self.largest_batch = max(self.largest_batch, len(records))
+                self._flush_seconds += finished - started
+                if error is not None:
+                    self.failed += len(records) + sum(record is not None for record, _, _ in behind)
+                self._recent.append((finished, len(records)))
+                while self._recent and self._recent[0][0] < finished - RATE_WINDOW_SECONDS:
+                    self._recent.popleft()
+
+    def stats(self) -> Dict:
+        """Group commit sizes, fsync time and mutation throughput"""
+        now = time.monotonic()
+        recent = [count for at, count in list(self._recent) if at >= now - RATE_WINDOW_SECONDS]
+        window = min(RATE_WINDOW_SECONDS, now - self._first_flush) if self._first_flush else 0
+        acked = self.mutations or 1
+        return {
+            "mutations": self.mutations,
+            "batches": self.batches,
+            "failed": self.failed,
+            "queued": len(self._queue),
+            "avg_batch_size": round(self.mutations / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "avg_flush_ms": round(self._flush_seconds * 1000 / self.batches, 3) if self.batches else 0.0,
+            "avg_ack_ms": round(self._ack_seconds * 1000 / acked, 3),
+            "max_ack_ms": round(self._max_ack_seconds * 1000, 3),
+            "mutations_per_second": round(sum(recent) / window, 2) if window > 0 else 0.0,
+            "max_batch": self.max_batch,
+            "max_latency_ms": self.max_latency * 1000
+        }
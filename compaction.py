@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from event_log import EventLog, Checkpoints, apply_event, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+class Compactor:
+    """Shrinks the vault directory without stopping the app.
+
+    History older than ``retention_days`` is folded into a checkpoint and
+    dropped from the event log; older checkpoints go with it. The
+    notification log and reply queue journal are rewritten to just what is
+    still live, and legacy JSON files that have already been migrated can be
+    removed. Every rewrite goes to a temp file that is renamed into place,
+    and locks are only held for the final short copy, so requests keep being
+    served while a run is in progress.
+    """
+
+    def __init__(self, event_log: EventLog, checkpoints: Checkpoints, notification_store=None,
+                 reply_scheduler=None, retention_days: float = 30,
+                 legacy_files: Optional[List[str]] = None):
+        self.event_log = event_log
+        self.checkpoints = checkpoints
+        self.notification_store = notification_store
+        self.reply_scheduler = reply_scheduler
+        self.retention_days = retention_days
+        self.legacy_files = legacy_files or []
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.last_report: Optional[Dict] = None
+
+    def _fold_history(self, cutoff: datetime) -> Optional[Dict]:
+        """Checkpoint the state as of the last event before cutoff and return its index entry"""
+        entry = self.checkpoints.before(cutoff)
+        posts: Dict[int, Dict] = {}
+        revisions: "OrderedDict[int, int]" = OrderedDict()
+        seq, timestamp, offset = 0, None, 0
+        if entry is not None:
+            checkpoint = self.checkpoints.load(entry)
+            posts = {post["id"]: post for post in checkpoint["posts"]}
+            revisions.update((post_id, revision) for post_id, revision in checkpoint["revisions"])
+            seq, timestamp, offset = checkpoint["seq"], checkpoint["timestamp"], entry["offset"]
+        elif self.event_log.base > 0:
+            logger.warning("No checkpoint covers the compacted part of the event log, skipping history")
+            return None
+
+        for event, end in self.event_log.events_with_offsets(offset):
+            if parse_timestamp(event["timestamp"]) >= cutoff:
+                break
+            post = apply_event(posts, event)
+            if post is not None:
+                revisions[post["id"]] = event["seq"]
+                revisions.move_to_end(post["id"])
+            seq, timestamp, offset = event["seq"], event["timestamp"], end
+
+        if seq == 0:
+            return None
+        if entry is None or seq > entry["seq"]:
+            self.checkpoints.write(seq, timestamp, offset, list(posts.values()),
+                                   [[post_id, revision] for post_id, revision in revisions.items()])
+        return {"seq": seq, "offset": offset}
+
+    def _drop_legacy(self) -> int:
+        # Legacy files are only imported into an empty log, so once it has events they are dead weight
+        if self.event_log.is_empty():
+            return 0
+        reclaimed = 0
+        for path in self.legacy_files:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                reclaimed += size
+                logger.info(f"Removed migrated legacy file {path}")
+            except FileNotFoundError:
+                pass
+        return reclaimed
+
+    def run(self) -> Dict:
+        """Compact everything once and return bytes reclaimed per target and the time taken"""
+        with self._lock:
+            started = time.perf_counter()
+            reclaimed: Dict[str, int] = {}
+            cutoff = datetime.now(timezone.utc) - timedelta(days=self.retention_days)
+
+            steps = [("history", lambda: self._compact_history(cutoff))]
+            if self.notification_store is not None:
+                steps.append(("notifications", self.notification_store.compact))
+            if self.reply_scheduler is not None:
+                steps.append(("reply_queue", self.reply_scheduler.compact))
+            if self.legacy_files:
+                steps.append(("legacy", self._drop_legacy))
+
+            for name, step in steps:
+                try:
+                    reclaimed[name] = step()
+                except Exception as e:
+                    reclaimed[name] = 0
+                    logger.error(f"Error compacting {name}: {e}")
+
+            self.runs += 1
+            self.last_report = {
+                "reclaimed_bytes": sum(reclaimed.values()),
+                "reclaimed": reclaimed,
+                "seconds": round(time.perf_counter() - started, 3),
+                "finished": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+            }
+            logger.info(f"Compaction reclaimed {self.last_report['reclaimed_bytes']} bytes "
+                        f"in {self.last_report['seconds']} s: {reclaimed}")
+            return self.last_report
+
+    def _compact_history(self, cutoff: datetime) -> int:
+        fold = self._fold_history(cutoff)
+        if fold is None:
+            return 0
+        # Checkpoints first: the log must never lose events an indexed checkpoint still points before
+        reclaimed = self.checkpoints.drop_before(fold["seq"])
+        return reclaimed + self.event_log.drop_before(fold["offset"])
+
+    def start(self, interval: float):
+        """Run compaction every interval seconds on a daemon thread"""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.run()
+                except Exception as e:
+                    logger.error(f"Compaction failed: {e}")
+
+        threading.Thread(target=loop, name="compaction", daemon=True).start()
+        logger.info(f"Compaction scheduled every {interval:.0f} s, keeping {self.retention_days} days of history")
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from reply_scheduler import ReplyScheduler
+    from storage import Storage, BACKENDS
+
+    parser = argparse.ArgumentParser(description="Compact the vault directory (run while the app is stopped)")
+    parser.add_argument("--vault", default="vault", help="vault directory (default: vault)")
+    parser.add_argument("--backend", choices=BACKENDS, default=os.getenv("STORAGE_BACKEND", "json"),
+                        help="storage backend the vault uses")
+    parser.add_argument("--retention-days", type=float, default=float(os.getenv("HISTORY_RETENTION_DAYS", 30)),
+                        help="days of event history to keep replayable")
+    parser.add_argument("--drop-legacy", action="store_true",
+                        help="remove posts.json and notifications.json once they have been migrated")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    storage = Storage(args.backend, args.vault, int(os.getenv("NOTIFICATION_RETENTION", 500)))
+    legacy = [storage.path("posts.json")]
+    if storage.notification_store.last_id > 0:
+        legacy.append(storage.path("notifications.json"))
+    compactor = Compactor(
+        storage.event_log,
+        storage.checkpoints,
+        notification_store=storage.notification_store,
+        reply_scheduler=ReplyScheduler(storage.path("reply_queue.jsonl"), handler=None),
+        retention_days=args.retention_days,
+        legacy_files=legacy if args.drop_legacy else None
+    )
+    print(json.dumps(compactor.run(), indent=2))
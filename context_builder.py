@@ -0,0 +1,185 @@
+import re
+import threading
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Per-message overhead of the chat format (role markers and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_LINE_CHARS = 120
+MAX_CACHED_POST_TOKENS = 50000
+# Room for the summary's heading and its "earlier messages not shown" line
+SUMMARY_HEADER_TOKENS = 20
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) for when no tokenizer is available"""
+    return max(1, (len(text) + 3) // 4)
+
+
+def litellm_token_counter(model: str) -> Callable[[str], int]:
+    """Count tokens with litellm's tokenizer for model, falling back to estimate_tokens"""
+    def count(text: str) -> int:
+        try:
+            from litellm import token_counter
+            return token_counter(model=model, text=text)
+        except Exception:
+            return estimate_tokens(text)
+    return count
+
+
+def _summary_line(post: Dict) -> str:
+    content = " ".join(post.get("content", "").split())
+    first = _SENTENCE_END.split(content, 1)[0]
+    if len(first) > SUMMARY_LINE_CHARS:
+        first = first[:SUMMARY_LINE_CHARS - 1].rstrip() + "…"
+    return f"- {post.get('createdBy', 'User')}: {first}"
+
+
+class ContextBuilder:
+    """Fits a thread into a prompt token budget.
+
+    The most recent messages go in verbatim, newest first, until the budget
+    runs out. Everything older is represented by a summary: one extractive
+    line per message (author and first sentence), capped at
+    ``summary_tokens`` by dropping the oldest lines. Summaries are cached
+    per thread and only extended with the messages that slid out of the
+    window since the last reply, and token counts are cached per post since
+    posts never change.
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int] = estimate_tokens, budget: int = 1500,
+                 summary_tokens: int = 300, max_threads: int = 1000):
+        self.count_tokens = count_tokens
+        self.budget = budget
+        self.summary_tokens = summary_tokens
+        self.max_threads = max_threads
+        self._lock = threading.Lock()
+        self._post_tokens: "OrderedDict[int, int]" = OrderedDict()
+        # root id -> {"lines": [(post id, line, tokens)] oldest first, "tokens": total,
+        #             "dropped": newest post id whose line was dropped to fit summary_tokens}
+        self._summaries: "OrderedDict[int, Dict]" = OrderedDict()
+        self.replies = 0
+        self.summarized = 0
+        self.total_prompt_tokens = 0
+        self.max_prompt_tokens = 0
+
+    def _message_tokens(self, message: Dict) -> int:
+        return self.count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    def _post_message_tokens(self, post: Dict, message: Dict) -> int:
+        post_id = post.get("id")
+        with self._lock:
+            cached = self._post_tokens.get(post_id)
+        if cached is not None:
+            return cached
+        tokens = self._message_tokens(message)
+        if post_id is not None:
+            with self._lock:
+                self._post_tokens[post_id] = tokens
+                while len(self._post_tokens) > MAX_CACHED_POST_TOKENS:
+                    self._post_tokens.popitem(last=False)
+        return tokens
+
+    def _summary(self, thread_id: Optional[int], thread: List[Dict], window_start: int, cap: int) -> Optional[str]:
+        """Summary of thread[:window_start] in about cap tokens, extending the cached one for thread_id.
+
+        The cache is keyed by post id rather than position: replies to
+        different posts of a thread leave different posts out of ``thread``.
+        """
+        if window_start <= 0:
+            return None
+        with self._lock:
+            summary = self._summaries.get(thread_id) if thread_id is not None else None
+            if summary is None:
+                summary = {"lines": [], "tokens": 0, "dropped": 0}
+            summary = {"lines": list(summary["lines"]), "tokens": summary["tokens"], "dropped": summary["dropped"]}
+
+        folded = {post_id for post_id, _, _ in summary["lines"]}
+        added = []
+        for post in thread[:window_start]:
+            post_id = post.get("id")
+            if post_id in folded or (post_id is not None and post_id <= summary["dropped"]):
+                continue
+            line = _summary_line(post)
+            added.append((post_id, line, self.count_tokens(line) + 1))
+        if added:
+            summary["lines"] = sorted(summary["lines"] + added, key=lambda entry: entry[0] or 0)
+            summary["tokens"] += sum(tokens for _, _, tokens in added)
+        while summary["lines"] and summary["tokens"] > self.summary_tokens:
+            post_id, _, tokens = summary["lines"].pop(0)
+            summary["tokens"] -= tokens
+            summary["dropped"] = max(summary["dropped"], post_id or 0)
+
+        if thread_id is not None:
+            with self._lock:
+                self._summaries[thread_id] = summary
+                self._summaries.move_to_end(thread_id)
+                while len(self._summaries) > self.max_threads:
+                    self._summaries.popitem(last=False)
+
+        lines = []
+        available = cap - SUMMARY_HEADER_TOKENS
+        summarized = {post.get("id") for post in thread[:window_start]}
+        for post_id, line, tokens in reversed(summary["lines"]):
+            if post_id not in summarized:
+                # Folded for an earlier reply, but in this reply's window (or left out of its thread)
+                continue
+            if tokens > available:
+                break
+            lines.append(line)
+            available -= tokens
+        lines.reverse()
+        omitted = window_start - len(lines)
+        if omitted > 0:
+            lines.insert(0, f"- ({omitted} earlier messages not shown)")
+        return "Earlier in this thread:\n" + "\n".join(lines)
+
+    def build(self, head: List[Dict], tail: List[Dict], thread: List[Dict],
+              to_message: Callable[[Dict], Dict], thread_id: Optional[int] = None) -> Tuple[List[Dict], int]:
+        """Return head + [summary] + recent thread messages + tail, and the prompt's token count"""
+        fixed = sum(self._message_tokens(m) for m in head + tail)
+        remaining = self.budget - fixed
+        thread_messages = [to_message(post) for post in thread]
+        costs = [self._post_message_tokens(post, message) for post, message in zip(thread, thread_messages)]
+
+        # Leave room for a summary only if the whole thread does not fit
+        reserved = 0 if sum(costs) <= remaining else min(self.summary_tokens, max(remaining // 3, 0))
+        window_start = len(thread)
+        used = 0
+        while window_start > 0 and used + costs[window_start - 1] <= remaining - reserved:
+            window_start -= 1
+            used += costs[window_start]
+        recent = thread_messages[window_start:]
+
+        messages = list(head)
+        summary = self._summary(thread_id, thread, window_start, reserved)
+        if summary is not None:
+            summary_message = {"role": "system", "content": summary}
+            messages.append(summary_message)
+            used += self._message_tokens(summary_message)
+        messages += recent + tail
+        prompt_tokens = fixed + used
+
+        with self._lock:
+            self.replies += 1
+            self.summarized += summary is not None
+            self.total_prompt_tokens += prompt_tokens
+            self.max_prompt_tokens = max(self.max_prompt_tokens, prompt_tokens)
+        return messages, prompt_tokens
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "budget_tokens": self.budget,
+                "summary_tokens": self.summary_tokens,
+                "prompts_built": self.replies,
+                "prompts_with_summary": self.summarized,
+                "avg_prompt_tokens": round(self.total_prompt_tokens / self.replies, 1) if self.replies else 0.0,
+                "max_prompt_tokens": self.max_prompt_tokens,
+                "cached_summaries": len(self._summaries)
+            }
@@ -0,0 +1,568 @@
+import json
+import os
+import threading
+import logging
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+from commit_queue import CommitQueue
+from metrics import STORAGE_SECONDS
+from vault_lock import NO_LOCK
+from vault_format import (dumps, loads, is_framed, read_document, read_last, read_records,
+                          split_sections, write_file, SECTIONS)
+
+logger = logging.getLogger(__name__)
+
+# Event types written to the log, one per mutation
+POST_CREATED = "post_created"
+LIKE_TOGGLED = "like_toggled"
+AI_REPLY_ADDED = "ai_reply_added"
+
+
+def utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def from_record(post: Dict) -> Dict:
+    """A stored post with its likes list turned into an ordered set (a dict of user -> None)"""
+    return dict(post, likes=dict.fromkeys(post.get("likes", [])))
+
+
+def to_record(post: Dict) -> Dict:
+    """A post as stored in checkpoints, with its like set as a list in the order the likes came in"""
+    return dict(post, likes=list(post["likes"]))
+
+
+def apply_event(posts: Dict[int, Dict], event: Dict) -> Optional[Dict]:
+    """Apply a single event to a dict of posts keyed by id, returning the touched post.
+
+    Posts hold their likes as an ordered set, so a toggle is O(1).
+    """
+    data = event["data"]
+    if event["type"] in (POST_CREATED, AI_REPLY_ADDED):
+        post = from_record(data)
+        posts[post["id"]] = post
+        return post
+
+    if event["type"] == LIKE_TOGGLED:
+        post = posts.get(data["post_id"])
+        if post is None:
+            return None
+        if data["liked"]:
+            post["likes"].setdefault(data["user"])
+        else:
+            post["likes"].pop(data["user"], None)
+        return post
+
+    logger.warning(f"Skipping unknown event type: {event['type']}")
+    return None
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse an ISO 8601 timestamp; naive values are taken as UTC"""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+class EventLog:
+    """Append-only log of mutations, stored as one JSON object per line.
+
+    Readers can start from any byte offset, which is what lets checkpoints
+    skip the part of the log they already cover. Offsets are logical: when
+    compaction drops the oldest events, the rewritten file starts with a
+    header line recording how many bytes were dropped, so offsets held by
+    checkpoints stay valid.
+
+    Appends go through a CommitQueue: seqs and offsets are assigned in
+    order when an event is appended, and a single writer thread writes and
+    fsyncs whole batches. ``append`` returns once its event is on disk.
+    If a batch fails, the file is cut back to where it was and rollback()
+    returns seqs and offsets to what the file holds.
+    """
+
+    def __init__(self, path: str, max_batch: int = 256, max_latency: float = 0.002, vault_lock=NO_LOCK):
+        self.path = path
+        self._lock = threading.Lock()
+        self.vault_lock = vault_lock
+        self.last_seq = 0
+        self.base = 0
+        self.offset = 0
+        # Bumped by every rollback(), so state taken before one can be told apart
+        self.rollbacks = 0
+        self._followed: Optional[Tuple[int, int]] = None
+        self.commits = CommitQueue(os.path.basename(path), self._flush, max_batch, max_latency)
+        with vault_lock:
+            self._open()
+
+    @staticmethod
+    def _read_header(f) -> Tuple[int, int]:
+        """Return (base, header length) for an open log positioned at the start"""
+        first = f.readline()
+        try:
+            header = loads(first)
+            if "base" in header and "seq" not in header:
+                return header["base"], len(first)
+        except (json.JSONDecodeError, TypeError):
+            pass
+        f.seek(0)
+        return 0, 0
+
+    def _open(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            self.base, header_length = self._read_header(f)
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            # Find the start of the last complete line, reading backwards
+            tail = b""
+            position = size
+            while position > header_length and tail.count(b"\n") < 2:
+                step = min(65536, position - header_length)
+                position -= step
+                f.seek(position)
+                tail = f.read(step) + tail
+            if tail and not tail.endswith(b"\n"):
+                # A crash mid-append left a torn final line; drop it so the next append starts clean
+                keep = tail.rfind(b"\n") + 1
+                logger.warning(f"Truncating torn event at the end of {self.path}")
+                size = position + keep
+                f.truncate(size)
+                tail = tail[:keep]
+            self.offset = self.base + size - header_length
+            for line in reversed(tail.splitlines()):
+                try:
+                    self.last_seq = loads(line)["seq"]
+                    break
+                except (json.JSONDecodeError, KeyError):
+                    continue
+
+    def events(self, start_offset: int = 0) -> Iterator[Dict]:
+        """Iterate over events from a byte offset (default: the beginning), oldest first"""
+        for event, _ in self.events_with_offsets(start_offset):
+            yield event
+
+    def events_with_offsets(self, start_offset: int = 0) -> Iterator[Tuple[Dict, int]]:
+        """Like events(), also yielding the byte offset just past each event"""
+        if not os.path.exists(self.path):
+            return
+        end = self.offset
+        with open(self.path, "rb") as f:
+            base, header_length = self._read_header(f)
+            offset = max(start_offset, base)
+            f.seek(offset - base + header_length)
+            for line in f:
+                if offset >= end:
+                    break
+                offset += len(line)
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield loads(line), offset
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping unreadable event at byte {offset} of {self.path}")
+
+    def follow(self) -> List[Dict]:
+        """Events other processes appended since this one last looked, oldest first.
+
+        Only whole lines are taken, so an append still being written is
+        picked up on a later call. Raises HistoryCompacted if the log was
+        compacted past what this process has seen.
+        """
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return []
+            if (stat.st_ino, stat.st_size) == self._followed:
+                return []
+            events = []
+            with open(self.path, "rb") as f:
+                base, header_length = self._read_header(f)
+                if self.offset < base:
+                    raise HistoryCompacted(f"{self.path} was compacted past offset {self.offset}")
+                f.seek(self.offset - base + header_length)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    self.offset += len(line)
+                    try:
+                        event = loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"Skipping unreadable event at byte {self.offset} of {self.path}")
+                        continue
+                    if event["seq"] > self.last_seq:
+                        events.append(event)
+                        self.last_seq = event["seq"]
+            self.base = base
+            self._followed = (stat.st_ino, stat.st_size)
+            return events
+
+    def drop_before(self, offset: int) -> int:
+        """Rewrite the log without the events before a logical offset, returning bytes reclaimed.
+
+        The bulk of the copy happens without the lock; only the tail appended
+        meanwhile is copied while appends (in every process) are held, then
+        the new file is renamed over the old one.
+        """
+        if offset <= self.base:
+            return 0
+        tmp_path = self.path + ".compact"
+        old_size = os.path.getsize(self.path)
+        with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+            base, header_length = self._read_header(src)
+            src.seek(offset - base + header_length)
+            header = (json.dumps({"base": offset}) + "\n").encode("utf-8")
+            dst.write(header)
+            while True:
+                chunk = src.read(1 << 20)
+                if not chunk:
+                    break
+                dst.write(chunk)
+            with self.vault_lock, self._lock:
+                # Nothing new can be queued while the lock is held; drain what already was
+                self.commits.sync()
+                while True:
+                    chunk = src.read(1 << 20)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                dst.flush()
+                os.fsync(dst.fileno())
+                os.replace(tmp_path, self.path)
+                self.base = offset
+        return old_size - os.path.getsize(self.path)
+
+    def is_empty(self) -> bool:
+        return self.last_seq == 0
+
+    def snapshot(self) -> Optional[Dict]:
+        """The current state in checkpoint form, for backends that keep it; a plain log does not"""
+        return None
+
+    def _flush(self, lines: List[bytes]):
+        with open(self.path, "ab") as f:
+            if f.tell() > 0:
+                self._truncate_torn(f)
+            start = f.tell()
+            try:
+                f.write(b"".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            except Exception:
+                # The callers are told the batch failed, so none of it may be replayed later
+                try:
+                    f.truncate(start)
+                except Exception as e:
+                    logger.error(f"Error cutting a failed commit off {self.path}: {e}")
+                raise
+
+    def rollback(self) -> bool:
+        """After a failed group commit, forget every event that did not reach the file.
+
+        Seqs and offsets are read back from the file and the commit queue
+        accepts events again. Returns False if there was nothing to roll
+        back, e.g. because another caller of the same batch already did.
+        """
+        with self._lock:
+            if self.commits.error is None:
+                return False
+            queued_seq = self.last_seq
+            self.base = self.offset = self.last_seq = 0
+            self._followed = None
+            self._open()
+            self.rollbacks += 1
+            self.commits.reset()
+            logger.warning(f"Rolled {self.path} back from seq {queued_seq} to {self.last_seq} after a failed commit")
+            return True
+
+    def _truncate_torn(self, f):
+        """Drop a partial line left by a writer that crashed mid-append, so ours starts clean"""
+        size = f.tell()
+        with open(self.path, "rb") as reader:
+            reader.seek(size - 1)
+            if reader.read(1) == b"\n":
+                return
+            position = size
+            while position > 0:
+                position = max(0, position - 65536)
+                reader.seek(position)
+                chunk = reader.read(size - position)
+                if b"\n" in chunk:
+                    position += chunk.rfind(b"\n") + 1
+                    break
+        logger.warning(f"Truncating torn event at the end of {self.path}")
+        f.truncate(position)
+        f.seek(position)
+
+    def append_nowait(self, event_type: str, data: Dict, timestamp: Optional[str] = None) -> Tuple[Dict, Future]:
+        """Queue one event, returning it and a Future that resolves once it is durable"""
+        with self._lock:
+            event = {
+                "seq": self.last_seq + 1,
+                "type": event_type,
+                "timestamp": timestamp or utc_now(),
+                "data": data
+            }
+            line = dumps(event) + b"\n"
+            durable = self.commits.submit(line)
+            self.last_seq = event["seq"]
+            self.offset += len(line)
+            return event, durable
+
+    def append(self, event_type: str, data: Dict, timestamp: Optional[str] = None) -> Dict:
+        """Append one event to the log and return it once it is durable"""
+        event, durable = self.append_nowait(event_type, data, timestamp)
+        try:
+            durable.result()
+        except Exception:
+            self.rollback()
+            raise
+        return event
+
+    def sync(self):
+        """Wait until every appended event is durable"""
+        self.commits.sync()
+
+    def replay(self) -> List[Dict]:
+        """Build the current list of messages by replaying every event"""
+        posts: Dict[int, Dict] = {}
+        for event in self.events():
+            apply_event(posts, event)
+        return [to_record(post) for post in posts.values()]
+
+    def import_history(self, history_path: str) -> int:
+        """Import a legacy posts.json (list of full snapshots) as events.
+
+        Consecutive snapshots are diffed so the original timeline is kept:
+        new ids become post events and changed like lists become like
+        toggles, stamped with the snapshot's timestamp. A history converted
+        to the framed format is read one snapshot at a time.
+        """
+        try:
+            if is_framed(history_path):
+                history = read_records(history_path)
+            else:
+                with open(history_path, "rb") as f:
+                    history = loads(f.read())
+        except Exception as e:
+            logger.error(f"Error reading legacy history {history_path}: {e}")
+            return 0
+
+        imported = 0
+        known: Dict[int, List[str]] = {}
+        for snapshot in history:
+            timestamp = snapshot.get("timestamp")
+            for msg in snapshot.get("messages", []):
+                likes = list(dict.fromkeys(msg.get("likes", [])))
+                previous = known.get(msg["id"])
+                if previous is None:
+                    self.append_nowait(AI_REPLY_ADDED if msg.get("isAI") else POST_CREATED, dict(msg, likes=[]), timestamp)
+                    previous = []
+                    imported += 1
+                current = set(likes)
+                for user in previous:
+                    if user not in current:
+                        self.append_nowait(LIKE_TOGGLED, {"post_id": msg["id"], "user": user, "liked": False}, timestamp)
+                        imported += 1
+                before = set(previous)
+                for user in likes:
+                    if user not in before:
+                        self.append_nowait(LIKE_TOGGLED, {"post_id": msg["id"], "user": user, "liked": True}, timestamp)
+                        imported += 1
+                known[msg["id"]] = likes
+
+        self.sync()
+        logger.info(f"Imported {imported} events from {history_path}")
+        return imported
+
+
+class Checkpoints:
+    """Periodic full-state snapshots taken at known positions in an event log.
+
+    Each checkpoint records the seq, timestamp and byte offset of the last
+    event it includes, so any past state can be rebuilt by loading the
+    nearest earlier checkpoint and replaying only the events after it.
+
+    Checkpoints are written in the framed vault format with the posts in
+    chunked records and the seq, timestamp and offset in a footer, so the
+    index can be rebuilt from the footers alone. Older JSON checkpoints
+    still load.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.index: List[Dict] = []
+        self._index_mtime = 0
+        index_path = os.path.join(directory, "index.json")
+        if os.path.exists(index_path):
+            try:
+                self._read_index()
+            except Exception as e:
+                logger.error(f"Error reading checkpoint index {index_path}: {e}")
+                self._rebuild_index()
+        else:
+            self._rebuild_index()
+
+    def _read_index(self):
+        index_path = os.path.join(self.directory, "index.json")
+        mtime = os.stat(index_path).st_mtime_ns
+        with open(index_path, "rb") as f:
+            self.index = loads(f.read())
+        self._index_mtime = mtime
+
+    def refresh(self):
+        """Pick up checkpoints written or dropped by another process"""
+        try:
+            if os.stat(os.path.join(self.directory, "index.json")).st_mtime_ns == self._index_mtime:
+                return
+            with self._lock:
+                self._read_index()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error refreshing checkpoint index: {e}")
+
+    def _rebuild_index(self):
+        """Recover the index from the footer of each framed checkpoint"""
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith("checkpoint-") and name.endswith(".brdv")):
+                continue
+            try:
+                footer = read_last(os.path.join(self.directory, name))
+                self.index.append({"seq": footer["seq"], "timestamp": footer["timestamp"],
+                                   "offset": footer["offset"], "file": name})
+            except Exception as e:
+                logger.error(f"Error reading checkpoint footer {name}: {e}")
+        if self.index:
+            logger.warning(f"Rebuilt checkpoint index from {len(self.index)} checkpoints")
+            self._save_index()
+
+    @property
+    def latest(self) -> Optional[Dict]:
+        self.refresh()
+        return self.index[-1] if self.index else None
+
+    def write(self, seq: int, timestamp: str, offset: int, posts: List[Dict], revisions: List[List[int]]):
+        """Write a checkpoint atomically and add it to the index"""
+        name = f"checkpoint-{seq:012d}.brdv"
+        checkpoint = {"posts": [to_record(p) for p in posts], "revisions": revisions,
+                      "seq": seq, "timestamp": timestamp, "offset": offset}
+        with STORAGE_SECONDS.time(operation="checkpoint_write"):
+            write_file(os.path.join(self.directory, name), split_sections(checkpoint), SECTIONS)
+        with self._lock:
+            self.index.append({"seq": seq, "timestamp": timestamp, "offset": offset, "file": name})
+            self.index.sort(key=lambda entry: entry["seq"])
+            self._save_index()
+        logger.info(f"Wrote checkpoint at seq {seq} ({len(posts)} posts)")
+
+    def _save_index(self):
+        index_path = os.path.join(self.directory, "index.json")
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(dumps(self.index))
+        os.replace(tmp_path, index_path)
+        self._index_mtime = os.stat(index_path).st_mtime_ns
+
+    def drop_before(self, seq: int) -> int:
+        """Delete checkpoints older than seq, returning bytes reclaimed"""
+        with self._lock:
+            dropped = [entry for entry in self.index if entry["seq"] < seq]
+            self.index = [entry for entry in self.index if entry["seq"] >= seq]
+            self._save_index()
+        reclaimed = 0
+        for entry in dropped:
+            path = os.path.join(self.directory, entry["file"])
+            try:
+                reclaimed += os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return reclaimed
+
+    def load(self, entry: Dict) -> Dict:
+        """Read a checkpoint, with its posts ready for apply_event"""
+        with STORAGE_SECONDS.time(operation="checkpoint_load"):
+            path = os.path.join(self.directory, entry["file"])
+            if is_framed(path):
+                checkpoint = read_document(path)
+            else:
+                with open(path, "rb") as f:
+                    checkpoint = loads(f.read())
+            checkpoint["posts"] = [from_record(post) for post in checkpoint["posts"]]
+        return checkpoint
+
+    def before(self, at: datetime, strict: bool = False) -> Optional[Dict]:
+        """The newest checkpoint taken at or before (or strictly before) a moment"""
+        self.refresh()
+        with self._lock:
+            for entry in reversed(self.index):
+                taken = parse_timestamp(entry["timestamp"])
+                if taken < at or (taken == at and not strict):
+                    return entry
+        return None
+
+
+def events_between(log: EventLog, checkpoints: Checkpoints, start: Optional[datetime] = None,
+                   end: Optional[datetime] = None) -> Iterator[Dict]:
+    """Events with start <= timestamp <= end, read from the nearest checkpoint offset"""
+    offset = 0
+    if start is not None:
+        entry = checkpoints.before(start, strict=True)
+        if entry is not None:
+            offset = entry["offset"]
+    for event in log.events(offset):
+        timestamp = parse_timestamp(event["timestamp"])
+        if start is not None and timestamp < start:
+            continue
+        if end is not None and timestamp > end:
+            break
+        yield event
+
+
+class HistoryCompacted(Exception):
+    """Raised when asking for a moment older than the retained history"""
+
+
+def state_at(log: EventLog, checkpoints: Checkpoints, at: datetime) -> Tuple[int, List[Dict]]:
+    """Rebuild (revision, posts) as of a moment from the nearest checkpoint"""
+    posts: Dict[int, Dict] = {}
+    revision = 0
+    offset = 0
+    entry = checkpoints.before(at)
+    if entry is None and log.base > 0:
+        # The index can be empty if the checkpoint files were lost after compaction
+        oldest = checkpoints.index[0]["timestamp"] if checkpoints.index else None
+        raise HistoryCompacted(f"History before {oldest} has been compacted" if oldest
+                               else "Older history has been compacted")
+    if entry is not None:
+        checkpoint = checkpoints.load(entry)
+        posts = {post["id"]: post for post in checkpoint["posts"]}
+        revision = checkpoint["seq"]
+        offset = entry["offset"]
+    for event in log.events(offset):
+        if parse_timestamp(event["timestamp"]) > at:
+            break
+        apply_event(posts, event)
+        revision = event["seq"]
+    return revision, [to_record(post) for post in posts.values()]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import a legacy posts.json history into an event log")
+    parser.add_argument("history", help="path to the legacy posts.json")
+    parser.add_argument("log", help="path to the event log to append to")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    log = EventLog(args.log)
+    if not log.is_empty():
+        parser.error(f"{args.log} already contains events")
+    log.import_history(args.history)
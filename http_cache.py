@@ -0,0 +1,225 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+import logging
+from typing import Dict, Optional, Tuple
+from flask import Request, Response
+from metrics import HTTP_COMPRESSION_BYTES, HTTP_COMPRESSION_CPU_SECONDS, STATIC_ASSET_BYTES
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Types worth compressing; media formats are compressed already
+COMPRESSIBLE = ("text/", "application/json", "application/javascript", "image/svg+xml")
+# Hashed asset URLs never change content, so browsers may keep them for a year
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Encodings suffixed to a strong ETag, so each representation has its own
+ETAG_SUFFIXES = {"br": "-br", "gzip": "-gz"}
+
+
+def encodings() -> Tuple[str, ...]:
+    """Content codings this process can produce, preferred first"""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    """gzip levels run 1-9 and brotli qualities 0-11; level is scaled from the gzip range for brotli"""
+    if encoding == "br":
+        return brotli.compress(data, quality=min(11, round(level * 11 / 9)))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether If-None-Match names etag in any of the encodings it may have been sent in"""
+    if_none_match = request.if_none_match
+    return any(if_none_match.contains(etag + suffix) for suffix in ("",) + tuple(ETAG_SUFFIXES.values()))
+
+
+class Asset:
+    __slots__ = ("name", "url", "mimetype", "etag", "mtime", "variants")
+
+    def __init__(self, name: str, url: str, mimetype: str, etag: str, mtime: int,
+                 variants: Dict[Optional[str], bytes]):
+        self.name = name
+        self.url = url
+        self.mimetype = mimetype
+        self.etag = etag
+        self.mtime = mtime
+        self.variants = variants
+
+
+class StaticAssets:
+    """The files of a static directory, read, hashed and compressed once.
+
+    Each file gets a content-hashed URL (``name.<hash>.ext``) that is
+    served with immutable caching; references to ``static/<name>`` in HTML
+    files are rewritten to those URLs before the HTML itself is hashed.
+    Compressible files also get gzip (and, with the ``brotli`` package
+    installed, brotli) variants at the highest level, kept only where
+    smaller. ETags are the content hashes, so requests never touch the
+    disk. With ``watch`` set (for development), every request checks the
+    directory's mtimes and rebuilds everything if a file changed.
+    """
+
+    def __init__(self, directory: str, url_prefix: str = "/static/", watch: bool = False):
+        self.directory = directory
+        self.url_prefix = url_prefix
+        self.watch = watch
+        self._lock = threading.Lock()
+        self._assets: Dict[str, Asset] = {}
+        self._hashed: Dict[str, str] = {}
+        self.build()
+
+    def build(self):
+        started = time.perf_counter()
+        names = list(self._mtimes())
+        # HTML last, so the URLs it refers to are known
+        names.sort(key=lambda name: (name.endswith(".html"), name))
+        assets: Dict[str, Asset] = {}
+        with self._lock:
+            for name in names:
+                assets[name] = self._build(name, assets)
+            # Swapped in whole, so requests during a rebuild see the old set
+            self._assets = assets
+            self._hashed = {asset.url[len(self.url_prefix):]: name for name, asset in assets.items()}
+        total = sum(len(a.variants[None]) for a in assets.values())
+        sent = sum(min(len(data) for data in a.variants.values()) for a in assets.values())
+        logger.info(f"Prepared {len(self._assets)} static assets in {(time.perf_counter() - started) * 1000:.1f} ms: "
+                    f"{total} bytes, {sent} bytes compressed ({', '.join(encodings())})")
+
+    def _build(self, name: str, assets: Dict[str, Asset]) -> Asset:
+        path = os.path.join(self.directory, name)
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, "rb") as f:
+            data = f.read()
+        mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if name.endswith(".html"):
+            data = self._rewrite_urls(data, assets)
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        stem, ext = os.path.splitext(name)
+        url = f"{self.url_prefix}{stem}.{digest}{ext}"
+
+        variants: Dict[Optional[str], bytes] = {None: data}
+        STATIC_ASSET_BYTES.set(len(data), file=name, encoding="identity")
+        if mimetype.startswith(COMPRESSIBLE):
+            for encoding in encodings():
+                started = time.thread_time()
+                compressed = compress(data, encoding, 9)
+                HTTP_COMPRESSION_CPU_SECONDS.observe(time.thread_time() - started, kind="static", encoding=encoding)
+                if len(compressed) < len(data):
+                    variants[encoding] = compressed
+                    STATIC_ASSET_BYTES.set(len(compressed), file=name, encoding=encoding)
+
+        return Asset(name, url, mimetype, digest, mtime, variants)
+
+    def _rewrite_urls(self, html: bytes, assets: Dict[str, Asset]) -> bytes:
+        def hashed(match):
+            asset = assets.get(match.group(2).decode())
+            return match.group(1) + asset.url.encode() if asset else match.group(0)
+
+        return re.sub(rb"""(["'(])/?static/([\w./-]+)""", hashed, html)
+
+    def _mtimes(self) -> Dict[str, int]:
+        mtimes = {}
+        for root, _, files in os.walk(self.directory):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                mtimes[os.path.relpath(path, self.directory).replace(os.sep, "/")] = os.stat(path).st_mtime_ns
+        return mtimes
+
+    def _get(self, name: str) -> Tuple[Optional[Asset], bool]:
+        """The asset for a plain or hashed file name, and whether the name was the hashed one"""
+        if self.watch and self._mtimes() != {n: asset.mtime for n, asset in self._assets.items()}:
+            # HTML refers to the other files by hash, so everything is rebuilt
+            self.build()
+        hashed = name in self._hashed
+        return self._assets.get(self._hashed.get(name, name)), hashed
+
+    def response(self, request: Request, name: str) -> Optional[Response]:
+        """The best variant of a static file for the request, or None if there is no such file"""
+        asset, hashed = self._get(name)
+        if asset is None:
+            return None
+        encoding = request.accept_encodings.best_match([e for e in asset.variants if e is not None])
+        data = asset.variants[encoding]
+        response = Response(data, mimetype=asset.mimetype)
+        if len(asset.variants) > 1:
+            response.vary.add("Accept-Encoding")
+        if encoding is not None:
+            response.content_encoding = encoding
+        response.set_etag(asset.etag + ETAG_SUFFIXES.get(encoding, ""))
+        response.cache_control.public = True
+        if hashed:
+            response.headers["Cache-Control"] = IMMUTABLE
+        else:
+            # Plain URLs may change content, so they are revalidated against the ETag
+            response.cache_control.no_cache = True
+        response = response.make_conditional(request, accept_ranges=encoding is None, complete_length=len(data))
+        if response.status_code == 200:
+            HTTP_COMPRESSION_BYTES.inc(len(asset.variants[None]), kind="static", stage="in")
+            HTTP_COMPRESSION_BYTES.inc(len(data), kind="static", stage="out")
+        return response
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                asset.name: {encoding or "identity": len(data) for encoding, data in asset.variants.items()}
+                for asset in self._assets.values()
+            }
+
+
+class JSONCompressor:
+    """Compresses JSON responses of at least ``min_size`` bytes on the way out, in an after_request hook.
+
+    Responses without an ETag get a strong one from a hash of their body,
+    so unchanged GETs are answered with 304. A compressed response's ETag
+    is suffixed with its encoding; routes that answer conditional requests
+    themselves compare through etag_matches().
+    """
+
+    def __init__(self, min_size: int = 1024, level: int = 5):
+        self.min_size = min_size
+        self.level = level
+
+    def __call__(self, request: Request, response: Response) -> Response:
+        if (response.mimetype != "application/json" or response.status_code != 200 or
+                response.direct_passthrough or response.is_streamed or "Content-Encoding" in response.headers):
+            return response
+        data = response.get_data()
+        encoding = None
+        if len(data) >= self.min_size:
+            encoding = request.accept_encodings.best_match(encodings())
+            # The body and ETag depend on Accept-Encoding even when this client gets identity
+            response.vary.add("Accept-Encoding")
+        suffix = ETAG_SUFFIXES.get(encoding, "")
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(etag + suffix, weak)
+        elif request.method == "GET":
+            response.set_etag(hashlib.blake2b(data, digest_size=12).hexdigest() + suffix)
+            if "Cache-Control" not in response.headers:
+                response.cache_control.no_cache = True
+            if request.if_none_match.contains(response.get_etag()[0]):
+                response.status_code = 304
+                response.set_data(b"")
+                del response.headers["Content-Length"]
+                return response
+        if encoding is None:
+            return response
+
+        started = time.thread_time()
+        compressed = compress(data, encoding, self.level)
+        HTTP_COMPRESSION_CPU_SECONDS.observe(time.thread_time() - started, kind="json", encoding=encoding)
+        HTTP_COMPRESSION_BYTES.inc(len(data), kind="json", stage="in")
+        HTTP_COMPRESSION_BYTES.inc(len(compressed), kind="json", stage="out")
+        response.set_data(compressed)
+        response.content_encoding = encoding
+        return response
@@ -0,0 +1,368 @@
+import asyncio
+import importlib
+import random
+import time
+import logging
+from types import SimpleNamespace
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+from background_loop import get_loop, submit
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+PROBE_MESSAGES = [{"role": "user", "content": "ping"}]
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the provider while it is considered unhealthy"""
+
+
+def litellm_transport(max_connections: int = 20, api_base: Optional[str] = None) -> Callable[..., Awaitable]:
+    """litellm's acompletion over one pooled HTTP client, optionally pointed at api_base (e.g. a local stub)"""
+    session = None
+
+    async def complete(**kwargs):
+        nonlocal session
+        if session is None:
+            # Importing litellm takes seconds; keep it off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, importlib.import_module, "litellm")
+        import litellm
+        import httpx
+        if session is None:
+            # Providers that go through the OpenAI SDK reuse this client and its keep-alive connections
+            session = litellm.aclient_session = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            )
+        # Retries are ours, so the provider SDK must not retry on its own as well
+        kwargs.setdefault("max_retries", 0)
+        if api_base:
+            kwargs.setdefault("api_base", api_base)
+        return await litellm.acompletion(**kwargs)
+
+    return complete
+
+
+def delta_text(chunk) -> Optional[str]:
+    """The text in one streamed chunk (a litellm chunk, or a plain string from a fake transport)"""
+    if isinstance(chunk, str):
+        return chunk
+    choices = getattr(chunk, "choices", None)
+    if not choices:
+        return None
+    delta = getattr(choices[0], "delta", None)
+    return getattr(delta, "content", None)
+
+
+class StubProviderError(Exception):
+    """A simulated provider outage from stub_transport"""
+
+    status_code = 503
+
+
+def stub_transport(latency: float = 0.2, jitter: float = 0.5, failure_rate: float = 0.0,
+                   seed: int = 0) -> Callable[..., Awaitable]:
+    """An offline stand-in for the provider, for benchmarks and local runs without keys.
+
+    Each call takes ``latency`` seconds give or take ``jitter`` (a fraction
+    of it) and fails with ``failure_rate`` probability, drawn from a seeded
+    generator so runs are repeatable. The reply is derived from the prompt,
+    so identical prompts get identical replies. Streams yield word by word,
+    with the first word after a third of the latency.
+    """
+    rng = random.Random(seed)
+
+    def reply_for(messages) -> str:
+        words = messages[-2]["content"].split() if len(messages) >= 2 else ["hello"]
+        return f"stub reply about {' '.join(words[-6:])}"
+
+    async def complete(model: str, messages, stream: bool = False, **kwargs):
+        delay = latency * (1 + jitter * (2 * rng.random() - 1))
+        failed = rng.random() < failure_rate
+        text = reply_for(messages)
+        if not stream:
+            await asyncio.sleep(delay)
+            if failed:
+                raise StubProviderError(f"Stub provider for {model} is unavailable")
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+        async def chunks():
+            await asyncio.sleep(delay / 3)
+            if failed:
+                raise StubProviderError(f"Stub provider for {model} is unavailable")
+            words = text.split(" ")
+            for i, word in enumerate(words):
+                if i:
+                    await asyncio.sleep(delay * 2 / 3 / len(words))
+                yield word if i == 0 else " " + word
+
+        return chunks()
+
+    return complete
+
+
+def status_of(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether an error looks transient: rate limits, server errors, timeouts and dropped connections"""
+    status = status_of(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    name = type(error).__name__
+    return "Timeout" in name or "Connection" in name or "RateLimit" in name or "ServiceUnavailable" in name
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the provider asked us to wait, from a Retry-After header if there is one"""
+    candidates = (getattr(error, "litellm_response_headers", None), getattr(error, "headers", None),
+                  getattr(getattr(error, "response", None), "headers", None))
+    for headers in candidates:
+        try:
+            value = headers.get("retry-after") if headers else None
+            if value is not None:
+                return float(value)
+        except (TypeError, ValueError, AttributeError):
+            continue
+    return None
+
+
+class Circuit:
+    """Breaker state of one model: "closed" (calls go through) or "open" (calls fail fast)"""
+
+    def __init__(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.times_opened = 0
+        self.probe: Optional[asyncio.Task] = None
+
+
+class LLMClient:
+    """Every provider call goes through here, on the shared background loop.
+
+    Calls are limited by a global semaphore and one per model, each attempt
+    has its own timeout, and transient failures (rate limits, 5xx, timeouts)
+    are retried with full-jitter exponential backoff, honouring Retry-After.
+
+    Each model has a circuit breaker that opens after ``failure_threshold``
+    calls in a row fail even after retries. While open, calls to that model
+    raise CircuitOpenError at once so callers can fall back (or route to
+    another model) without waiting, and a background probe retries it with
+    a tiny request, backing off, until it answers and the breaker closes.
+    """
+
+    def __init__(self, transport: Callable[..., Awaitable], max_concurrency: int = 8, per_model_concurrency: int = 4,
+                 timeout: float = 20, max_retries: int = 3, base_delay: float = 0.5, max_delay: float = 8,
+                 failure_threshold: int = 5, probe_interval: float = 5, max_probe_interval: float = 60):
+        self.transport = transport
+        self.max_concurrency = max_concurrency
+        self.per_model_concurrency = per_model_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.max_probe_interval = max_probe_interval
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._model_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._circuits: Dict[str, Circuit] = {}
+        self.calls = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.short_circuited = 0
+        self.in_flight = 0
+        self.waiting = 0
+
+    def _semaphores(self, model: str):
+        # Created lazily so they belong to the background loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if model not in self._model_semaphores:
+            self._model_semaphores[model] = asyncio.Semaphore(self.per_model_concurrency)
+        return self._semaphore, self._model_semaphores[model]
+
+    def _backoff(self, attempt: int, error: BaseException) -> float:
+        requested = retry_after(error)
+        if requested is not None:
+            return min(requested, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def _acquire(self, model: str):
+        global_limit, model_limit = self._semaphores(model)
+        self.waiting += 1
+        try:
+            await global_limit.acquire()
+            try:
+                await model_limit.acquire()
+            except BaseException:
+                global_limit.release()
+                raise
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return global_limit, model_limit
+
+    def _release(self, limits):
+        self.in_flight -= 1
+        for limit in limits:
+            limit.release()
+
+    async def _attempt(self, **kwargs):
+        limits = await self._acquire(kwargs["model"])
+        try:
+            return await asyncio.wait_for(self.transport(**kwargs), self.timeout)
+        finally:
+            self._release(limits)
+
+    def circuit(self, model: str) -> "Circuit":
+        if model not in self._circuits:
+            self._circuits[model] = Circuit()
+        return self._circuits[model]
+
+    def is_open(self, model: str) -> bool:
+        return self.circuit(model).state == "open"
+
+    def _check_circuit(self, model: str):
+        circuit = self.circuit(model)
+        if circuit.state == "open":
+            self.short_circuited += 1
+            raise CircuitOpenError(f"Circuit for {model} open since {circuit.opened_at:.0f}")
+        self.calls += 1
+
+    def _retry_delay(self, error: Exception, attempt: int, model: str) -> Optional[float]:
+        """Backoff before retrying after error, or None (with the failure recorded) to give up"""
+        if status_of(error) == 429 or "RateLimit" in type(error).__name__:
+            self.rate_limited += 1
+        if not is_retryable(error):
+            # The request itself is at fault, not the provider's health
+            self.failed += 1
+            return None
+        if attempt >= self.max_retries:
+            self.failed += 1
+            self._record_failure(model)
+            return None
+        delay = self._backoff(attempt, error)
+        self.retries += 1
+        logger.warning(f"LLM call to {model} failed ({error}); retry {attempt + 1} in {delay:.2f} s")
+        return delay
+
+    def _record_success(self, model: str):
+        self.succeeded += 1
+        self.circuit(model).consecutive_failures = 0
+
+    async def acall(self, **kwargs):
+        """Call the provider with retries; must run on the background loop"""
+        self._check_circuit(kwargs["model"])
+        attempt = 0
+        while True:
+            try:
+                response = await self._attempt(**kwargs)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, kwargs["model"])
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self._record_success(kwargs["model"])
+            return response
+
+    async def astream(self, **kwargs) -> AsyncIterator[str]:
+        """Stream the reply's text as it is generated; must run on the background loop.
+
+        Failures before the first piece of text are retried like acall();
+        once text has been yielded the error is raised to the caller. Each
+        chunk has to arrive within the timeout.
+        """
+        model = kwargs["model"]
+        self._check_circuit(model)
+        attempt = 0
+        while True:
+            streamed = False
+            delay = None
+            limits = await self._acquire(model)
+            try:
+                stream = await asyncio.wait_for(self.transport(stream=True, **kwargs), self.timeout)
+                chunks = stream.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                    except StopAsyncIteration:
+                        break
+                    text = delta_text(chunk)
+                    if text:
+                        streamed = True
+                        yield text
+            except Exception as e:
+                delay = None if streamed else self._retry_delay(e, attempt, model)
+                if delay is None:
+                    if streamed:
+                        self.failed += 1
+                        self._record_failure(model)
+                    raise
+            finally:
+                self._release(limits)
+            if delay is None:
+                self._record_success(model)
+                return
+            # Back off without holding a concurrency slot
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def call(self, **kwargs):
+        """Blocking acall() for threads other than the background loop"""
+        return submit(self.acall(**kwargs)).result()
+
+    def _record_failure(self, model: str):
+        circuit = self.circuit(model)
+        circuit.consecutive_failures += 1
+        if circuit.state == "closed" and circuit.consecutive_failures >= self.failure_threshold:
+            circuit.state = "open"
+            circuit.opened_at = time.time()
+            circuit.times_opened += 1
+            logger.error(f"LLM circuit for {model} opened after {circuit.consecutive_failures} failed calls")
+            circuit.probe = get_loop().create_task(self._probe(model))
+
+    async def _probe(self, model: str):
+        circuit = self.circuit(model)
+        interval = self.probe_interval
+        while circuit.state == "open":
+            await asyncio.sleep(interval)
+            try:
+                await self._attempt(model=model, messages=PROBE_MESSAGES, max_tokens=1)
+            except Exception as e:
+                interval = min(interval * 2, self.max_probe_interval)
+                logger.info(f"LLM probe of {model} failed ({e}); next probe in {interval:.0f} s")
+                continue
+            circuit.state = "closed"
+            circuit.consecutive_failures = 0
+            logger.info(f"LLM circuit for {model} closed after {time.time() - circuit.opened_at:.0f} s")
+
+    def stats(self) -> Dict:
+        return {
+            "circuits": {model: {
+                "state": c.state,
+                "consecutive_failures": c.consecutive_failures,
+                "times_opened": c.times_opened
+            } for model, c in self._circuits.items()},
+            "calls": self.calls,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "short_circuited": self.short_circuited,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "per_model_concurrency": self.per_model_concurrency
+        }
@@ -1,10 +1,17 @@
 import os
 import random
 import asyncio
-from typing import List, Dict, Optional
-from litellm import completion, acompletion
-from datetime import datetime
+import threading
+import time
+from typing import Callable, List, Dict, Optional
+from datetime import datetime, timezone
 import logging
+from reply_cache import ReplyCache
+from context_builder import ContextBuilder, estimate_tokens, litellm_token_counter
+from llm_client import LLMClient, litellm_transport, stub_transport
+from model_router import ModelRouter
+from background_loop import submit
+from metrics import LLM_REPLY_SECONDS, LLM_FIRST_TOKEN_SECONDS
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -174,17 +181,107 @@ You're the beginner's mind that asks the questions experts forget to ask.""",
 class LLMIntegration:
     def __init__(self):
         self.personalities = AI_PERSONALITIES
+        # An offline stand-in provider (see llm_client.stub_transport), e.g. for benchmarks
+        self.stub = os.getenv("LLM_STUB", "False").lower() == "true"
         self.model = self._determine_model()
-        self._validate_configuration()
+        # An ordered pool of models; the first is the primary, the rest take hedged and failed-over requests
+        self.models = self._model_list("LLM_MODELS") or [self.model]
+        # Personalities can have a pool of their own, e.g. LLM_MODELS_NEWBIEAI for a cheaper, faster model
+        self.personality_models = {
+            p.name: self._model_list(f"LLM_MODELS_{p.name.upper()}") for p in self.personalities
+        }
+        self.cache = ReplyCache(
+            max_entries=int(os.getenv("LLM_CACHE_SIZE", 1000)),
+            ttl=float(os.getenv("LLM_CACHE_TTL", 3600)),
+            disk_dir=os.getenv("LLM_CACHE_DIR") or None
+        )
+        self.context = ContextBuilder(
+            count_tokens=estimate_tokens if self.stub else litellm_token_counter(self.model),
+            budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500)),
+            summary_tokens=int(os.getenv("CONTEXT_SUMMARY_TOKENS", 300))
+        )
+        if self.stub:
+            transport = stub_transport(
+                latency=float(os.getenv("LLM_STUB_LATENCY_MS", 200)) / 1000,
+                failure_rate=float(os.getenv("LLM_STUB_FAILURE_RATE", 0)),
+                seed=int(os.getenv("LLM_STUB_SEED", 0))
+            )
+        else:
+            # litellm takes seconds to import, so the transport loads it on the first call rather than at startup
+            transport = litellm_transport(int(os.getenv("LLM_MAX_CONNECTIONS", 20)), os.getenv("LLM_API_BASE") or None)
+        self.client = LLMClient(
+            transport,
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 8)),
+            per_model_concurrency=int(os.getenv("LLM_MODEL_CONCURRENCY", 4)),
+            timeout=float(os.getenv("LLM_TIMEOUT", 20)),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", 3)),
+            failure_threshold=int(os.getenv("LLM_CIRCUIT_FAILURES", 5)),
+            probe_interval=float(os.getenv("LLM_CIRCUIT_PROBE_SECONDS", 5))
+        )
+        self.router = ModelRouter(
+            self.client,
+            self.models,
+            hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", 0.9)),
+            min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20)),
+            default_hedge_delay=float(os.getenv("LLM_HEDGE_DEFAULT_MS", 3000)) / 1000
+        )
+        # (personality, model) -> streamed replies, summed and worst time to first token and to the last one
+        self._stream_timings: Dict[tuple, Dict] = {}
+        self._stream_lock = threading.Lock()
+        # One of "validating", "ready" or "failed"; see start_validation
+        self.status = "validating"
+        self.last_error: Optional[str] = None
+        self.last_checked: Optional[str] = None
+        self._validation_thread: Optional[threading.Thread] = None
+    
+    @property
+    def is_available(self) -> bool:
+        return self.status == "ready"
+    
+    def start_validation(self, retry_interval: float = 60):
+        """Validate the configuration in a background thread, retrying until it succeeds"""
+        if self._validation_thread is not None:
+            return
+        
+        def validate_until_ready():
+            # Load the tokenizer (and litellm with it) here rather than on the first reply
+            self.context.count_tokens("warm up")
+            while True:
+                try:
+                    self._validate_configuration()
+                    self.status = "ready"
+                    self.last_error = None
+                except Exception as e:
+                    self.status = "failed"
+                    self.last_error = str(e)
+                finally:
+                    self.last_checked = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+                if self.status == "ready":
+                    return
+                logger.info(f"Retrying LLM validation in {retry_interval} seconds")
+                time.sleep(retry_interval)
+        
+        self._validation_thread = threading.Thread(target=validate_until_ready, name="llm-validation", daemon=True)
+        self._validation_thread.start()
         
     def _determine_model(self) -> str:
         """Determine which model to use based on environment variables"""
+        # A model pool starts with its primary
+        if self._model_list("LLM_MODELS"):
+            model = self._model_list("LLM_MODELS")[0]
+            logger.info(f"Using model pool {os.getenv('LLM_MODELS')}")
+            return model
+        
         # Direct model specification (most flexible)
         if os.getenv("LITELLM_MODEL"):
             model = os.getenv("LITELLM_MODEL")
             logger.info(f"Using specified model: {model}")
             return model
         
+        if self.stub:
+            logger.info("Using the offline stub provider")
+            return "stub/echo"
+        
         # Smart defaults for main providers
         if os.getenv("OPENAI_API_KEY"):
             model = os.getenv("OPENAI_MODEL", "openai/gpt-4.1")
@@ -211,16 +308,24 @@ class LLMIntegration:
             logger.error("No LLM provider configured! Set OPENAI_API_KEY, ANTHROPIC_API_KEY, AZURE_OPENAI_API_KEY, or OPENROUTER_API_KEY")
             raise ValueError("No LLM provider configured. Please set appropriate environment variables.")
     
+    @staticmethod
+    def _model_list(name: str) -> List[str]:
+        """Comma-separated models from an environment variable"""
+        return [m.strip() for m in os.getenv(name, "").split(",") if m.strip()]
+    
+    def models_for(self, personality: AIPersonality) -> List[str]:
+        """The model pool a personality's replies are routed to"""
+        return self.personality_models.get(personality.name) or self.models
+    
     def _validate_configuration(self):
         """Validate that the selected model configuration is correct"""
         try:
             # Test with a simple message
             test_messages = [{"role": "user", "content": "Hello"}]
-            response = completion(
+            response = self.client.call(
                 model=self.model,
                 messages=test_messages,
-                max_tokens=10,
-                timeout=30
+                max_tokens=10
             )
             logger.info("LLM configuration validated successfully")
         except Exception as e:
@@ -231,125 +336,192 @@ class LLMIntegration:
         """Get a random AI personality"""
         return random.choice(self.personalities)
     
-    def generate_reply(self, personality: AIPersonality, post_content: str, 
-                      conversation_context: List[Dict] = None, user_name: str = "someone") -> str:
-        """Generate a reply using the specified personality"""
-        
-        # Build conversation context
-        messages = [{"role": "system", "content": personality.system_prompt}]
+    def _build_messages(self, personality: AIPersonality, post_content: str,
+                        conversation_context: List[Dict] = None, user_name: str = "someone",
+                        thread_id: Optional[int] = None) -> List[Dict]:
+        """Build the prompt for a reply from the personality and as much of the thread as fits the token budget"""
+        ai_names = {p.name for p in self.personalities}
         
-        # Add conversation context if available
-        if conversation_context:
-            for msg in conversation_context[-3:]:  # Only last 3 messages for context
-                role = "assistant" if msg.get("createdBy") in [p.name for p in self.personalities] else "user"
-                messages.append({
-                    "role": role,
-                    "content": f"{msg.get('createdBy', 'User')}: {msg.get('content', '')}"
-                })
+        def to_message(msg: Dict) -> Dict:
+            role = "assistant" if msg.get("createdBy") in ai_names else "user"
+            return {"role": role, "content": f"{msg.get('createdBy', 'User')}: {msg.get('content', '')}"}
         
-        # Add the current post
-        messages.append({
-            "role": "user", 
-            "content": f"{user_name} posted: {post_content}"
-        })
+        head = [{"role": "system", "content": personality.system_prompt}]
+        tail = [
+            # The current post
+            {"role": "user", "content": f"{user_name} posted: {post_content}"},
+            # Personality-specific instruction
+            {
+                "role": "system",
+                "content": f"Respond as {personality.name} with your {personality.style} personality. Keep it conversational, engaging, and under 150 characters. Write in lowercase (except for 'I' and proper nouns). DO NOT include your name in the response - it will be shown separately."
+            }
+        ]
+        messages, prompt_tokens = self.context.build(head, tail, conversation_context or [], to_message, thread_id)
+        logger.info(f"Prompt for {personality.name} uses {prompt_tokens} tokens "
+                    f"({len(messages) - 3} context messages, budget {self.context.budget})")
+        return messages
+    
+    async def _build_messages_async(self, *args) -> List[Dict]:
+        """_build_messages in a worker thread, so token counting never stalls the shared event loop"""
+        return await asyncio.get_running_loop().run_in_executor(None, self._build_messages, *args)
+    
+    def _fallback_reply(self, personality: AIPersonality) -> str:
+        """Template response used when the LLM is unavailable"""
+        template = random.choice(personality.response_templates)
+        return template.format(
+            topic="this",
+            speculation="something interesting happened",
+            connection="something related",
+            practical_point="the main issue",
+            innovation="a new approach",
+            trend="innovation",
+            time_period="the past",
+            historical_parallel="similar patterns",
+            historical_event="history",
+            concept="the concept",
+            question="this is important"
+        )
+    
+    def _completion_args(self, messages: List[Dict]) -> Dict:
+        return dict(
+            messages=messages,
+            max_tokens=100,
+            temperature=0.9,
+            top_p=0.95,
+            frequency_penalty=0.3,
+            presence_penalty=0.3
+        )
+    
+    def generate_reply(self, personality: AIPersonality, post_content: str, 
+                      conversation_context: List[Dict] = None, user_name: str = "someone",
+                      thread_id: Optional[int] = None) -> str:
+        """Generate a reply using the specified personality"""
+        messages = self._build_messages(personality, post_content, conversation_context, user_name, thread_id)
+        models = self.models_for(personality)
+        started = time.monotonic()
+        winner = None
         
-        # Add personality-specific instruction
-        messages.append({
-            "role": "system",
-            "content": f"Respond as {personality.name} with your {personality.style} personality. Keep it conversational, engaging, and under 150 characters. Write in lowercase (except for 'I' and proper nouns). DO NOT include your name in the response - it will be shown separately."
-        })
+        def complete() -> str:
+            nonlocal winner
+            winner, response = submit(self.router.complete(models, **self._completion_args(messages))).result()
+            # Extract content from response
+            return response.choices[0].message.content.strip()
         
         try:
-            response = completion(
-                model=self.model,
-                messages=messages,
-                max_tokens=100,
-                temperature=0.9,
-                top_p=0.95,
-                frequency_penalty=0.3,
-                presence_penalty=0.3,
-                timeout=30
-            )
-            
-            # Extract content from response
-            content = response.choices[0].message.content.strip()
-            return content
-            
+            reply = self.cache.get_or_compute(ReplyCache.make_key(models[0], messages), complete)
         except Exception as e:
             logger.error(f"Failed to generate LLM response: {e}")
+            self._observe_reply(personality, models[0], started, e)
             # Fallback to template response
-            template = random.choice(personality.response_templates)
-            return template.format(
-                topic="this",
-                speculation="something interesting happened",
-                connection="something related",
-                practical_point="the main issue",
-                innovation="a new approach",
-                trend="innovation",
-                time_period="the past",
-                historical_parallel="similar patterns",
-                historical_event="history",
-                concept="the concept",
-                question="this is important"
-            )
+            return self._fallback_reply(personality)
+        self._observe_reply(personality, winner or models[0], started, cached=winner is None)
+        return reply
     
     async def generate_reply_async(self, personality: AIPersonality, post_content: str, 
-                                  conversation_context: List[Dict] = None, user_name: str = "someone") -> str:
+                                  conversation_context: List[Dict] = None, user_name: str = "someone",
+                                  thread_id: Optional[int] = None) -> str:
         """Async version of generate_reply for better performance"""
+        messages = await self._build_messages_async(personality, post_content, conversation_context, user_name,
+                                                    thread_id)
+        models = self.models_for(personality)
+        started = time.monotonic()
+        winner = None
         
-        # Build conversation context (same as sync version)
-        messages = [{"role": "system", "content": personality.system_prompt}]
-        
-        if conversation_context:
-            for msg in conversation_context[-3:]:
-                role = "assistant" if msg.get("createdBy") in [p.name for p in self.personalities] else "user"
-                messages.append({
-                    "role": role,
-                    "content": f"{msg.get('createdBy', 'User')}: {msg.get('content', '')}"
-                })
-        
-        messages.append({
-            "role": "user", 
-            "content": f"{user_name} posted: {post_content}"
-        })
-        
-        messages.append({
-            "role": "system",
-            "content": f"Respond as {personality.name} with your {personality.style} personality. Keep it conversational, engaging, and under 150 characters. Write in lowercase (except for 'I' and proper nouns). DO NOT include your name in the response - it will be shown separately."
-        })
+        async def complete() -> str:
+            nonlocal winner
+            winner, response = await self.router.complete(models, **self._completion_args(messages))
+            return response.choices[0].message.content.strip()
         
         try:
-            response = await acompletion(
-                model=self.model,
-                messages=messages,
-                max_tokens=100,
-                temperature=0.9,
-                top_p=0.95,
-                frequency_penalty=0.3,
-                presence_penalty=0.3,
-                timeout=30
-            )
-            
-            content = response.choices[0].message.content.strip()
-            return content
-            
+            reply = await self.cache.get_or_compute_async(ReplyCache.make_key(models[0], messages), complete)
         except Exception as e:
             logger.error(f"Failed to generate async LLM response: {e}")
+            self._observe_reply(personality, models[0], started, e)
             # Fallback to template response
-            template = random.choice(personality.response_templates)
-            return template.format(
-                topic="this",
-                speculation="something interesting happened",
-                connection="something related",
-                practical_point="the main issue",
-                innovation="a new approach",
-                trend="innovation",
-                time_period="the past",
-                historical_parallel="similar patterns",
-                historical_event="history",
-                concept="the concept",
-                question="this is important"
-            )
+            return self._fallback_reply(personality)
+        self._observe_reply(personality, winner or models[0], started, cached=winner is None)
+        return reply
+    
+    async def generate_reply_stream(self, personality: AIPersonality, post_content: str,
+                                    on_delta: Callable[[str], None], conversation_context: List[Dict] = None,
+                                    user_name: str = "someone", thread_id: Optional[int] = None) -> str:
+        """Like generate_reply_async, but hands each piece of text to on_delta as it is generated.
+
+        Identical requests in flight share one provider stream: the others
+        wait for it and, like a cached reply, arrive as a single delta. If
+        the provider fails, the template fallback is returned; pieces
+        already passed to on_delta are then superseded by it.
+        """
+        messages = await self._build_messages_async(personality, post_content, conversation_context, user_name,
+                                                    thread_id)
+        models = self.models_for(personality)
+        started = time.monotonic()
+        first_token = None
+        model = None
+
+        async def stream() -> str:
+            nonlocal first_token, model
+            parts = []
+            async for model, delta in self.router.stream(models, **self._completion_args(messages)):
+                if first_token is None:
+                    first_token = time.monotonic() - started
+                parts.append(delta)
+                on_delta(delta)
+            reply = "".join(parts).strip()
+            if not reply:
+                raise ValueError("Provider streamed an empty reply")
+            return reply
+
+        try:
+            reply = await self.cache.get_or_compute_async(ReplyCache.make_key(models[0], messages), stream)
+        except Exception as e:
+            logger.error(f"Failed to stream LLM response: {e}")
+            self._observe_reply(personality, model or models[0], started, e)
+            return self._fallback_reply(personality)
+
+        if first_token is None:
+            # Cached, or coalesced with an identical stream
+            on_delta(reply)
+            self._observe_reply(personality, models[0], started, cached=True)
+            return reply
+        self._observe_reply(personality, model, started)
+        LLM_FIRST_TOKEN_SECONDS.observe(first_token, personality=personality.name, model=model)
+        self._record_stream(personality.name, model, first_token, time.monotonic() - started)
+        return reply
+
+    @staticmethod
+    def _observe_reply(personality: AIPersonality, model: str, started: float,
+                       error: Optional[Exception] = None, cached: bool = False):
+        if error is None:
+            outcome = "cached" if cached else "success"
+        elif isinstance(error, (asyncio.TimeoutError, TimeoutError)) or "Timeout" in type(error).__name__:
+            outcome = "timeout"
+        else:
+            outcome = "fallback"
+        LLM_REPLY_SECONDS.observe(time.monotonic() - started, personality=personality.name, model=model,
+                                  outcome=outcome)
+
+    def _record_stream(self, personality_name: str, model: str, first_token: float, total: float):
+        with self._stream_lock:
+            timings = self._stream_timings.setdefault((personality_name, model), {
+                "replies": 0, "ttft": 0.0, "max_ttft": 0.0, "total": 0.0
+            })
+            timings["replies"] += 1
+            timings["ttft"] += first_token
+            timings["max_ttft"] = max(timings["max_ttft"], first_token)
+            timings["total"] += total
+
+    def stream_stats(self) -> List[Dict]:
+        """Time to first token and to the full reply of streamed replies, per personality and model"""
+        with self._stream_lock:
+            return [{
+                "personality": name,
+                "model": model,
+                "replies": t["replies"],
+                "avg_ttft_ms": round(t["ttft"] * 1000 / t["replies"], 1),
+                "max_ttft_ms": round(t["max_ttft"] * 1000, 1),
+                "avg_reply_ms": round(t["total"] * 1000 / t["replies"], 1)
+            } for (name, model), t in sorted(self._stream_timings.items())]
     
     def should_reply_randomly(self) -> bool:
         """Determine if AI should reply randomly (80% chance)"""
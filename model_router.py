@@ -0,0 +1,197 @@
+import asyncio
+import time
+import logging
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from llm_client import LLMClient, CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# Latency samples kept per model and kind (full reply or first token)
+LATENCY_WINDOW = 200
+
+
+class LatencyTracker:
+    """Sliding window of recent latencies, in seconds"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples: deque = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+class ModelRouter:
+    """Sends each request to an ordered pool of models, hedging slow ones.
+
+    The first model whose circuit is closed gets the request. If it has not
+    answered within the ``hedge_percentile`` of its recently observed
+    latency (``default_hedge_delay`` until ``min_samples`` are in), the same
+    request also goes to the next model in the pool; whichever answers first
+    wins and the other is cancelled. A model that fails outright hands over
+    to the next one at once. For streams, "answering" means producing the
+    first token. A percentile of 0 turns hedging off, leaving only failover.
+
+    Latencies are only observed for winners, so a model that keeps losing
+    its hedges is judged by its faster answers; that errs on the side of
+    hedging less.
+    """
+
+    def __init__(self, client: LLMClient, models: List[str], hedge_percentile: float = 0.9,
+                 min_samples: int = 20, default_hedge_delay: float = 3.0):
+        self.client = client
+        self.models = models
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.default_hedge_delay = default_hedge_delay
+        self._latency: Dict[Tuple[str, str], LatencyTracker] = {}
+        self.requests = 0
+        self.hedged = 0
+        self.failovers = 0
+        self.failed = 0
+        # model -> {"sent": requests it got, "wins": answered first, "hedge_wins": answered first as the hedge}
+        self._wins: Dict[str, Dict[str, int]] = {}
+
+    def _tracker(self, kind: str, model: str) -> LatencyTracker:
+        if (kind, model) not in self._latency:
+            self._latency[(kind, model)] = LatencyTracker()
+        return self._latency[(kind, model)]
+
+    def hedge_delay(self, kind: str, model: str) -> Optional[float]:
+        """Seconds to wait on model before hedging, or None if hedging is off"""
+        if self.hedge_percentile <= 0:
+            return None
+        tracker = self._tracker(kind, model)
+        if len(tracker) < self.min_samples:
+            return self.default_hedge_delay
+        return tracker.percentile(self.hedge_percentile)
+
+    def _candidates(self, models: Optional[List[str]]) -> List[str]:
+        models = models or self.models
+        healthy = [m for m in models if not self.client.is_open(m)]
+        # With every circuit open, the first model raises CircuitOpenError for the caller
+        return healthy or models[:1]
+
+    def _counts(self, model: str) -> Dict[str, int]:
+        return self._wins.setdefault(model, {"sent": 0, "wins": 0, "hedge_wins": 0})
+
+    def _record_win(self, kind: str, model: str, started: float, hedge: bool):
+        self._tracker(kind, model).add(time.monotonic() - started)
+        wins = self._counts(model)
+        wins["wins"] += 1
+        wins["hedge_wins"] += hedge
+
+    async def _race(self, kind: str, models: List[str], start) -> Tuple[str, object, Dict[asyncio.Task, str]]:
+        """Run start(model) on models in turn, hedging and failing over, until one succeeds.
+
+        Returns the winning model, its result and the other tasks (by model)
+        that were started, which the caller must cancel or clean up.
+        """
+        self.requests += 1
+        remaining = list(models)
+        pending: Dict[asyncio.Task, Tuple[str, float, bool]] = {}
+        last_error: Optional[BaseException] = None
+
+        def launch(hedge: bool):
+            model = remaining.pop(0)
+            self._counts(model)["sent"] += 1
+            pending[asyncio.ensure_future(start(model))] = (model, time.monotonic(), hedge)
+            return model
+
+        current = launch(False)
+        while pending:
+            delay = self.hedge_delay(kind, current) if remaining else None
+            try:
+                done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            except asyncio.CancelledError:
+                self._cancel(list(pending))
+                raise
+            if not done:
+                previous, current = current, launch(True)
+                self.hedged += 1
+                logger.info(f"Hedging {previous} with {current} after {delay * 1000:.0f} ms")
+                continue
+            for task in done:
+                model, started, hedge = pending.pop(task)
+                if task.exception() is None:
+                    self._record_win(kind, model, started, hedge)
+                    return model, task.result(), {t: m for t, (m, _, _) in pending.items()}
+                last_error = task.exception()
+                logger.warning(f"Model {model} failed: {last_error}")
+            if remaining and not pending:
+                self.failovers += 1
+                current = launch(False)
+        self.failed += 1
+        raise last_error or CircuitOpenError("No model available")
+
+    @staticmethod
+    def _cancel(tasks: List[asyncio.Task]):
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # Retrieved so a loser that failed is not reported as an unhandled error
+                task.exception()
+
+    async def complete(self, models: Optional[List[str]] = None, **kwargs) -> Tuple[str, object]:
+        """The first successful response from the pool, and the model that gave it"""
+        model, response, losers = await self._race(
+            "reply", self._candidates(models), lambda m: self.client.acall(model=m, **kwargs)
+        )
+        self._cancel(list(losers))
+        return model, response
+
+    async def stream(self, models: Optional[List[str]] = None, **kwargs) -> AsyncIterator[Tuple[str, str]]:
+        """Stream (model, text) from the first model in the pool to produce a token"""
+        streams = {}
+
+        async def first_token(model: str) -> str:
+            streams[model] = self.client.astream(model=model, **kwargs)
+            try:
+                return await streams[model].__anext__()
+            except StopAsyncIteration:
+                raise ValueError(f"{model} streamed no text")
+
+        model, text, losers = await self._race("first_token", self._candidates(models), first_token)
+        for task, loser in losers.items():
+            if task.done() and not task.cancelled() and task.exception() is None:
+                # It produced a token in the same instant as the winner and is parked on it
+                asyncio.ensure_future(streams[loser].aclose())
+        self._cancel(list(losers))
+        yield model, text
+        async for text in streams[model]:
+            yield model, text
+
+    def stats(self) -> Dict:
+        models = {}
+        for (kind, model), tracker in self._latency.items():
+            entry = models.setdefault(model, {})
+            for p in (0.5, 0.9, 0.99):
+                value = tracker.percentile(p)
+                entry[f"{kind}_p{int(p * 100)}_ms"] = round(value * 1000, 1) if value is not None else None
+            delay = self.hedge_delay(kind, model)
+            entry[f"{kind}_hedge_after_ms"] = round(delay * 1000, 1) if delay is not None else None
+        for model, wins in self._wins.items():
+            entry = models.setdefault(model, {})
+            entry.update(wins)
+            entry["win_rate"] = round(wins["wins"] / wins["sent"], 3) if wins["sent"] else 0.0
+        hedge_wins = sum(w["hedge_wins"] for w in self._wins.values())
+        return {
+            "pool": self.models,
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_win_rate": round(hedge_wins / self.hedged, 3) if self.hedged else 0.0,
+            "failovers": self.failovers,
+            "failed": self.failed,
+            "hedge_percentile": self.hedge_percentile,
+            "models": models
+        }
@@ -0,0 +1,220 @@
+import json
+import os
+import threading
+import logging
+from collections import deque
+from typing import Dict, List, Optional
+from commit_queue import CommitQueue
+from event_log import utc_now
+from metrics import STORAGE_SECONDS
+from vault_format import dumps, loads
+from vault_lock import NO_LOCK
+
+logger = logging.getLogger(__name__)
+
+# Watermark applied to readers that have never marked anything as seen
+DEFAULT_READER = "*"
+
+
+class NotificationStore:
+    """Most recent notifications kept in a capped ring, backed by an append-only log.
+
+    Instead of a seen flag on every record, each reader has a watermark: the
+    highest notification id they have seen. Adding a notification and
+    marking everything seen are both O(1), and ids are consecutive so the
+    unread count is simple arithmetic.
+
+    When several processes share the store, adds and watermark changes
+    happen under ``vault_lock`` and follow() picks up what the others wrote.
+    """
+
+    def __init__(self, path: str, watermark_path: str, retention: int = 500,
+                 max_batch: int = 256, max_latency: float = 0.002, vault_lock=NO_LOCK):
+        self.path = path
+        self.watermark_path = watermark_path
+        self.retention = retention
+        self.vault_lock = vault_lock
+        self._lock = threading.Lock()
+        self.commits = CommitQueue(os.path.basename(path), self._flush, max_batch, max_latency)
+        self._items: deque = deque(maxlen=retention)
+        self._watermarks: Dict[str, int] = {}
+        self._watermarks_mtime = 0
+        # Inode and size of the log up to where it has been read
+        self._followed = (0, 0)
+        self.last_id = 0
+        with vault_lock:
+            self.load()
+
+    def load(self):
+        with self._lock, STORAGE_SECONDS.time(operation="notification_load"):
+            self._items.clear()
+            self.last_id = 0
+            self._followed = (0, 0)
+            lines = len(self._read_log())
+            self._read_watermarks()
+
+            # Keep the log from growing far past what is retained
+            if lines > 2 * self.retention:
+                self._rewrite()
+
+    def _read_log(self) -> List[Dict]:
+        """Read whole lines past the followed position, returning notifications newer than last_id"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        # A different inode means the log was rewritten; ids already held are skipped
+        offset = self._followed[1] if stat.st_ino == self._followed[0] else 0
+        newer = []
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                try:
+                    notif = loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if notif["id"] > self.last_id:
+                    self._items.append(notif)
+                    self.last_id = notif["id"]
+                    newer.append(notif)
+        self._followed = (stat.st_ino, offset)
+        return newer
+
+    def _read_watermarks(self):
+        try:
+            mtime = os.stat(self.watermark_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._watermarks_mtime:
+            with open(self.watermark_path, "rb") as f:
+                self._watermarks = loads(f.read())
+            self._watermarks_mtime = mtime
+
+    def follow(self) -> List[Dict]:
+        """Notifications other processes added since this one last looked, oldest first"""
+        with self._lock:
+            newer = self._read_log()
+            self._read_watermarks()
+            return newer
+
+    def _flush(self, lines: List[bytes]):
+        with open(self.path, "ab") as f:
+            start = f.tell()
+            try:
+                f.write(b"".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            except Exception:
+                # The callers are told the batch failed, so none of it may be read back later
+                try:
+                    f.truncate(start)
+                except Exception as e:
+                    logger.error(f"Error cutting a failed commit off {self.path}: {e}")
+                raise
+
+    def _roll_back(self):
+        """After a failed group commit, go back to the notifications the log holds"""
+        with self._lock:
+            if self.commits.error is None:
+                return
+            self._items.clear()
+            self.last_id = 0
+            self._followed = (0, 0)
+            self._read_log()
+            self.commits.reset()
+
+    def _rewrite(self):
+        self.commits.sync()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for notif in self._items:
+                f.write(dumps(notif) + b"\n")
+        os.replace(tmp_path, self.path)
+        stat = os.stat(self.path)
+        self._followed = (stat.st_ino, stat.st_size)
+
+    def compact(self) -> int:
+        """Rewrite the log with only the retained notifications, returning bytes reclaimed"""
+        with self.vault_lock, self._lock:
+            if not os.path.exists(self.path):
+                return 0
+            before = os.path.getsize(self.path)
+            self._rewrite()
+            return before - os.path.getsize(self.path)
+
+    def _save_watermarks(self):
+        tmp_path = self.watermark_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(dumps(self._watermarks))
+        os.replace(tmp_path, self.watermark_path)
+        self._watermarks_mtime = os.stat(self.watermark_path).st_mtime_ns
+
+    def import_legacy(self, legacy_path: str) -> int:
+        """Import a legacy notifications.json list; its seen flags become the default watermark"""
+        try:
+            with open(legacy_path, "r") as f:
+                legacy = json.load(f)
+        except Exception as e:
+            logger.error(f"Error reading legacy notifications {legacy_path}: {e}")
+            return 0
+
+        seen_up_to = 0
+        for notif in sorted(legacy, key=lambda n: n["id"]):
+            added = self.add(notif["message"], notif.get("post_id"), notif.get("timestamp"))
+            if notif.get("seen") and seen_up_to == added["id"] - 1:
+                seen_up_to = added["id"]
+        if seen_up_to:
+            self.mark_seen(DEFAULT_READER, seen_up_to)
+        logger.info(f"Imported {len(legacy)} notifications from {legacy_path}")
+        return len(legacy)
+
+    def add(self, message: str, post_id: Optional[int] = None, timestamp: Optional[str] = None) -> Dict:
+        with self.vault_lock:
+            with self._lock:
+                notif = {
+                    "id": self.last_id + 1,
+                    "message": message,
+                    "post_id": post_id,
+                    "timestamp": timestamp or utc_now()
+                }
+                durable = self.commits.submit(dumps(notif) + b"\n")
+                self._items.append(notif)
+                self.last_id = notif["id"]
+            try:
+                durable.result()
+            except Exception:
+                self._roll_back()
+                raise
+        return dict(notif)
+
+    def seen_up_to(self, reader: str) -> int:
+        return self._watermarks.get(reader, self._watermarks.get(DEFAULT_READER, 0))
+
+    def mark_seen(self, reader: str, up_to: Optional[int] = None) -> int:
+        """Move the reader's watermark forward, to the latest notification by default"""
+        with self.vault_lock, self._lock:
+            target = self.last_id if up_to is None else min(up_to, self.last_id)
+            watermark = max(self.seen_up_to(reader), target)
+            if watermark != self._watermarks.get(reader):
+                self._watermarks[reader] = watermark
+                self._save_watermarks()
+            return watermark
+
+    def unread_count(self, reader: str) -> int:
+        with self._lock:
+            return max(0, min(len(self._items), self.last_id - self.seen_up_to(reader)))
+
+    def since(self, since_id: int, reader: str) -> List[Dict]:
+        """Retained notifications newer than since_id, oldest first, with the reader's seen flag"""
+        with self._lock:
+            watermark = self.seen_up_to(reader)
+            newer = []
+            for notif in reversed(self._items):
+                if notif["id"] <= since_id:
+                    break
+                newer.append(dict(notif, seen=notif["id"] <= watermark))
+            newer.reverse()
+            return newer
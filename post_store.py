@@ -0,0 +1,397 @@
+import threading
+import logging
+from bisect import bisect_left
+from itertools import islice
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+from event_log import (EventLog, Checkpoints, HistoryCompacted, POST_CREATED, LIKE_TOGGLED, AI_REPLY_ADDED,
+                       apply_event, from_record, to_record, utc_now)
+from metrics import STORAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class PostStore:
+    """Process-wide in-memory view of the feed, persisted through the event log.
+
+    Posts are indexed by id, by parentId and by the root of their thread, so
+    lookups are O(1) and thread collection is O(thread size). Each thread
+    also keeps its reply count and last activity time, updated as posts
+    arrive, so thread listings never walk the replies. Every applied
+    event bumps ``revision`` and stamps the posts it touched, so clients can
+    ask for just the posts that changed since a revision they already have.
+
+    With ``checkpoints``, a full snapshot is written every
+    ``checkpoint_interval`` events and loading starts from the latest one,
+    so startup only replays the tail of the log.
+
+    Mutations are applied in memory in seq order under the lock and their
+    events handed to the log's group commit; the mutating call returns, and
+    listeners hear about the change (in seq order), only once the event is
+    durable. Readers can see a change slightly before it is durable. If the
+    commit fails, the log is rolled back and the indexes rebuilt from it,
+    so changes that never reached disk disappear again.
+
+    When several processes share the log, mutations happen under the log's
+    ``vault_lock`` and follow() applies (and announces to listeners) the
+    events the other processes appended. Only the process with
+    ``write_checkpoints`` set writes checkpoints.
+    """
+
+    def __init__(self, event_log: EventLog, checkpoints: Optional[Checkpoints] = None,
+                 checkpoint_interval: int = 1000, write_checkpoints: bool = True):
+        self.event_log = event_log
+        self.checkpoints = checkpoints
+        self.checkpoint_interval = checkpoint_interval
+        self.write_checkpoints = write_checkpoints
+        self._checkpoint_seq = 0
+        self._checkpoint_thread: Optional[threading.Thread] = None
+        self._last_timestamp: Optional[str] = None
+        self._lock = threading.RLock()
+        self._posts: Dict[int, Dict] = {}
+        self._children: Dict[Optional[int], List[int]] = {}
+        self._root_of: Dict[int, int] = {}
+        self._threads: Dict[int, List[int]] = {}
+        self._root_ids: List[int] = []
+        self._thread_stats: Dict[int, Dict] = {}
+        self._changed: "OrderedDict[int, int]" = OrderedDict()
+        self._next_id = 1
+        self._listeners: List[Callable[[Dict, Dict], None]] = []
+        # Keyed by (rollbacks, seq): seqs are reused after a rollback
+        self._unpublished: "OrderedDict[Tuple[int, int], Tuple[Dict, Dict, Future]]" = OrderedDict()
+        self._publish_lock = threading.Lock()
+        self.revision = 0
+        self.load()
+
+    def load(self):
+        """(Re)build every index by replaying the event log"""
+        with self._lock, STORAGE_SECONDS.time(operation="post_store_load"):
+            self._posts.clear()
+            self._children.clear()
+            self._root_of.clear()
+            self._threads.clear()
+            self._root_ids.clear()
+            self._thread_stats.clear()
+            self._changed.clear()
+            self._next_id = 1
+            self.revision = 0
+            self._checkpoint_seq = 0
+            snapshot = self.event_log.snapshot()
+            offset = self._seed(snapshot, snapshot["seq"]) if snapshot else self._load_checkpoint()
+            count = 0
+            for event in self.event_log.events(offset):
+                self._apply(event)
+                count += 1
+            logger.info(f"Loaded {len(self._posts)} posts, replaying {count} events after seq {self._checkpoint_seq}")
+            self._maybe_checkpoint()
+
+    def _load_checkpoint(self) -> int:
+        """Seed the indexes from the latest checkpoint, returning the log offset to replay from"""
+        entry = self.checkpoints.latest if self.checkpoints else None
+        if entry is None:
+            return 0
+        try:
+            checkpoint = self.checkpoints.load(entry)
+        except Exception as e:
+            logger.error(f"Error loading checkpoint {entry['file']}, replaying the full log: {e}")
+            return 0
+        return self._seed(checkpoint, entry["offset"])
+
+    def _seed(self, checkpoint: Dict, offset: int) -> int:
+        for post in checkpoint["posts"]:
+            post = from_record(post)
+            self._posts[post["id"]] = post
+            self._index(post)
+        for post_id, post_revision in checkpoint["revisions"]:
+            self._changed[post_id] = post_revision
+        self.revision = self._checkpoint_seq = checkpoint["seq"]
+        self._last_timestamp = checkpoint["timestamp"]
+        return offset
+
+    def _maybe_checkpoint(self):
+        """Snapshot the state under the lock and write it out in the background"""
+        if not self.checkpoints or not self.write_checkpoints:
+            return
+        if self.revision - self._checkpoint_seq < self.checkpoint_interval:
+            return
+        if self._checkpoint_thread is not None and self._checkpoint_thread.is_alive():
+            return
+        self._checkpoint_seq = self.revision
+        rollbacks = self.event_log.rollbacks
+        args = (
+            self.revision,
+            self._last_timestamp,
+            self.event_log.offset,
+            [to_record(p) for p in self._posts.values()],
+            [[post_id, post_revision] for post_id, post_revision in self._changed.items()]
+        )
+
+        def write():
+            try:
+                # Never checkpoint past what the log has made durable
+                self.event_log.sync()
+                if self.event_log.rollbacks != rollbacks:
+                    logger.warning(f"Skipping the checkpoint at seq {args[0]}: a failed commit was rolled back")
+                    return
+                self.checkpoints.write(*args)
+            except Exception as e:
+                logger.error(f"Error writing checkpoint: {e}")
+
+        self._checkpoint_thread = threading.Thread(target=write, name="checkpoint", daemon=True)
+        self._checkpoint_thread.start()
+
+    def _apply(self, event: Dict) -> Optional[Dict]:
+        is_new = event["type"] in (POST_CREATED, AI_REPLY_ADDED) and event["data"]["id"] not in self._posts
+        post = apply_event(self._posts, event)
+        if post is not None and is_new:
+            self._index(post)
+        self.revision = event["seq"]
+        self._last_timestamp = event["timestamp"]
+        if post is not None:
+            self._changed[post["id"]] = event["seq"]
+            self._changed.move_to_end(post["id"])
+        return post
+
+    def _index(self, post: Dict):
+        post_id = post["id"]
+        parent_id = post.get("parentId")
+        self._children.setdefault(parent_id, []).append(post_id)
+        root_id = self._root_of.get(parent_id, parent_id) if parent_id is not None else post_id
+        if root_id not in self._threads:
+            # Orphaned replies (parent missing) start their own thread
+            root_id = post_id
+        if root_id == post_id:
+            self._root_ids.append(post_id)
+            self._thread_stats[root_id] = {"replyCount": 0, "lastActivity": post["createdWhen"]}
+        else:
+            stats = self._thread_stats[root_id]
+            stats["replyCount"] += 1
+            stats["lastActivity"] = max(stats["lastActivity"], post["createdWhen"])
+        self._root_of[post_id] = root_id
+        self._threads.setdefault(root_id, []).append(post_id)
+        self._next_id = max(self._next_id, post_id + 1)
+
+    def follow(self) -> int:
+        """Apply and announce the events other processes appended, returning how many"""
+        with self._lock:
+            try:
+                events = self.event_log.follow()
+            except HistoryCompacted as e:
+                logger.warning(f"Reloading posts: {e}")
+                self.load()
+                return 0
+            applied = [(event, self._apply(event)) for event in events]
+            changes = [(event, self._copy(post)) for event, post in applied if post is not None]
+            if events:
+                self._maybe_checkpoint()
+        with self._publish_lock:
+            for event, post in changes:
+                self._notify(event, post)
+        return len(events)
+
+    def add_listener(self, listener: Callable[[Dict, Dict], None]):
+        """Call listener(event, post) after each new mutation is committed"""
+        self._listeners.append(listener)
+
+    def _commit(self, event_type: str, data: Dict) -> Future:
+        """Queue an event and apply it; the caller holds the lock and then calls _acknowledge"""
+        event, durable = self.event_log.append_nowait(event_type, data)
+        post = self._copy(self._apply(event))
+        self._unpublished[(self.event_log.rollbacks, event["seq"])] = (event, post, durable)
+        self._maybe_checkpoint()
+        return durable
+
+    def _acknowledge(self, durable: Future):
+        """Wait (without the lock) until an event is durable, then notify listeners in seq order.
+
+        If the commit failed, the first of its callers here rolls the log back
+        and reloads, and the error is raised to each of them.
+        """
+        try:
+            durable.result()
+        except Exception:
+            with self._lock:
+                if self.event_log.rollback():
+                    logger.warning("Reloading posts after a failed commit")
+                    self.load()
+            raise
+        finally:
+            self._publish()
+
+    def _publish(self):
+        with self._publish_lock:
+            while self._unpublished:
+                key = next(iter(self._unpublished))
+                event, post, queued = self._unpublished[key]
+                if not queued.done():
+                    break
+                del self._unpublished[key]
+                if queued.exception() is not None:
+                    continue
+                self._notify(event, post)
+
+    def _notify(self, event: Dict, post: Dict):
+        for listener in self._listeners:
+            try:
+                listener(event, post)
+            except Exception as e:
+                logger.error(f"Post listener failed: {e}")
+
+    @staticmethod
+    def _copy(post: Dict) -> Dict:
+        """The public view of a post: its like count instead of the likers"""
+        view = {key: value for key, value in post.items() if key != "likes"}
+        view["likeCount"] = len(post["likes"])
+        return view
+
+    def liked_by(self, user: str, post_ids: List[int]) -> set:
+        """The ids among post_ids that user has liked"""
+        with self._lock:
+            return {i for i in post_ids if i in self._posts and user in self._posts[i]["likes"]}
+
+    def likers(self, post_id: int, offset: int = 0, limit: int = 100) -> Optional[Tuple[List[str], int]]:
+        """A page of the users who liked a post, oldest like first, and the total; None if it doesn't exist"""
+        with self._lock:
+            post = self._posts.get(post_id)
+            if post is None:
+                return None
+            likes = post["likes"]
+            return list(islice(likes, offset, offset + limit)), len(likes)
+
+    def get(self, post_id: int) -> Optional[Dict]:
+        with self._lock:
+            post = self._posts.get(post_id)
+            return self._copy(post) if post else None
+
+    def all_posts(self) -> List[Dict]:
+        with self._lock:
+            return [self._copy(p) for p in self._posts.values()]
+
+    def posts_after(self, post_id: int) -> List[Dict]:
+        """Posts with an id above post_id, oldest first"""
+        with self._lock:
+            newer = []
+            # Posts are kept in id order, so only the newer ones are visited
+            for i in reversed(self._posts):
+                if i <= post_id:
+                    break
+                newer.append(self._copy(self._posts[i]))
+            newer.reverse()
+            return newer
+
+    def children(self, post_id: Optional[int]) -> List[Dict]:
+        with self._lock:
+            return [self._copy(self._posts[i]) for i in self._children.get(post_id, [])]
+
+    def root_of(self, post_id: int) -> Optional[int]:
+        with self._lock:
+            return self._root_of.get(post_id)
+
+    def thread(self, root_id: int) -> List[Dict]:
+        """All posts in a thread (root first), in creation order"""
+        with self._lock:
+            return [self._copy(self._posts[i]) for i in self._threads.get(root_id, [])]
+
+    def _nest(self, root_id: int, post_ids: List[int]) -> Dict:
+        """The given posts of a thread nested under their parents as ``replies``, with the thread's stats on the root"""
+        nodes = {}
+        for post_id in post_ids:
+            node = self._copy(self._posts[post_id])
+            node["replies"] = []
+            nodes[post_id] = node
+            parent = nodes.get(node.get("parentId")) if post_id != root_id else None
+            if parent is not None:
+                parent["replies"].append(node)
+        root = nodes[root_id]
+        root.update(self._thread_stats[root_id])
+        return root
+
+    def thread_tree(self, post_id: int) -> Optional[Dict]:
+        """The whole thread containing a post, nested from its root; None if the post doesn't exist"""
+        with self._lock:
+            root_id = self._root_of.get(post_id)
+            if root_id is None:
+                return None
+            return self._nest(root_id, self._threads[root_id])
+
+    def threads_page(self, cursor: Optional[int] = None, limit: int = 20,
+                     replies: int = 3) -> Tuple[List[Dict], Optional[int]]:
+        """Up to ``limit`` threads whose root id is below ``cursor``, newest thread first.
+
+        Each thread is its root post with ``replyCount``, ``lastActivity`` and
+        its first ``replies`` replies (in creation order, so every one's parent
+        is included) nested as in thread_tree(). Returns the threads and the
+        cursor for the next page (None on the last page).
+        """
+        with self._lock:
+            end = bisect_left(self._root_ids, cursor) if cursor is not None else len(self._root_ids)
+            start = max(0, end - limit)
+            page = [self._nest(root_id, self._threads[root_id][:replies + 1])
+                    for root_id in reversed(self._root_ids[start:end])]
+            next_cursor = self._root_ids[start] if start > 0 else None
+            return page, next_cursor
+
+    def changes_since(self, revision: int) -> List[Dict]:
+        """Posts created or modified after the given revision, oldest change first"""
+        with self._lock:
+            changed = []
+            for post_id, post_revision in reversed(self._changed.items()):
+                if post_revision <= revision:
+                    break
+                changed.append(self._copy(self._posts[post_id]))
+            changed.reverse()
+            return changed
+
+    def thread_page(self, cursor: Optional[int] = None, limit: int = 20) -> Tuple[List[Dict], Optional[int]]:
+        """Posts of up to ``limit`` threads whose root id is below ``cursor``, newest thread first.
+
+        Returns the posts and the cursor for the next page (None on the last page).
+        """
+        with self._lock:
+            end = bisect_left(self._root_ids, cursor) if cursor is not None else len(self._root_ids)
+            start = max(0, end - limit)
+            page = []
+            for root_id in reversed(self._root_ids[start:end]):
+                page.extend(self._copy(self._posts[i]) for i in self._threads[root_id])
+            next_cursor = self._root_ids[start] if start > 0 else None
+            return page, next_cursor
+
+    def create_post(self, content: str, created_by: str, parent_id: Optional[int] = None,
+                    ai_personality: Optional[str] = None) -> Dict:
+        """Allocate an id, persist the post and index it; ValueError if parent_id names no post"""
+        with self.event_log.vault_lock:
+            with self._lock:
+                # Checked before anything reaches the log: an event that cannot be applied would poison every replay
+                if parent_id is not None and (type(parent_id) is not int or parent_id not in self._posts):
+                    raise ValueError(f"Parent post {parent_id!r} not found")
+                now = utc_now()
+                post = {
+                    "id": self._next_id,
+                    "parentId": parent_id,
+                    "createdBy": created_by,
+                    "createdWhen": now,
+                    "updatedWhen": now,
+                    "content": content,
+                    "likes": [],
+                    "isAI": ai_personality is not None
+                }
+                if ai_personality is not None:
+                    post["aiPersonality"] = ai_personality
+                durable = self._commit(AI_REPLY_ADDED if ai_personality is not None else POST_CREATED, post)
+                post = self._copy(self._posts[post["id"]])
+            self._acknowledge(durable)
+        return post
+
+    def toggle_like(self, post_id: int, user: str) -> Optional[Tuple[str, int]]:
+        """Like or unlike a post, returning (action, like count) or None if it doesn't exist"""
+        with self.event_log.vault_lock:
+            with self._lock:
+                post = self._posts.get(post_id)
+                if post is None:
+                    return None
+                liked = user not in post["likes"]
+                durable = self._commit(LIKE_TOGGLED, {"post_id": post_id, "user": user, "liked": liked})
+                count = len(post["likes"])
+            self._acknowledge(durable)
+        return ("liked" if liked else "unliked"), count
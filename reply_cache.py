@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class ReplyCache:
+    """LRU/TTL cache of LLM replies with in-flight request coalescing.
+
+    Entries are keyed on the model and the normalized message list. An
+    optional directory adds a disk tier that survives restarts. Concurrent
+    requests for the same key share a single provider call; the followers
+    wait on the leader's result (or its exception).
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600, disk_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._miss_seconds = 0.0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict]) -> str:
+        normalized = [
+            {"role": m["role"], "content": _WHITESPACE.sub(" ", m["content"]).strip()}
+            for m in messages
+        ]
+        payload = json.dumps({"model": model, "messages": normalized}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached reply for key, or None; counts as a hit when found"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), "r") as f:
+                    record = json.load(f)
+                if record["expires"] > now:
+                    self._remember(key, record["expires"], record["value"])
+                    with self._lock:
+                        self.hits += 1
+                        self.disk_hits += 1
+                    return record["value"]
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable cache entry {key}: {e}")
+        return None
+
+    def _remember(self, key: str, expires: float, value: str):
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key: str, value: str):
+        expires = time.time() + self.ttl
+        self._remember(key, expires, value)
+        if not self.disk_dir:
+            return
+        try:
+            tmp_path = self._disk_path(key) + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"expires": expires, "value": value}, f)
+            os.replace(tmp_path, self._disk_path(key))
+        except Exception as e:
+            logger.warning(f"Failed to write cache entry {key}: {e}")
+        self._puts += 1
+        if self._puts % 100 == 0:
+            self.prune_disk()
+
+    def prune_disk(self) -> int:
+        """Delete expired entries from the disk tier"""
+        if not self.disk_dir:
+            return 0
+        removed = 0
+        now = time.time()
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            try:
+                with open(path, "r") as f:
+                    if json.load(f)["expires"] <= now:
+                        os.remove(path)
+                        removed += 1
+            except Exception:
+                continue
+        return removed
+
+    def _claim(self, key: str) -> Tuple[Future, bool]:
+        """The in-flight future for key, and whether the caller must compute it"""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._inflight[key] = Future()
+            self.misses += 1
+            return future, True
+
+    def _settle(self, key: str, future: Future, started: float, value: Optional[str] = None,
+                error: Optional[BaseException] = None):
+        if error is None:
+            self.put(key, value)
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._miss_seconds += time.time() - started
+        if error is None:
+            future.set_result(value)
+        else:
+            future.set_exception(error)
+
+    def get_or_compute(self, key: str, compute: Callable[[], str]) -> str:
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        future, leader = self._claim(key)
+        if not leader:
+            return future.result()
+        started = time.time()
+        try:
+            value = compute()
+        except Exception as e:
+            self._settle(key, future, started, error=e)
+            raise
+        self._settle(key, future, started, value)
+        return value
+
+    async def get_or_compute_async(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        future, leader = self._claim(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        started = time.time()
+        try:
+            value = await compute()
+        except BaseException as e:
+            self._settle(key, future, started, error=e)
+            raise
+        self._settle(key, future, started, value)
+        return value
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            avg_miss = self._miss_seconds / self.misses if self.misses else 0.0
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+                "provider_calls_saved": self.hits + self.coalesced,
+                "avg_provider_seconds": round(avg_miss, 3),
+                "estimated_seconds_saved": round(avg_miss * (self.hits + self.coalesced), 3)
+            }
@@ -0,0 +1,318 @@
+import asyncio
+import heapq
+import json
+import os
+import time
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from background_loop import get_loop
+from metrics import REPLY_SCHEDULER_LAG_SECONDS
+from vault_format import dumps, loads
+from vault_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+# Replied post ids kept by id when the journal is rewritten; older ones are covered by a watermark
+REPLIED_POSTS_KEPT = 1000
+
+
+class ReplyScheduler:
+    """Delay-ordered queue of pending AI replies, run on the shared background loop.
+
+    Jobs wait in a heap keyed by due time instead of a sleeping thread each,
+    and at most ``max_concurrency`` handlers run at once. Every job is
+    journaled to ``queue_file`` when scheduled and again when finished, so
+    replies still pending at shutdown are picked up on the next start. A
+    crash between committing a reply and journaling it as done can repeat
+    that one reply (at-least-once).
+
+    The journal is shared by every process using the vault. Any of them can
+    schedule, but only the one that called start() runs jobs; with
+    ``poll_interval`` it also picks up the jobs the others journaled. Each
+    post gets at most one scheduled reply, also across restarts: rewriting
+    the journal keeps the ids of the latest ``replied_kept`` posts whose
+    jobs are done, and a watermark below which no post is scheduled again,
+    as replies are only ever scheduled for new posts. Appends and rewrites
+    are fsynced, so the journal survives a crash as well.
+    """
+
+    def __init__(self, queue_file: str, handler: Callable[[Dict], Awaitable[None]], max_concurrency: int = 4,
+                 poll_interval: Optional[float] = None, replied_kept: int = REPLIED_POSTS_KEPT):
+        self.queue_file = queue_file
+        self.handler = handler
+        self.max_concurrency = max_concurrency
+        self.poll_interval = poll_interval
+        self.replied_kept = replied_kept
+        self._journal_lock = FileLock(os.path.splitext(queue_file)[0] + ".lock")
+        # Inode and size of the journal up to where this process has read it
+        self._journal_position = (0, 0)
+        self._scheduled_posts = set()
+        # Posts with ids up to this one count as scheduled without being listed
+        self._replied_through = 0
+        self._pending: Dict[int, Dict] = {}
+        self._running_ids = set()
+        self._heap: List = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # The loop keeps only weak references to tasks, so the dispatcher and running jobs are held here
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._tasks = set()
+        self._next_job_id = 1
+        self.running = 0
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.journal_errors = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._total_lag = 0.0
+
+    def _read_entries(self, offset: int) -> Tuple[List[Dict], int]:
+        """Journal entries from a byte offset up to the last whole line, and the offset after them"""
+        entries = []
+        with open(self.queue_file, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                try:
+                    entries.append(loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return entries, offset
+
+    def _follow_journal(self) -> List[Dict]:
+        """Catch up on entries journaled by other processes, returning the jobs they added that are not done.
+
+        The caller holds the journal lock, so nobody is mid-append and a
+        partial last line can only be left over from a crash; it is cut off.
+        """
+        try:
+            stat = os.stat(self.queue_file)
+        except FileNotFoundError:
+            return []
+        inode, offset = self._journal_position
+        if stat.st_ino != inode:
+            # Rewritten (or never read): it holds everything still worth remembering, so start afresh
+            self._scheduled_posts = set()
+            offset = 0
+        entries, offset = self._read_entries(offset)
+        if stat.st_size > offset:
+            logger.warning(f"Truncating a torn entry at the end of {self.queue_file}")
+            os.truncate(self.queue_file, offset)
+        self._journal_position = (stat.st_ino, offset)
+        added: Dict[int, Dict] = {}
+        for entry in entries:
+            if entry["op"] == "add":
+                job = entry["job"]
+                added[job["id"]] = job
+                self._next_job_id = max(self._next_job_id, job["id"] + 1)
+                if job.get("post_id") is not None:
+                    self._scheduled_posts.add(job["post_id"])
+            elif entry["op"] == "done":
+                added.pop(entry["id"], None)
+            elif entry["op"] == "replied":
+                self._scheduled_posts.update(entry["post_ids"])
+                self._replied_through = max(self._replied_through, entry.get("through", 0))
+        return list(added.values())
+
+    def _append(self, entry: Dict):
+        """Append an entry to a journal this process has just caught up on, under the journal lock"""
+        line = dumps(entry) + b"\n"
+        with open(self.queue_file, "ab") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            inode = os.fstat(f.fileno()).st_ino
+        self._journal_position = (inode, self._journal_position[1] + len(line))
+
+    def _journal(self, entry: Optional[Dict] = None) -> List[Dict]:
+        """Catch up on the journal and append an entry, returning the jobs other processes added"""
+        with self._journal_lock:
+            added = self._follow_journal()
+            if entry is not None:
+                self._append(entry)
+            return added
+
+    def _read_journal(self) -> Dict[int, Dict]:
+        pending: Dict[int, Dict] = {}
+        if os.path.exists(self.queue_file):
+            for entry in self._read_entries(0)[0]:
+                if entry["op"] == "add":
+                    pending[entry["job"]["id"]] = entry["job"]
+                elif entry["op"] == "done":
+                    pending.pop(entry["id"], None)
+        return pending
+
+    def _rewrite_journal(self, pending: Dict[int, Dict]):
+        """Replace the journal with the pending jobs; the caller has just caught up on it under the lock"""
+        tmp_path = self.queue_file + ".tmp"
+        pending_posts = {job.get("post_id") for job in pending.values()}
+        # Posts whose replies are done, so they are never scheduled again
+        replied = sorted(self._scheduled_posts - pending_posts)
+        if len(replied) > self.replied_kept:
+            cut = len(replied) - self.replied_kept
+            self._replied_through = max(self._replied_through, replied[cut - 1])
+            replied = replied[cut:]
+            self._scheduled_posts = set(replied) | (pending_posts - {None})
+        with open(tmp_path, "wb") as f:
+            if replied or self._replied_through:
+                f.write(dumps({"op": "replied", "post_ids": replied, "through": self._replied_through}) + b"\n")
+            for job in pending.values():
+                f.write(dumps({"op": "add", "job": job}) + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.queue_file)
+        stat = os.stat(self.queue_file)
+        self._journal_position = (stat.st_ino, stat.st_size)
+
+    def _load_pending(self) -> List[Dict]:
+        # Rewrite the journal with only the jobs that are still pending
+        with self._journal_lock:
+            self._follow_journal()
+            pending = self._read_journal()
+            self._rewrite_journal(pending)
+        return list(pending.values())
+
+    def compact(self) -> int:
+        """Drop finished jobs from the journal, returning bytes reclaimed"""
+        with self._journal_lock:
+            if not os.path.exists(self.queue_file):
+                return 0
+            self._push_all(self._follow_journal())
+            before = os.path.getsize(self.queue_file)
+            self._rewrite_journal(self._read_journal())
+            return before - os.path.getsize(self.queue_file)
+
+    def start(self):
+        """Reload persisted jobs and start dispatching on the background loop"""
+        jobs = self._load_pending()
+        self._next_job_id = max([self._next_job_id] + [job["id"] + 1 for job in jobs])
+        self._loop = get_loop()
+
+        async def start():
+            self._wakeup = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            for job in jobs:
+                self._push(job)
+            self._dispatcher = self._loop.create_task(self._dispatch())
+
+        asyncio.run_coroutine_threadsafe(start(), self._loop).result()
+        logger.info(f"Reply scheduler started with {len(jobs)} pending jobs")
+
+    def schedule(self, job: Dict, delay: float) -> Optional[Dict]:
+        """Queue a job to run after delay seconds; safe from any thread or process.
+
+        Returns None, scheduling nothing, if the job's post already has a reply scheduled.
+        """
+        with self._journal_lock:
+            added = self._follow_journal()
+            if job.get("post_id") in self._scheduled_posts or self._replied(job.get("post_id")):
+                logger.info(f"A reply to post {job['post_id']} is already scheduled")
+                self.skipped += 1
+                job = None
+            else:
+                job = dict(job, id=self._next_job_id, due=time.time() + delay)
+                self._next_job_id += 1
+                self._append({"op": "add", "job": job})
+                if job.get("post_id") is not None:
+                    self._scheduled_posts.add(job["post_id"])
+        self._push_all(added + ([job] if job else []))
+        return job
+
+    def _replied(self, post_id) -> bool:
+        """Whether post_id is at or below the watermark of posts that have had their reply"""
+        return isinstance(post_id, int) and post_id <= self._replied_through
+
+    def _push_all(self, jobs: List[Dict]):
+        if self._loop is not None:
+            for job in jobs:
+                self._loop.call_soon_threadsafe(self._push, job)
+
+    def _push(self, job: Dict):
+        if job["id"] in self._pending:
+            return
+        self._pending[job["id"]] = job
+        heapq.heappush(self._heap, (job["due"], job["id"]))
+        self._wakeup.set()
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                _, job_id = heapq.heappop(self._heap)
+                job = self._pending.get(job_id)
+                if job is not None:
+                    task = asyncio.ensure_future(self._run(job))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+            timeout = self._heap[0][0] - now if self._heap else None
+            if self.poll_interval is not None:
+                timeout = min(timeout, self.poll_interval) if timeout is not None else self.poll_interval
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            if self.poll_interval is not None:
+                # Jobs scheduled by other processes only show up in the journal
+                for job in await self._journal_async():
+                    self._push(job)
+
+    async def _journal_async(self, entry: Optional[Dict] = None) -> List[Dict]:
+        """_journal() off the loop; errors are logged rather than raised, so dispatching never stops"""
+        try:
+            return await self._loop.run_in_executor(None, self._journal, entry)
+        except Exception as e:
+            self.journal_errors += 1
+            logger.error(f"Error updating the reply journal {self.queue_file}: {e}")
+            return []
+
+    async def _run(self, job: Dict):
+        async with self._semaphore:
+            lag = time.time() - job["due"]
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self._total_lag += lag
+            REPLY_SCHEDULER_LAG_SECONDS.observe(max(lag, 0.0))
+            self._running_ids.add(job["id"])
+            self.started += 1
+            self.running += 1
+            try:
+                await self.handler(job)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Reply job {job['id']} failed: {e}")
+            finally:
+                self.running -= 1
+                self._running_ids.discard(job["id"])
+                self._pending.pop(job["id"], None)
+                # If this fails the job stays in the journal and runs again after a restart (at-least-once)
+                added = await self._journal_async({"op": "done", "id": job["id"]})
+                for other in added:
+                    self._push(other)
+
+    def status(self) -> Dict:
+        """Queue depth and how far behind schedule replies are running"""
+        now = time.time()
+        overdue = [now - job["due"] for job in list(self._pending.values())
+                   if job["due"] <= now and job["id"] not in self._running_ids]
+        return {
+            "pending": len(self._pending),
+            "running": self.running,
+            "waiting": len(self._pending) - self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "journal_errors": self.journal_errors,
+            "dispatching": self._loop is not None,
+            "max_concurrency": self.max_concurrency,
+            "current_lag_seconds": round(max(overdue, default=0.0), 3),
+            "last_lag_seconds": round(self.last_lag, 3),
+            "avg_lag_seconds": round(self._total_lag / self.started, 3) if self.started else 0.0,
+            "max_lag_seconds": round(self.max_lag, 3)
+        }
@@ -0,0 +1,297 @@
+import math
+import os
+import re
+import sys
+import threading
+import time
+import heapq
+import logging
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+from vault_format import SECTIONS, read_document, split_sections, write_file
+from metrics import STORAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+TOKEN = re.compile(r"\w+")
+# BM25 term frequency saturation and length normalisation
+K1 = 1.2
+B = 0.75
+# Postings that can be scanned in the time of one bisection into a term's postings
+PROBE_COST = 8
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN.findall(text.lower()) if text else []
+
+
+class SearchIndex:
+    """BM25 full-text search over post content and authors, updated one post at a time.
+
+    Posts are never edited, so the index only grows: each term keeps its
+    postings as two parallel arrays (post ids, ascending, and term counts)
+    that new posts are appended to. Authors and AI personalities keep id
+    lists of their own for filtering.
+
+    A query scores about ``scan_limit`` postings at most. Its rare terms
+    are scanned in full; the common ones only as far back from the newest
+    post as the rest of that budget reaches, and posts the rare terms found
+    before that are looked up in them by bisection if there are few enough.
+    When a filter leaves fewer posts than the rarest term matches, the
+    filter's newest posts are looked up in each term instead. So query time
+    is bounded however large the feed grows, at the cost of ranking only the
+    newest matches of very common terms.
+
+    save() snapshots the index to a framed vault file; load() reads it
+    back, after which only posts newer than ``last_id`` need indexing.
+    """
+
+    def __init__(self, path: str, scan_limit: int = 5000, save_interval: int = 1000, write: bool = True):
+        self.path = path
+        self.scan_limit = scan_limit
+        self.save_interval = save_interval
+        self.write = write
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._lengths: Dict[int, int] = {}
+        self._meta: Dict[int, Tuple[bool, str, Optional[str]]] = {}
+        self._by_author: Dict[str, array] = {}
+        self._by_personality: Dict[str, array] = {}
+        self._total_length = 0
+        self.last_id = 0
+        self._saved_id = 0
+        self._save_thread: Optional[threading.Thread] = None
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._lengths.clear()
+            self._meta.clear()
+            self._by_author.clear()
+            self._by_personality.clear()
+            self._total_length = 0
+            self.last_id = self._saved_id = 0
+
+    def add(self, post: Dict):
+        """Index a post; posts must arrive in id order, and ones already indexed are skipped"""
+        with self._lock:
+            self._add(post)
+        self._maybe_save()
+
+    def add_all(self, posts: Iterable[Dict]) -> int:
+        count = 0
+        with self._lock:
+            for post in posts:
+                count += self._add(post)
+        self._maybe_save()
+        return count
+
+    def _add(self, post: Dict) -> bool:
+        post_id = post["id"]
+        if post_id <= self.last_id:
+            return False
+        author = sys.intern((post.get("createdBy") or "").lower())
+        personality = sys.intern(post["aiPersonality"].lower()) if post.get("aiPersonality") else None
+        terms = Counter(tokenize(post.get("content", "")))
+        terms.update(tokenize(author))
+        for term, count in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("I"), array("I"))
+            postings[0].append(post_id)
+            postings[1].append(count)
+        length = sum(terms.values())
+        self._lengths[post_id] = length
+        self._meta[post_id] = (bool(post.get("isAI")), author, personality)
+        self._by_author.setdefault(author, array("I")).append(post_id)
+        if personality is not None:
+            self._by_personality.setdefault(personality, array("I")).append(post_id)
+        self._total_length += length
+        self.last_id = post_id
+        return True
+
+    def search(self, query: str, author: Optional[str] = None, is_ai: Optional[bool] = None,
+               personality: Optional[str] = None, offset: int = 0,
+               limit: int = 20) -> Tuple[List[Tuple[int, float]], int]:
+        """Rank posts matching any term of query, best first.
+
+        Returns a page of (post id, score) and how many posts matched (of
+        those scored). Filters match the author and personality
+        case-insensitively.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            scores = self._score(set(tokenize(query)), author.lower() if author is not None else None, is_ai,
+                                 personality.lower() if personality is not None else None)
+            # Ties go to the most recently scored, which is mostly the newest
+            ranked = [(post_id, scores[post_id])
+                      for post_id in heapq.nlargest(offset + limit, reversed(scores), key=scores.__getitem__)]
+        elapsed = time.perf_counter() - started
+        STORAGE_SECONDS.observe(elapsed, operation="search_query")
+        self.queries += 1
+        self.query_seconds += elapsed
+        return [(post_id, round(score, 4)) for post_id, score in ranked[offset:]], len(scores)
+
+    def _score(self, terms: set, author: Optional[str], is_ai: Optional[bool],
+               personality: Optional[str]) -> Dict[int, float]:
+        postings = sorted((self._postings[t] for t in terms if t in self._postings), key=lambda p: len(p[0]))
+        if not postings:
+            return {}
+        restrict = None
+        for index, key in ((self._by_author, author), (self._by_personality, personality)):
+            if key is None:
+                continue
+            matching = index.get(key)
+            if matching is None:
+                return {}
+            if restrict is None or len(matching) < len(restrict):
+                restrict = matching
+
+        count = len(self._lengths)
+        lengths = self._lengths
+        meta = self._meta
+        norm_base = K1 * (1 - B)
+        norm_per_token = K1 * B * count / self._total_length
+        filtered = author is not None or is_ai is not None or personality is not None
+        scores: Dict[int, float] = {}
+
+        def idf(ids: array) -> float:
+            return math.log(1 + (count - len(ids) + 0.5) / (len(ids) + 0.5))
+
+        def accepts(post_id: int) -> bool:
+            ai, name, persona = meta[post_id]
+            return ((is_ai is None or ai == is_ai) and (author is None or name == author) and
+                    (personality is None or persona == personality))
+
+        def scan(ids: array, tfs: array, start: int):
+            weight = idf(ids) * (K1 + 1)
+            get = scores.get
+            for post_id, tf in zip(ids[start:], tfs[start:]):
+                if filtered and not accepts(post_id):
+                    continue
+                scores[post_id] = get(post_id, 0.0) + weight * tf / (tf + norm_base + norm_per_token * lengths[post_id])
+
+        def probe(post_ids: List[int], terms: List[Tuple[array, array]]):
+            # A bisection per post and term costs about as much as scanning PROBE_COST postings
+            for ids, tfs in terms:
+                weight = idf(ids) * (K1 + 1)
+                size = len(ids)
+                for post_id in post_ids:
+                    position = bisect_left(ids, post_id)
+                    if position < size and ids[position] == post_id:
+                        tf = tfs[position]
+                        scores[post_id] = (scores.get(post_id, 0.0) +
+                                           weight * tf / (tf + norm_base + norm_per_token * lengths[post_id]))
+
+        budget = self.scan_limit
+        if restrict is not None and len(restrict) < len(postings[0][0]):
+            # The filters are more selective than any term: look their newest posts up directly
+            newest = restrict[-max(1, budget // (PROBE_COST * len(postings))):]
+            probe([post_id for post_id in newest if accepts(post_id)], postings)
+            return scores
+
+        # Rare terms are scanned in full, up to half the budget
+        rare = 0
+        while rare < len(postings) and len(postings[rare][0]) <= budget // 2:
+            budget -= len(postings[rare][0])
+            scan(*postings[rare], 0)
+            rare += 1
+        common = postings[rare:]
+        if not common:
+            return scores
+
+        # The common terms only within the newest posts, as far back as the budget reaches
+        low, high = 0, self.last_id + 1
+        while low < high:
+            middle = (low + high) // 2
+            if sum(len(ids) - bisect_left(ids, middle) for ids, _ in common) > budget:
+                low = middle + 1
+            else:
+                high = middle
+        older = [post_id for post_id in scores if post_id < low]
+        for ids, tfs in common:
+            scan(ids, tfs, bisect_left(ids, low))
+        # Older posts the rare terms found still get the common terms' share if that's cheap
+        if older and len(older) * len(common) * PROBE_COST <= self.scan_limit:
+            probe(older, common)
+        return scores
+
+    def stats(self) -> Dict:
+        return {
+            "posts": len(self._lengths),
+            "terms": len(self._postings),
+            "last_id": self.last_id,
+            "saved_id": self._saved_id,
+            "queries": self.queries,
+            "avg_query_ms": round(self.query_seconds / self.queries * 1000, 3) if self.queries else 0.0
+        }
+
+    def load(self) -> bool:
+        """Read the saved index, returning False (and leaving it empty) if there is none or it can't be used"""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with STORAGE_SECONDS.time(operation="search_index_load"):
+                document = read_document(self.path)
+                if document.get("version") != VERSION:
+                    logger.warning(f"Ignoring search index {self.path} of version {document.get('version')}")
+                    return False
+                with self._lock:
+                    self._restore(document)
+        except Exception as e:
+            logger.error(f"Error loading search index {self.path}, reindexing: {e}")
+            self.clear()
+            return False
+        logger.info(f"Loaded search index of {len(self._lengths)} posts up to post {self.last_id}")
+        return True
+
+    def _restore(self, document: Dict):
+        for post_id, length, author, ai, personality in document.get("posts", []):
+            self._lengths[post_id] = length
+            author = sys.intern(author)
+            personality = sys.intern(personality) if personality is not None else None
+            self._meta[post_id] = (ai, author, personality)
+            self._by_author.setdefault(author, array("I")).append(post_id)
+            if personality is not None:
+                self._by_personality.setdefault(personality, array("I")).append(post_id)
+            self._total_length += length
+        for term, ids, tfs in document.get("terms", []):
+            self._postings[term] = (array("I", ids), array("I", tfs))
+        self.last_id = self._saved_id = document["last_id"]
+
+    def _maybe_save(self):
+        if not self.write or self.last_id - self._saved_id < self.save_interval:
+            return
+        if self._save_thread is not None and self._save_thread.is_alive():
+            return
+        self._save_thread = threading.Thread(target=self.save, name="search-index", daemon=True)
+        self._save_thread.start()
+
+    def save(self):
+        """Write the index out; the arrays are copied under the lock and encoded outside it"""
+        try:
+            with self._lock:
+                last_id = self.last_id
+                posts = [(post_id, length, author, ai, personality)
+                         for (post_id, length), (ai, author, personality) in zip(self._lengths.items(),
+                                                                                 self._meta.values())]
+                terms = [(term, ids[:], tfs[:]) for term, (ids, tfs) in self._postings.items()]
+            with STORAGE_SECONDS.time(operation="search_index_save"):
+                write_file(self.path, split_sections({
+                    "posts": [list(post) for post in posts],
+                    "terms": [[term, ids.tolist(), tfs.tolist()] for term, ids, tfs in terms],
+                    "version": VERSION,
+                    "last_id": last_id
+                }), SECTIONS)
+            self._saved_id = last_id
+            logger.info(f"Saved search index of {len(posts)} posts up to post {last_id}")
+        except Exception as e:
+            logger.error(f"Error saving search index: {e}")
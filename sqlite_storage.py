@@ -0,0 +1,364 @@
+import json
+import sqlite3
+import threading
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+from concurrent.futures import Future
+from commit_queue import CommitQueue
+from event_log import EventLog, POST_CREATED, LIKE_TOGGLED, AI_REPLY_ADDED, utc_now
+from notification_store import NotificationStore, DEFAULT_READER
+from vault_lock import NO_LOCK
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY,
+    parent_id INTEGER,
+    created_when TEXT,
+    revision INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS posts_parent_id ON posts (parent_id);
+CREATE INDEX IF NOT EXISTS posts_created_when ON posts (created_when);
+CREATE INDEX IF NOT EXISTS posts_revision ON posts (revision);
+CREATE TABLE IF NOT EXISTS likes (
+    post_id INTEGER NOT NULL REFERENCES posts (id),
+    user TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (post_id, user)
+);
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY,
+    message TEXT NOT NULL,
+    post_id INTEGER,
+    timestamp TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS watermarks (reader TEXT PRIMARY KEY, seen_up_to INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+class Database:
+    """One SQLite file in WAL mode, with a connection per thread.
+
+    WAL lets readers run alongside the single writer without blocking, and
+    reusing each thread's connection keeps its prepared statement cache
+    warm. Writes are serialized with a lock and run in explicit
+    transactions.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self.write_lock = threading.RLock()
+        self.connection().executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                                   cached_statements=256, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # FULL syncs the WAL on every commit, so a committed batch survives power loss
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute("PRAGMA foreign_keys=OFF")
+            self._local.conn = conn
+        return conn
+
+    def query(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        return self.connection().execute(sql, params).fetchall()
+
+    def write(self, statements: List[Tuple[str, Tuple]]):
+        """Run statements in one write transaction"""
+        with self.write_lock:
+            conn = self.connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    conn.execute(sql, params)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def get_meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        rows = self.query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else default
+
+
+def _materialize(event: Dict) -> List[Tuple[str, Tuple]]:
+    """Statements that apply an event to the posts and likes tables, mirroring apply_event"""
+    data = event["data"]
+    if event["type"] in (POST_CREATED, AI_REPLY_ADDED):
+        post = {k: v for k, v in data.items() if k != "likes"}
+        return [
+            ("DELETE FROM likes WHERE post_id = ?", (data["id"],)),
+            ("INSERT OR REPLACE INTO posts (id, parent_id, created_when, revision, data) VALUES (?, ?, ?, ?, ?)",
+             (data["id"], data.get("parentId"), data.get("createdWhen"), event["seq"],
+              json.dumps(post, separators=(",", ":"))))
+        ]
+    if event["type"] == LIKE_TOGGLED:
+        if data["liked"]:
+            like = ("INSERT OR IGNORE INTO likes (post_id, user, seq) "
+                    "SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM posts WHERE id = ?)",
+                    (data["post_id"], data["user"], event["seq"], data["post_id"]))
+        else:
+            like = ("DELETE FROM likes WHERE post_id = ? AND user = ?", (data["post_id"], data["user"]))
+        return [like, ("UPDATE posts SET revision = ? WHERE id = ?", (event["seq"], data["post_id"]))]
+    return []
+
+
+class SQLiteEventLog(EventLog):
+    """The event log kept in SQLite, with the current posts and likes materialized alongside.
+
+    Each append writes the event and its effect on the posts and likes
+    tables in one transaction, so the latest state can be loaded with a
+    couple of indexed queries instead of replaying the log. Offsets are
+    event seqs: the offset just past an event is its own seq. Appends are
+    group committed, one transaction per batch.
+    """
+
+    def __init__(self, db: Database, max_batch: int = 256, max_latency: float = 0.002, vault_lock=NO_LOCK):
+        self.db = db
+        self.path = db.path
+        self._lock = threading.Lock()
+        self.vault_lock = vault_lock
+        self.commits = CommitQueue("events", self.append_events, max_batch, max_latency)
+        self.base = int(db.get_meta("base", "0"))
+        self.last_seq = db.query("SELECT MAX(seq) FROM events")[0][0] or int(db.get_meta("last_seq", "0"))
+        self.offset = self.last_seq
+        self.rollbacks = 0
+
+    def rollback(self) -> bool:
+        """After a failed group commit (its transaction was rolled back), go back to the last stored seq"""
+        with self._lock:
+            if self.commits.error is None:
+                return False
+            self.last_seq = self.db.query("SELECT MAX(seq) FROM events")[0][0] or int(self.db.get_meta("last_seq", "0"))
+            self.offset = self.last_seq
+            self.rollbacks += 1
+            self.commits.reset()
+            return True
+
+    def events_with_offsets(self, start_offset: int = 0) -> Iterator[Tuple[Dict, int]]:
+        end = self.offset
+        cursor = self.db.connection().execute(
+            "SELECT seq, type, timestamp, data FROM events WHERE seq > ? AND seq <= ? ORDER BY seq",
+            (start_offset, end))
+        for seq, event_type, timestamp, data in cursor:
+            yield {"seq": seq, "type": event_type, "timestamp": timestamp, "data": json.loads(data)}, seq
+
+    def follow(self) -> List[Dict]:
+        """Events other processes committed since this one last looked, oldest first"""
+        with self._lock:
+            events = [{"seq": seq, "type": event_type, "timestamp": timestamp, "data": json.loads(data)}
+                      for seq, event_type, timestamp, data in self.db.query(
+                          "SELECT seq, type, timestamp, data FROM events WHERE seq > ? ORDER BY seq",
+                          (self.last_seq,))]
+            if events:
+                self.last_seq = self.offset = events[-1]["seq"]
+            return events
+
+    def drop_before(self, offset: int) -> int:
+        """Delete events up to offset, returning the bytes of event data removed"""
+        if offset <= self.base:
+            return 0
+        with self._lock:
+            reclaimed = self.db.query("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM events WHERE seq <= ?",
+                                      (offset,))[0][0]
+            statements = [
+                ("DELETE FROM events WHERE seq <= ?", (offset,)),
+                ("INSERT OR REPLACE INTO meta (key, value) VALUES ('base', ?)", (str(offset),)),
+                ("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_seq', ?)", (str(self.last_seq),))
+            ]
+            # Remember when the newest dropped event happened, in case nothing newer is left
+            last = self.db.query("SELECT timestamp FROM events WHERE seq = ?", (offset,))
+            if last:
+                statements.append(("INSERT OR REPLACE INTO meta (key, value) VALUES ('timestamp', ?)", last[0]))
+            self.db.write(statements)
+            self.base = offset
+        return reclaimed
+
+    def append_events(self, events: List[Dict]):
+        """Store events that already have their seq and timestamp, in one transaction"""
+        statements = []
+        for event in events:
+            statements.append(("INSERT INTO events (seq, type, timestamp, data) VALUES (?, ?, ?, ?)",
+                               (event["seq"], event["type"], event["timestamp"],
+                                json.dumps(event["data"], separators=(",", ":")))))
+            statements += _materialize(event)
+        self.db.write(statements)
+        with self._lock:
+            self.last_seq = max(self.last_seq, events[-1]["seq"])
+            self.offset = max(self.offset, self.last_seq)
+
+    def append_nowait(self, event_type: str, data: Dict, timestamp: Optional[str] = None) -> Tuple[Dict, Future]:
+        with self._lock:
+            event = {
+                "seq": self.last_seq + 1,
+                "type": event_type,
+                "timestamp": timestamp or utc_now(),
+                "data": data
+            }
+            durable = self.commits.submit(event)
+            self.last_seq = self.offset = event["seq"]
+            return event, durable
+
+    def seed(self, checkpoint: Dict):
+        """Start an empty database from a checkpoint, for logs whose early events were compacted"""
+        statements = []
+        for post in checkpoint["posts"]:
+            statements += _materialize({"seq": checkpoint["seq"], "type": POST_CREATED, "data": post})
+            for user in post.get("likes", []):
+                statements += _materialize({"seq": checkpoint["seq"], "type": LIKE_TOGGLED,
+                                            "data": {"post_id": post["id"], "user": user, "liked": True}})
+        for post_id, revision in checkpoint["revisions"]:
+            statements.append(("UPDATE posts SET revision = ? WHERE id = ?", (revision, post_id)))
+        statements += [
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES ('base', ?)", (str(checkpoint["seq"]),)),
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_seq', ?)", (str(checkpoint["seq"]),)),
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES ('timestamp', ?)", (checkpoint["timestamp"],))
+        ]
+        with self._lock:
+            self.db.write(statements)
+            self.base = self.last_seq = self.offset = checkpoint["seq"]
+
+    def snapshot(self) -> Optional[Dict]:
+        """The current state in checkpoint form, read from the posts and likes tables"""
+        if self.is_empty():
+            return None
+        conn = self.db.connection()
+        conn.execute("BEGIN")
+        try:
+            seq = conn.execute("SELECT MAX(seq) FROM events").fetchone()[0]
+            row = conn.execute("SELECT timestamp FROM events WHERE seq = ?", (seq,)).fetchone() if seq else None
+            timestamp = row[0] if row else self.db.get_meta("timestamp")
+            likes: Dict[int, List[str]] = {}
+            for post_id, user in conn.execute("SELECT post_id, user FROM likes ORDER BY seq"):
+                likes.setdefault(post_id, []).append(user)
+            posts = []
+            revisions = []
+            for post_id, revision, data in conn.execute("SELECT id, revision, data FROM posts ORDER BY revision, id"):
+                post = json.loads(data)
+                post["likes"] = likes.get(post_id, [])
+                posts.append(post)
+                revisions.append([post_id, revision])
+        finally:
+            conn.execute("COMMIT")
+        posts.sort(key=lambda post: post["id"])
+        return {"seq": seq or self.last_seq, "timestamp": timestamp, "posts": posts, "revisions": revisions}
+
+
+class SQLiteNotificationStore(NotificationStore):
+    """Notifications and per-reader watermarks kept in SQLite tables"""
+
+    def __init__(self, db: Database, retention: int = 500, max_batch: int = 256, max_latency: float = 0.002,
+                 vault_lock=NO_LOCK):
+        self.db = db
+        self.retention = retention
+        self.vault_lock = vault_lock
+        self._lock = threading.Lock()
+        self.commits = CommitQueue("notifications", self._flush, max_batch, max_latency)
+        self.load()
+
+    def _flush(self, notifications: List[Dict]):
+        self.db.write([("INSERT INTO notifications (id, message, post_id, timestamp) VALUES (?, ?, ?, ?)",
+                        (n["id"], n["message"], n["post_id"], n["timestamp"])) for n in notifications])
+
+    def load(self):
+        self.last_id = self.db.query("SELECT COALESCE(MAX(id), 0) FROM notifications")[0][0]
+
+    def follow(self) -> List[Dict]:
+        """Notifications other processes added since this one last looked, oldest first"""
+        with self._lock:
+            rows = self.db.query("SELECT id, message, post_id, timestamp FROM notifications WHERE id > ? ORDER BY id",
+                                 (self.last_id,))
+            if rows:
+                self.last_id = rows[-1][0]
+            return [{"id": i, "message": m, "post_id": p, "timestamp": t} for i, m, p, t in rows]
+
+    def compact(self) -> int:
+        """Delete notifications beyond the retention window, returning the bytes of text removed"""
+        with self._lock:
+            self.commits.sync()
+            cutoff = self.last_id - self.retention
+            reclaimed = self.db.query("SELECT COALESCE(SUM(LENGTH(message)), 0) FROM notifications WHERE id <= ?",
+                                      (cutoff,))[0][0]
+            self.db.write([("DELETE FROM notifications WHERE id <= ?", (cutoff,))])
+            return reclaimed
+
+    def add(self, message: str, post_id: Optional[int] = None, timestamp: Optional[str] = None) -> Dict:
+        with self.vault_lock:
+            with self._lock:
+                notif = {
+                    "id": self.last_id + 1,
+                    "message": message,
+                    "post_id": post_id,
+                    "timestamp": timestamp or utc_now()
+                }
+                durable = self.commits.submit(notif)
+                self.last_id = notif["id"]
+            try:
+                durable.result()
+            except Exception:
+                self._roll_back()
+                raise
+        return dict(notif)
+
+    def _roll_back(self):
+        with self._lock:
+            if self.commits.error is None:
+                return
+            self.load()
+            self.commits.reset()
+
+    def seen_up_to(self, reader: str) -> int:
+        rows = self.db.query("SELECT reader, seen_up_to FROM watermarks WHERE reader IN (?, ?)",
+                             (reader, DEFAULT_READER))
+        watermarks = dict(rows)
+        return watermarks.get(reader, watermarks.get(DEFAULT_READER, 0))
+
+    def mark_seen(self, reader: str, up_to: Optional[int] = None) -> int:
+        with self.vault_lock, self._lock:
+            target = self.last_id if up_to is None else min(up_to, self.last_id)
+            watermark = max(self.seen_up_to(reader), target)
+            self.db.write([("INSERT OR REPLACE INTO watermarks (reader, seen_up_to) VALUES (?, ?)",
+                            (reader, watermark))])
+            return watermark
+
+    def unread_count(self, reader: str) -> int:
+        return max(0, min(self.retention, self.last_id - self.seen_up_to(reader)))
+
+    def since(self, since_id: int, reader: str) -> List[Dict]:
+        watermark = self.seen_up_to(reader)
+        rows = self.db.query(
+            "SELECT id, message, post_id, timestamp FROM notifications WHERE id > ? AND id > ? ORDER BY id",
+            (since_id, self.last_id - self.retention))
+        return [{"id": i, "message": m, "post_id": p, "timestamp": t, "seen": i <= watermark}
+                for i, m, p, t in rows]
+
+
+class SQLiteSettings:
+    """Settings as key/value rows, values stored as JSON"""
+
+    def __init__(self, db: Database, defaults: Dict):
+        self.db = db
+        if not db.query("SELECT 1 FROM settings LIMIT 1"):
+            self.save(defaults)
+
+    def get(self) -> Dict:
+        return {key: json.loads(value) for key, value in self.db.query("SELECT key, value FROM settings")}
+
+    def save(self, settings: Dict):
+        self.db.write([("DELETE FROM settings", ())] + [
+            ("INSERT INTO settings (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            for key, value in settings.items()
+        ])
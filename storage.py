@@ -0,0 +1,177 @@
+import json
+import os
+import threading
+import logging
+from typing import Dict, Optional
+from event_log import EventLog, Checkpoints
+from notification_store import NotificationStore
+from vault_lock import NO_LOCK, WriterLock
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("json", "sqlite")
+DEFAULT_SETTINGS = {"notifications_enabled": True}
+
+
+class JSONSettings:
+    """Settings in a JSON file, parsed again only when its mtime changes and rewritten atomically on save.
+
+    Saves happen under ``vault_lock``, as other processes may be saving too.
+    """
+
+    def __init__(self, path: str, defaults: Dict, vault_lock=NO_LOCK):
+        self.path = path
+        self.vault_lock = vault_lock
+        self._lock = threading.Lock()
+        self._settings = dict(defaults)
+        self._mtime = 0
+        with vault_lock:
+            # Another process may have created it first
+            if os.path.exists(path):
+                self._reload()
+            else:
+                self.save(self._settings)
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime != self._mtime:
+                with open(self.path, "r") as f:
+                    self._settings = json.load(f)
+                self._mtime = mtime
+        except Exception as e:
+            logger.error(f"Error loading settings: {e}")
+
+    def get(self) -> Dict:
+        # Another worker process may have saved since
+        self._reload()
+        return dict(self._settings)
+
+    def save(self, settings: Dict):
+        with self.vault_lock, self._lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(settings, f, indent=2)
+            os.replace(tmp_path, self.path)
+            self._settings = dict(settings)
+            self._mtime = os.stat(self.path).st_mtime_ns
+
+
+class Storage:
+    """The event log, notification store and settings of one vault, on one backend.
+
+    ``json`` keeps the append-only files in the vault directory; ``sqlite``
+    keeps everything in a single WAL-mode database next to them. Both expose
+    the same EventLog and NotificationStore interfaces, so the rest of the
+    app does not care which one is in use. Checkpoints stay files either way.
+    Posts, likes and notifications are written through group commits of up
+    to ``commit_batch`` mutations, waiting at most ``commit_latency``
+    seconds for a batch to fill.
+
+    With ``shared`` the vault may be used by several processes at once:
+    every write then happens under ``lock``, a WriterLock on vault.lock,
+    and each process follows what the others append.
+    """
+
+    def __init__(self, backend: str, vault_dir: str = "vault", notification_retention: int = 500,
+                 commit_batch: int = 256, commit_latency: float = 0.002, shared: bool = False):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown storage backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+        self.backend = backend
+        self.vault_dir = vault_dir
+        self.notification_retention = notification_retention
+        self.shared = shared
+        self.lock = WriterLock(self.path("vault.lock")) if shared else NO_LOCK
+        self.checkpoints = Checkpoints(self.path("checkpoints"))
+        if backend == "sqlite":
+            from sqlite_storage import Database, SQLiteEventLog, SQLiteNotificationStore, SQLiteSettings
+
+            self.db = Database(self.path("birdieee.db"))
+            self.event_log = SQLiteEventLog(self.db, commit_batch, commit_latency, self.lock)
+            with self.lock:
+                self.event_log.follow()
+                if self.event_log.is_empty() and self.db.get_meta("migrated") is None:
+                    migrate_json_to_sqlite(self)
+            self.notification_store = SQLiteNotificationStore(self.db, notification_retention,
+                                                              commit_batch, commit_latency, self.lock)
+            self.settings = SQLiteSettings(self.db, DEFAULT_SETTINGS)
+        else:
+            self.event_log = EventLog(self.path("events.jsonl"), commit_batch, commit_latency, self.lock)
+            self.notification_store = NotificationStore(self.path("notifications.jsonl"),
+                                                        self.path("notifications_seen.json"),
+                                                        notification_retention, commit_batch, commit_latency,
+                                                        self.lock)
+            self.settings = JSONSettings(self.path("settings.json"), DEFAULT_SETTINGS, self.lock)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.vault_dir, name)
+
+
+def migrate_json_to_sqlite(storage: Storage) -> Optional[Dict]:
+    """One-shot copy of the JSON vault files into a fresh SQLite database.
+
+    Events keep their seqs and timestamps. Checkpoint offsets are rewritten
+    to seqs, which is what offsets mean in the SQLite log, so switching back
+    to the JSON backend afterwards needs the checkpoints directory cleared.
+    """
+    db = storage.db
+    counts = {"events": 0, "notifications": 0, "settings": 0}
+    source_log = EventLog(storage.path("events.jsonl"))
+    offset = 0
+    if source_log.base > 0:
+        # The oldest events were compacted; start from the checkpoint they were folded into
+        entry = next((e for e in storage.checkpoints.index if e["offset"] == source_log.base), None)
+        if entry is None:
+            raise RuntimeError("No checkpoint matches the start of the compacted event log")
+        storage.event_log.seed(storage.checkpoints.load(entry))
+        offset = entry["offset"]
+    batch = []
+    for event in source_log.events(offset):
+        batch.append(event)
+        if len(batch) == 1000:
+            storage.event_log.append_events(batch)
+            batch = []
+        counts["events"] += 1
+    if batch:
+        storage.event_log.append_events(batch)
+
+    with storage.checkpoints._lock:
+        for entry in storage.checkpoints.index:
+            entry["offset"] = entry["seq"]
+        storage.checkpoints._save_index()
+
+    notif_path = storage.path("notifications.jsonl")
+    if os.path.exists(notif_path):
+        source = NotificationStore(notif_path, storage.path("notifications_seen.json"),
+                                   retention=storage.notification_retention)
+        statements = [("INSERT INTO notifications (id, message, post_id, timestamp) VALUES (?, ?, ?, ?)",
+                       (n["id"], n["message"], n.get("post_id"), n["timestamp"])) for n in source.since(0, "")]
+        statements += [("INSERT INTO watermarks (reader, seen_up_to) VALUES (?, ?)", item)
+                       for item in source._watermarks.items()]
+        db.write(statements)
+        counts["notifications"] = len(source._items)
+
+    settings_path = storage.path("settings.json")
+    if os.path.exists(settings_path):
+        settings = JSONSettings(settings_path, DEFAULT_SETTINGS).get()
+        db.write([("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+                  for key, value in settings.items()])
+        counts["settings"] = len(settings)
+
+    db.write([("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated', ?)", (json.dumps(counts),))])
+    logger.info(f"Migrated the JSON vault into {db.path}: {counts}")
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Migrate the JSON vault files into the SQLite backend")
+    parser.add_argument("--vault", default="vault", help="vault directory (default: vault)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if os.path.exists(os.path.join(args.vault, "birdieee.db")):
+        parser.error(f"{args.vault}/birdieee.db already exists")
+    # Opening an empty SQLite vault runs the migration
+    Storage("sqlite", args.vault)
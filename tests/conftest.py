@@ -0,0 +1,30 @@
+import os
+import sys
+import pytest
+
+# The app's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tests never reach the network; litellm would otherwise fetch its model cost map in the background on import
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """The Flask app, imported once with its vault in a temporary directory and the offline stub provider"""
+    with pytest.MonkeyPatch.context() as patch:
+        # The vault paths are relative to the working directory
+        patch.chdir(tmp_path_factory.mktemp("app"))
+        patch.setenv("LLM_STUB", "true")
+        patch.setenv("STORAGE_BACKEND", "json")
+        for name in ("WORKERS", "LLM_MODELS", "LLM_CACHE_DIR"):
+            patch.delenv(name, raising=False)
+        import app
+        # No AI replies get scheduled behind the tests' backs
+        patch.setattr(app, "llm", None)
+        yield app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,56 @@
+import pytest
+
+
+@pytest.mark.parametrize("parent_id", [[1], "abc", True, 1.5, 10 ** 6])
+def test_a_reply_to_no_valid_post_is_rejected_before_it_is_logged(app_module, client, parent_id):
+    root = client.post("/api/posts", json={"content": "hello", "createdBy": "alice"}).get_json()
+    seq = app_module.event_log.last_seq
+
+    response = client.post("/api/posts", json={"content": "orphan", "createdBy": "bob", "parentId": parent_id})
+    assert response.status_code == 400
+    assert app_module.event_log.last_seq == seq
+
+    reply = client.post("/api/posts", json={"content": "hi", "createdBy": "bob", "parentId": root["id"]})
+    assert reply.status_code == 201
+    assert reply.get_json()["id"] == root["id"] + 1
+
+
+def create(client, content, parent_id=None, author="alice"):
+    response = client.post("/api/posts", json={"content": content, "createdBy": author, "parentId": parent_id})
+    assert response.status_code == 201
+    return response.get_json()["id"]
+
+
+def test_threads_are_paged_newest_first(client):
+    roots = [create(client, f"thread {i}") for i in range(3)]
+    reply = create(client, "a reply", roots[0], "bob")
+    client.post(f"/api/posts/{reply}/like", json={"user": "carol"})
+
+    first = client.get("/api/threads?limit=2").get_json()
+    assert [t["id"] for t in first["threads"]] == [roots[2], roots[1]]
+    assert first["nextCursor"] == roots[1]
+    second = client.get(f"/api/threads?limit=2&cursor={first['nextCursor']}&user=carol").get_json()
+    thread = second["threads"][0]
+    assert thread["id"] == roots[0]
+    assert thread["replyCount"] == 1
+    assert thread["replies"][0]["id"] == reply and thread["replies"][0]["likedByMe"] is True
+    assert client.get(f"/api/threads/{reply}").get_json()["thread"]["id"] == roots[0]
+    assert client.get("/api/threads/999999").status_code == 404
+
+
+def test_threads_are_revalidated_by_revision(client):
+    create(client, "something new")
+    response = client.get("/api/threads")
+    etag = response.headers["ETag"]
+    assert etag == f'"r{response.get_json()["revision"]}"'
+
+    unchanged = client.get("/api/threads", headers={"If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.get_data() == b""
+    # The same revision tag holds whether or not the page was compressed
+    assert client.get("/api/threads", headers={"If-None-Match": etag[:-1] + '-gz"'}).status_code == 304
+
+    create(client, "and something newer")
+    changed = client.get("/api/threads", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
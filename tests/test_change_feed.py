@@ -0,0 +1,26 @@
+from change_feed import ChangeFeed
+
+
+def test_same_host_pages_may_read_the_feed_by_default():
+    feed = ChangeFeed()
+    assert feed.allows("http://example.com:5000", "example.com:5001")
+    assert not feed.allows("http://evil.test", "example.com:5001")
+    assert not feed.allows(None, "example.com:5001")
+    assert not feed.allows("http://example.com:5000", None)
+
+
+def test_configured_origins_replace_the_same_host_rule():
+    feed = ChangeFeed(allowed_origins=["https://birdieee.example"])
+    assert feed.allows("https://birdieee.example", "stream.example:5001")
+    assert not feed.allows("http://stream.example:5000", "stream.example:5001")
+
+
+def test_publish_before_the_server_starts_is_buffered():
+    feed = ChangeFeed(buffer_size=2)
+    feed.publish("post-created", {"id": 1})
+    feed.publish("post-created", {"id": 2})
+    feed.publish("post-created", {"id": 3})
+    assert [event[0] for event in feed.since(1)] == [2, 3]
+    # Older than the buffer reaches, or from before a restart
+    assert feed.since(0) is None
+    assert feed.since(10) is None
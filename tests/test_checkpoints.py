@@ -0,0 +1,97 @@
+import os
+from datetime import datetime, timezone
+import pytest
+from event_log import (EventLog, Checkpoints, HistoryCompacted, POST_CREATED, LIKE_TOGGLED, apply_event,
+                       events_between, parse_timestamp, state_at, to_record)
+
+
+def post(post_id):
+    return {"id": post_id, "parentId": None, "createdBy": "alice", "createdWhen": f"2024-01-0{post_id}T00:00:00Z",
+            "updatedWhen": f"2024-01-0{post_id}T00:00:00Z", "content": f"post {post_id}", "likes": [], "isAI": False}
+
+
+def at(day):
+    return datetime(2024, 1, day, 12, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def history(tmp_path):
+    """A log with one post per day on days 1-4 (each liked by bob the same day) and a checkpoint after day 2"""
+    log = EventLog(str(tmp_path / "events.jsonl"))
+    checkpoints = Checkpoints(str(tmp_path / "checkpoints"))
+    posts = {}
+    for day in range(1, 5):
+        for event_type, data in ((POST_CREATED, post(day)), (LIKE_TOGGLED, {"post_id": day, "user": "bob",
+                                                                             "liked": True})):
+            event = log.append(event_type, data, f"2024-01-0{day}T0{len(posts) % 2}:00:00Z")
+            apply_event(posts, event)
+        if day == 2:
+            checkpoints.write(event["seq"], event["timestamp"], log.offset, list(posts.values()),
+                              [[post_id, event["seq"]] for post_id in posts])
+    return log, checkpoints
+
+
+def test_state_at_matches_a_full_replay(history):
+    log, checkpoints = history
+    for day in range(1, 5):
+        posts = {}
+        for event in log.events():
+            if parse_timestamp(event["timestamp"]) <= at(day):
+                apply_event(posts, event)
+        revision, state = state_at(log, checkpoints, at(day))
+        assert revision == 2 * day
+        assert state == [to_record(p) for p in posts.values()]
+
+
+def test_checkpoints_survive_a_lost_index(history, tmp_path):
+    _, checkpoints = history
+    os.remove(tmp_path / "checkpoints" / "index.json")
+    rebuilt = Checkpoints(str(tmp_path / "checkpoints"))
+    assert rebuilt.index == checkpoints.index
+
+
+def test_offsets_stay_valid_after_dropping_events(history):
+    log, checkpoints = history
+    entry = checkpoints.latest
+    tail = list(log.events(entry["offset"]))
+    size = os.path.getsize(log.path)
+
+    reclaimed = log.drop_before(entry["offset"])
+    assert reclaimed > 0
+    assert log.base == entry["offset"]
+    assert list(log.events(entry["offset"])) == tail
+    assert list(log.events()) == tail
+
+    reopened = EventLog(log.path)
+    assert (reopened.base, reopened.offset, reopened.last_seq) == (log.base, log.offset, 8)
+    # Offsets are logical, so the end of the log is where it was before the drop
+    assert reopened.offset == size
+    event = reopened.append(POST_CREATED, post(5), "2024-01-05T00:00:00Z")
+    assert event["seq"] == 9
+    assert [e["seq"] for e in EventLog(log.path).events(entry["offset"])] == [5, 6, 7, 8, 9]
+
+
+def test_state_before_the_retained_history_is_compacted(history):
+    log, checkpoints = history
+    log.drop_before(checkpoints.latest["offset"])
+    with pytest.raises(HistoryCompacted, match="2024-01-02"):
+        state_at(log, checkpoints, at(1))
+    revision, state = state_at(log, checkpoints, at(3))
+    assert revision == 6
+    assert [p["id"] for p in state] == [1, 2, 3]
+
+
+def test_compacted_history_without_checkpoints(history, tmp_path):
+    log, checkpoints = history
+    log.drop_before(checkpoints.latest["offset"])
+    checkpoints.drop_before(100)
+    assert checkpoints.index == []
+    with pytest.raises(HistoryCompacted, match="Older history"):
+        state_at(log, checkpoints, at(1))
+
+
+def test_events_between_starts_from_the_nearest_checkpoint(history):
+    log, checkpoints = history
+    events = list(events_between(log, checkpoints, at(2), at(3)))
+    assert [e["seq"] for e in events] == [5, 6]
+    assert [e["seq"] for e in events_between(log, checkpoints, end=at(1))] == [1, 2]
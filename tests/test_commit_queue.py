@@ -0,0 +1,93 @@
+import threading
+import pytest
+from commit_queue import CommitQueue
+
+
+def test_concurrent_submitters_share_one_flush():
+    flushes = []
+    queue = CommitQueue("test", flushes.append, max_batch=8, max_latency=1.0)
+    barrier = threading.Barrier(8)
+    futures = []
+
+    def submit(i):
+        barrier.wait()
+        futures.append(queue.submit(i))
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for future in futures:
+        future.result(timeout=5)
+    # A full batch goes out at once instead of waiting for max_latency
+    assert len(flushes) == 1
+    assert sorted(flushes[0]) == list(range(8))
+    assert queue.stats()["largest_batch"] == 8
+
+
+def test_each_caller_waits_only_for_its_own_batch():
+    gate = threading.Event()
+    flushed = []
+
+    def flush(records):
+        if "slow" in records:
+            gate.wait(5)
+        flushed.extend(records)
+
+    queue = CommitQueue("test", flush, max_latency=0)
+    queue.submit("first").result(timeout=5)
+    slow = queue.submit("slow")
+    after = queue.submit("after")
+    assert not slow.done() and not after.done()
+    gate.set()
+    after.result(timeout=5)
+    assert slow.done()
+    assert flushed == ["first", "slow", "after"]
+
+
+def test_a_failed_flush_reaches_every_caller_of_the_batch_and_those_behind_it():
+    gate = threading.Event()
+    flushes = []
+
+    def flush(records):
+        flushes.append(records)
+        gate.wait(5)
+        if "bad" in records:
+            raise OSError(28, "No space left on device")
+
+    queue = CommitQueue("test", flush, max_batch=2, max_latency=0.5)
+    batch = [queue.submit("bad"), queue.submit("same batch")]
+    behind = queue.submit("behind")
+    gate.set()
+    for future in batch + [behind]:
+        with pytest.raises(OSError):
+            future.result(timeout=5)
+    assert flushes == [["bad", "same batch"]]
+
+    # Nothing is written until the owner has rolled back and reset the queue
+    with pytest.raises(OSError):
+        queue.submit("too early").result(timeout=5)
+    with pytest.raises(OSError):
+        queue.sync()
+    queue.reset()
+    queue.submit("again").result(timeout=5)
+    assert flushes[-1] == ["again"]
+    assert queue.stats()["failed"] == 3
+
+
+def test_sync_waits_for_everything_submitted():
+    gate = threading.Event()
+    flushed = []
+
+    def flush(records):
+        gate.wait(5)
+        flushed.extend(records)
+
+    queue = CommitQueue("test", flush, max_latency=0)
+    queue.sync()
+    queue.submit("a")
+    queue.submit("b")
+    threading.Timer(0.05, gate.set).start()
+    queue.sync()
+    assert flushed == ["a", "b"]
@@ -0,0 +1,84 @@
+import os
+from datetime import datetime, timedelta, timezone
+from compaction import Compactor
+from event_log import EventLog, Checkpoints, POST_CREATED, LIKE_TOGGLED, state_at
+from notification_store import NotificationStore
+from post_store import PostStore
+
+
+def stamp(days_ago):
+    moment = datetime.now(timezone.utc) - timedelta(days=days_ago)
+    return moment.isoformat().replace("+00:00", "Z")
+
+
+def post(post_id, days_ago):
+    return {"id": post_id, "parentId": None, "createdBy": "alice", "createdWhen": stamp(days_ago),
+            "updatedWhen": stamp(days_ago), "content": f"post {post_id}", "likes": [], "isAI": False}
+
+
+def make_vault(tmp_path):
+    """Posts 1-3 (liked by bob) from 40 days ago and posts 4-5 from today"""
+    log = EventLog(str(tmp_path / "events.jsonl"))
+    checkpoints = Checkpoints(str(tmp_path / "checkpoints"))
+    for post_id, days_ago in ((1, 40), (2, 40), (3, 40), (4, 0), (5, 0)):
+        log.append(POST_CREATED, post(post_id, days_ago), stamp(days_ago))
+        log.append(LIKE_TOGGLED, {"post_id": post_id, "user": "bob", "liked": True}, stamp(days_ago))
+    return log, checkpoints
+
+
+def test_old_history_is_folded_into_a_checkpoint(tmp_path):
+    log, checkpoints = make_vault(tmp_path)
+    before = PostStore(log).all_posts()
+    size = os.path.getsize(log.path)
+
+    report = Compactor(log, checkpoints, retention_days=30).run()
+    assert report["reclaimed"]["history"] > 0
+    assert os.path.getsize(log.path) < size
+    assert [entry["seq"] for entry in checkpoints.index] == [6]
+    assert log.base == checkpoints.index[0]["offset"]
+    assert [event["seq"] for event in log.events()] == [7, 8, 9, 10]
+
+    # Loading from the checkpoint and the rest of the log gives the same feed
+    reopened = EventLog(log.path)
+    assert PostStore(reopened, Checkpoints(str(tmp_path / "checkpoints"))).all_posts() == before
+    assert reopened.offset == log.offset
+
+
+def test_compaction_twice_drops_the_older_checkpoint(tmp_path):
+    log, checkpoints = make_vault(tmp_path)
+    Compactor(log, checkpoints, retention_days=30).run()
+    first = checkpoints.index[0]
+    Compactor(log, checkpoints, retention_days=-1).run()
+    assert [entry["seq"] for entry in checkpoints.index] == [10]
+    assert not os.path.exists(os.path.join(checkpoints.directory, first["file"]))
+    assert list(log.events()) == []
+    revision, posts = state_at(log, checkpoints, datetime.now(timezone.utc) + timedelta(seconds=1))
+    assert revision == 10
+    assert [p["likes"] for p in posts] == [["bob"]] * 5
+
+
+def test_history_is_kept_when_no_checkpoint_covers_the_compacted_log(tmp_path):
+    log, checkpoints = make_vault(tmp_path)
+    Compactor(log, checkpoints, retention_days=30).run()
+    checkpoints.drop_before(100)
+    base = log.base
+    assert Compactor(log, checkpoints, retention_days=-1).run()["reclaimed"]["history"] == 0
+    assert log.base == base
+
+
+def test_notifications_and_legacy_files(tmp_path):
+    log, checkpoints = make_vault(tmp_path)
+    notifications = NotificationStore(str(tmp_path / "notifications.jsonl"),
+                                      str(tmp_path / "notifications_seen.json"), retention=2)
+    for i in range(5):
+        notifications.add(f"notification {i}")
+    legacy = tmp_path / "posts.json"
+    legacy.write_text("[]")
+
+    report = Compactor(log, checkpoints, notification_store=notifications, retention_days=30,
+                       legacy_files=[str(legacy)]).run()
+    assert report["reclaimed"]["notifications"] > 0
+    assert report["reclaimed"]["legacy"] == 2
+    assert not legacy.exists()
+    reloaded = NotificationStore(str(tmp_path / "notifications.jsonl"), str(tmp_path / "notifications_seen.json"))
+    assert [n["id"] for n in reloaded.since(0, "alice")] == [4, 5]
@@ -0,0 +1,65 @@
+from context_builder import ContextBuilder, estimate_tokens
+
+HEAD = [{"role": "system", "content": "You are a test personality."}]
+TAIL = [{"role": "user", "content": "someone posted: what now?"}]
+
+
+def make_thread(count):
+    return [{"id": i, "createdBy": f"user{i}", "content": f"Message number {i} in this thread. More words follow."}
+            for i in range(1, count + 1)]
+
+
+def to_message(post):
+    return {"role": "user", "content": f"{post['createdBy']}: {post['content']}"}
+
+
+def summary_of(messages):
+    return next((m["content"] for m in messages if m["content"].startswith("Earlier in this thread")), None)
+
+
+def test_a_thread_that_fits_goes_in_verbatim():
+    builder = ContextBuilder(estimate_tokens, budget=1000)
+    messages, tokens = builder.build(HEAD, TAIL, make_thread(5), to_message, thread_id=1)
+    assert summary_of(messages) is None
+    assert len(messages) == 7
+    assert tokens <= 1000
+
+
+def test_older_messages_are_summarized_within_the_budget():
+    builder = ContextBuilder(estimate_tokens, budget=200, summary_tokens=100)
+    messages, tokens = builder.build(HEAD, TAIL, make_thread(40), to_message, thread_id=1)
+    summary = summary_of(messages)
+    assert summary is not None
+    assert "earlier messages not shown" in summary
+    # The newest message is verbatim, the summary ends just before the window
+    assert messages[-2]["content"].startswith("user40:")
+    first_verbatim = int(messages[2]["content"].split(":")[0][len("user"):])
+    assert f"- user{first_verbatim - 1}: Message number {first_verbatim - 1} in this thread." in summary
+    assert tokens <= 200
+    assert builder.stats()["prompts_with_summary"] == 1
+
+
+def test_cached_summaries_follow_post_ids_not_positions():
+    thread = make_thread(30)
+    cached = ContextBuilder(estimate_tokens, budget=250, summary_tokens=2000)
+    # Each reply leaves the post it answers out of the thread, so positions shift between replies
+    for answered in (10, 3, 25, 30, 1):
+        without = [post for post in thread if post["id"] != answered]
+        fresh = ContextBuilder(estimate_tokens, budget=250, summary_tokens=2000)
+        assert cached.build(HEAD, TAIL, without, to_message, thread_id=1) == \
+            fresh.build(HEAD, TAIL, without, to_message, thread_id=1)
+        summary = summary_of(cached.build(HEAD, TAIL, without, to_message, thread_id=1)[0])
+        lines = [line for line in summary.splitlines() if line.startswith("- user")]
+        assert len(lines) == len(set(lines))
+        assert f"- user{answered}:" not in summary
+
+
+def test_lines_dropped_to_fit_the_summary_stay_dropped():
+    thread = make_thread(60)
+    builder = ContextBuilder(estimate_tokens, budget=200, summary_tokens=60)
+    builder.build(HEAD, TAIL, thread[:40], to_message, thread_id=1)
+    summary = summary_of(builder.build(HEAD, TAIL, thread, to_message, thread_id=1)[0])
+    lines = [line for line in summary.splitlines() if line.startswith("- user")]
+    shown = [int(line.split(":")[0][len("- user"):]) for line in lines]
+    assert shown == sorted(shown) and len(shown) == len(set(shown))
+    assert builder._summaries[1]["tokens"] <= 60
@@ -0,0 +1,93 @@
+import json
+import os
+from event_log import EventLog, POST_CREATED, LIKE_TOGGLED, AI_REPLY_ADDED
+
+
+def post(post_id, likes=(), parent_id=None, is_ai=False):
+    return {"id": post_id, "parentId": parent_id, "createdBy": "alice", "createdWhen": "2024-01-01T00:00:00Z",
+            "updatedWhen": "2024-01-01T00:00:00Z", "content": f"post {post_id}", "likes": list(likes), "isAI": is_ai}
+
+
+def test_append_and_reopen(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    log = EventLog(path)
+    log.append(POST_CREATED, post(1))
+    log.append(LIKE_TOGGLED, {"post_id": 1, "user": "bob", "liked": True})
+
+    reopened = EventLog(path)
+    assert reopened.last_seq == 2
+    assert reopened.offset == os.path.getsize(path)
+    assert [event["seq"] for event in reopened.events()] == [1, 2]
+    assert reopened.replay() == [post(1, likes=["bob"])]
+
+
+def test_torn_tail_is_truncated_on_open(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    log = EventLog(path)
+    log.append(POST_CREATED, post(1))
+    intact = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(b'{"seq": 2, "type": "post_cre')
+
+    reopened = EventLog(path)
+    assert os.path.getsize(path) == intact
+    assert reopened.last_seq == 1
+    assert reopened.offset == intact
+
+    # The next append starts on a clean line
+    reopened.append(POST_CREATED, post(2))
+    assert [event["seq"] for event in EventLog(path).events()] == [1, 2]
+
+
+def test_torn_tail_left_by_another_writer_is_truncated_before_appending(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    log = EventLog(path)
+    log.append(POST_CREATED, post(1))
+    with open(path, "ab") as f:
+        f.write(b'{"seq": 2, "ty')
+
+    log.append(POST_CREATED, post(2))
+    with open(path, "rb") as f:
+        lines = f.read().splitlines()
+    assert [json.loads(line)["seq"] for line in lines] == [1, 2]
+
+
+def test_events_from_offset(tmp_path):
+    log = EventLog(str(tmp_path / "events.jsonl"))
+    log.append(POST_CREATED, post(1))
+    _, offset = next(log.events_with_offsets())
+    log.append(POST_CREATED, post(2))
+    assert [event["seq"] for event in log.events(offset)] == [2]
+
+
+def test_import_legacy_history(tmp_path):
+    history = [
+        {"timestamp": "2024-01-01T00:00:00Z", "messages": [post(1)]},
+        {"timestamp": "2024-01-01T00:01:00Z", "messages": [post(1, likes=["bob"]),
+                                                          post(2, parent_id=1, is_ai=True)]},
+        {"timestamp": "2024-01-01T00:02:00Z", "messages": [post(1, likes=["carol"]),
+                                                          post(2, parent_id=1, is_ai=True)]},
+    ]
+    history_path = tmp_path / "posts.json"
+    history_path.write_text(json.dumps(history))
+
+    log = EventLog(str(tmp_path / "events.jsonl"))
+    assert log.import_history(str(history_path)) == 5
+    events = list(log.events())
+    assert [(event["type"], event["timestamp"]) for event in events] == [
+        (POST_CREATED, "2024-01-01T00:00:00Z"),
+        (LIKE_TOGGLED, "2024-01-01T00:01:00Z"),
+        (AI_REPLY_ADDED, "2024-01-01T00:01:00Z"),
+        (LIKE_TOGGLED, "2024-01-01T00:02:00Z"),
+        (LIKE_TOGGLED, "2024-01-01T00:02:00Z"),
+    ]
+    assert events[3]["data"] == {"post_id": 1, "user": "bob", "liked": False}
+    assert log.replay() == [post(1, likes=["carol"]), post(2, parent_id=1, is_ai=True)]
+
+
+def test_unreadable_legacy_history_imports_nothing(tmp_path):
+    history_path = tmp_path / "posts.json"
+    history_path.write_text("[{")
+    log = EventLog(str(tmp_path / "events.jsonl"))
+    assert log.import_history(str(history_path)) == 0
+    assert log.is_empty()
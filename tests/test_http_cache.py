@@ -0,0 +1,131 @@
+import gzip
+import os
+import pytest
+from flask import Flask, jsonify, request
+from http_cache import IMMUTABLE, JSONCompressor, StaticAssets
+
+SCRIPT = "console.log('hello');\n" * 200
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    (tmp_path / "app.js").write_text(SCRIPT)
+    (tmp_path / "logo.png").write_bytes(b"\x89PNG not really an image")
+    (tmp_path / "index.html").write_text('<script src="/static/app.js"></script><img src="static/logo.png">')
+    return tmp_path
+
+
+@pytest.fixture
+def assets(static_dir):
+    return StaticAssets(str(static_dir))
+
+
+@pytest.fixture
+def client(assets):
+    app = Flask(__name__, static_folder=None)
+    compressor = JSONCompressor(min_size=100, level=5)
+
+    @app.route("/static/<path:filename>")
+    def serve_static(filename):
+        return assets.response(request, filename) or ("Not found", 404)
+
+    @app.route("/small")
+    def small():
+        return jsonify({"ok": True})
+
+    @app.route("/large")
+    def large():
+        return jsonify({"items": list(range(200))})
+
+    app.after_request(lambda response: compressor(request, response))
+    return app.test_client()
+
+
+def hashed_url(assets, name):
+    return assets._assets[name].url
+
+
+def test_html_refers_to_hashed_urls_served_as_immutable(assets, client):
+    url = hashed_url(assets, "app.js")
+    assert url.startswith("/static/app.") and url.endswith(".js") and url != "/static/app.js"
+    html = client.get("/static/index.html").get_data(as_text=True)
+    assert f'src="{url}"' in html
+    assert f'src="{hashed_url(assets, "logo.png")}"' in html
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == IMMUTABLE
+    assert response.get_data(as_text=True) == SCRIPT
+    plain = client.get("/static/app.js")
+    assert "no-cache" in plain.headers["Cache-Control"]
+    assert client.get("/static/missing.js").status_code == 404
+
+
+def test_compressed_variants_have_suffixed_etags_that_revalidate(client):
+    response = client.get("/static/app.js", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(response.get_data()).decode() == SCRIPT
+    etag = response.headers["ETag"]
+    assert etag.endswith('-gz"')
+
+    revalidated = client.get("/static/app.js", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert revalidated.status_code == 304
+    identity = client.get("/static/app.js", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in identity.headers
+    assert identity.headers["ETag"] == etag.replace("-gz", "")
+
+
+def test_ranges_are_served_from_the_identity_variant(client):
+    response = client.get("/static/app.js", headers={"Accept-Encoding": "identity", "Range": "bytes=0-6"})
+    assert response.status_code == 206
+    assert response.get_data() == b"console"
+    assert response.headers["Content-Range"] == f"bytes 0-6/{len(SCRIPT)}"
+    # Compressed variants are sent whole
+    compressed = client.get("/static/app.js", headers={"Accept-Encoding": "gzip", "Range": "bytes=0-6"})
+    assert compressed.status_code == 200
+
+
+def test_media_files_are_not_compressed(client):
+    response = client.get("/static/logo.png", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert "Vary" not in response.headers
+
+
+def test_watch_rebuilds_changed_files(static_dir):
+    watched = StaticAssets(str(static_dir), watch=True)
+    before = hashed_url(watched, "app.js")
+    (static_dir / "app.js").write_text("console.log('changed');\n")
+    # A coarse filesystem clock could leave the mtime as it was
+    os.utime(static_dir / "app.js", ns=(0, watched._assets["app.js"].mtime + 1))
+    watched._get("app.js")
+    assert hashed_url(watched, "app.js") != before
+
+
+def test_large_json_is_compressed_and_small_json_is_not(client):
+    large = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert large.headers["Content-Encoding"] == "gzip"
+    assert large.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(large.get_data()).startswith(b'{"items":[0,1,2')
+    assert large.headers["ETag"].endswith('-gz"')
+
+    small = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in small.headers
+    assert "Vary" not in small.headers
+
+
+def test_large_identity_json_still_varies_on_accept_encoding(client):
+    response = client.get("/large", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert not response.headers["ETag"].endswith('-gz"')
+
+
+def test_unchanged_json_is_answered_with_304(client):
+    etag = client.get("/large", headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+    revalidated = client.get("/large", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b""
+    assert revalidated.headers["Vary"] == "Accept-Encoding"
+    # The identity representation has a different ETag, so the gzip one does not match it
+    assert client.get("/large", headers={"Accept-Encoding": "identity", "If-None-Match": etag}).status_code == 200
@@ -0,0 +1,207 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+import pytest
+from background_loop import submit
+from llm_client import CircuitOpenError, LLMClient, litellm_transport, stub_transport
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def reply(text="ok"):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+def scripted(outcomes):
+    """A transport that fails with (or returns) the next of outcomes on each call, recording call times"""
+    calls = []
+
+    async def transport(**kwargs):
+        calls.append(time.monotonic())
+        outcome = outcomes.pop(0) if outcomes else reply()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    transport.calls = calls
+    return transport
+
+
+def run(coro):
+    return submit(coro).result(timeout=10)
+
+
+def test_calls_are_limited_per_model_and_overall():
+    in_flight = {}
+    peaks = {}
+
+    async def transport(model, **kwargs):
+        in_flight[model] = in_flight.get(model, 0) + 1
+        peaks[model] = max(peaks.get(model, 0), in_flight[model])
+        peaks["all"] = max(peaks.get("all", 0), sum(in_flight.values()))
+        await asyncio.sleep(0.02)
+        in_flight[model] -= 1
+        return reply()
+
+    client = LLMClient(transport, max_concurrency=3, per_model_concurrency=2)
+
+    async def burst():
+        await asyncio.gather(*(client.acall(model=m, messages=[]) for m in ["a"] * 6 + ["b"] * 6))
+
+    run(burst())
+    assert peaks == {"a": 2, "b": 2, "all": 3}
+    assert client.stats()["succeeded"] == 12
+
+
+def test_transient_errors_are_retried():
+    transport = scripted([ProviderError(503), ProviderError(429), reply("finally")])
+    client = LLMClient(transport, base_delay=0.001)
+    response = run(client.acall(model="m", messages=[]))
+    assert response.choices[0].message.content == "finally"
+    stats = client.stats()
+    assert (stats["retries"], stats["rate_limited"], stats["failed"]) == (2, 1, 0)
+
+
+def test_bad_requests_are_not_retried():
+    transport = scripted([ProviderError(400)])
+    client = LLMClient(transport, base_delay=0.001)
+    with pytest.raises(ProviderError):
+        run(client.acall(model="m", messages=[]))
+    assert len(transport.calls) == 1
+    # The request was at fault, not the provider
+    assert client.circuit("m").consecutive_failures == 0
+
+
+def test_retry_after_is_honoured():
+    transport = scripted([ProviderError(429, {"retry-after": "0.2"})])
+    client = LLMClient(transport, base_delay=0)
+    run(client.acall(model="m", messages=[]))
+    assert transport.calls[1] - transport.calls[0] >= 0.2
+
+
+def test_each_attempt_times_out():
+    async def slow(**kwargs):
+        await asyncio.sleep(1)
+
+    client = LLMClient(slow, timeout=0.05, max_retries=1, base_delay=0.001)
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        run(client.acall(model="m", messages=[]))
+    assert time.monotonic() - started < 0.5
+    assert client.stats()["retries"] == 1
+
+
+def test_circuit_opens_and_a_probe_closes_it():
+    healthy = threading.Event()
+
+    async def transport(**kwargs):
+        if not healthy.is_set():
+            raise ProviderError(503)
+        return reply()
+
+    client = LLMClient(transport, max_retries=0, failure_threshold=2, probe_interval=0.05)
+    for _ in range(2):
+        with pytest.raises(ProviderError):
+            run(client.acall(model="m", messages=[]))
+    assert client.is_open("m")
+    # While open, calls fail at once without reaching the provider
+    with pytest.raises(CircuitOpenError):
+        run(client.acall(model="m", messages=[]))
+    assert client.stats()["short_circuited"] == 1
+
+    healthy.set()
+    deadline = time.monotonic() + 5
+    while client.is_open("m"):
+        assert time.monotonic() < deadline, "the probe never closed the circuit"
+        time.sleep(0.01)
+    assert run(client.acall(model="m", messages=[])).choices[0].message.content == "ok"
+    assert client.stats()["circuits"]["m"]["times_opened"] == 1
+
+
+def test_streams_are_retried_until_the_first_text():
+    attempts = []
+
+    async def transport(stream=False, **kwargs):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ProviderError(502)
+
+        async def chunks():
+            for word in ("hello", " world"):
+                yield word
+
+        return chunks()
+
+    client = LLMClient(transport, base_delay=0.001)
+
+    async def collect():
+        return [text async for text in client.astream(model="m", messages=[])]
+
+    assert run(collect()) == ["hello", " world"]
+    assert len(attempts) == 2
+
+
+def test_stub_transport_is_repeatable_and_fails_on_request():
+    messages = [{"role": "user", "content": "tell me about otters"}, {"role": "system", "content": "be brief"}]
+    client = LLMClient(stub_transport(latency=0.01, seed=1))
+    first = run(client.acall(model="m", messages=messages)).choices[0].message.content
+    assert first == "stub reply about tell me about otters"
+
+    failing = LLMClient(stub_transport(latency=0.01, failure_rate=1), max_retries=1, base_delay=0.001)
+    with pytest.raises(Exception, match="unavailable"):
+        run(failing.acall(model="m", messages=messages))
+    assert failing.stats()["retries"] == 1
+
+
+class StubProvider(BaseHTTPRequestHandler):
+    """An OpenAI-compatible chat completions endpoint that answers 503 to the first request"""
+
+    requests = 0
+
+    def do_POST(self):
+        StubProvider.requests += 1
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if StubProvider.requests == 1:
+            self.send_response(503)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"error": {"message": "overloaded", "type": "server_error"}}')
+            return
+        body = json.dumps({
+            "id": "stub", "object": "chat.completion", "created": 0, "model": request["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "hi from the stub"}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_litellm_transport_against_a_local_stub_server():
+    pytest.importorskip("litellm")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubProvider)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        transport = litellm_transport(api_base=f"http://127.0.0.1:{server.server_port}/v1")
+        client = LLMClient(transport, base_delay=0.001, timeout=30)
+        response = run(client.acall(model="openai/stub-model", messages=[{"role": "user", "content": "hi"}],
+                                    api_key="not-a-real-key"))
+        assert response.choices[0].message.content == "hi from the stub"
+        assert StubProvider.requests == 2
+        assert client.stats()["retries"] == 1
+    finally:
+        server.shutdown()
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import pytest
+from background_loop import submit
+
+
+@pytest.fixture
+def integration(monkeypatch):
+    monkeypatch.setenv("LLM_STUB", "true")
+    monkeypatch.setenv("LLM_STUB_LATENCY_MS", "50")
+    monkeypatch.delenv("LLM_MODELS", raising=False)
+    monkeypatch.delenv("LLM_CACHE_DIR", raising=False)
+    from llm_integration import LLMIntegration
+    integration = LLMIntegration()
+    calls = []
+    transport = integration.client.transport
+
+    async def counting(**kwargs):
+        calls.append(kwargs["model"])
+        return await transport(**kwargs)
+
+    integration.client.transport = counting
+    integration.calls = calls
+    return integration
+
+
+def test_identical_streams_share_one_provider_call(integration):
+    personality = integration.personalities[0]
+    deltas = [[] for _ in range(3)]
+
+    async def run():
+        return await asyncio.gather(*(
+            integration.generate_reply_stream(personality, "hello there", deltas[i].append) for i in range(3)
+        ))
+
+    replies = submit(run()).result()
+    assert len(integration.calls) == 1
+    assert len(set(replies)) == 1 and replies[0].startswith("stub reply")
+    # The leader gets the words as they come, the others the whole reply at once
+    assert sorted(len(d) for d in deltas) == [1, 1, len(replies[0].split(" "))]
+    assert all("".join(d) == replies[0] for d in deltas)
+    assert integration.cache.stats()["coalesced"] == 2
+
+
+def test_a_cached_reply_arrives_as_one_delta(integration):
+    personality = integration.personalities[0]
+    first = submit(integration.generate_reply_stream(personality, "hello again", lambda _: None)).result()
+    deltas = []
+    second = submit(integration.generate_reply_stream(personality, "hello again", deltas.append)).result()
+    assert second == first
+    assert deltas == [first]
+    assert len(integration.calls) == 1
+
+
+def test_tokens_are_counted_off_the_event_loop(integration):
+    threads = set()
+    count_tokens = integration.context.count_tokens
+
+    def counting(text):
+        threads.add(threading.current_thread().name)
+        return count_tokens(text)
+
+    integration.context.count_tokens = counting
+    personality = integration.personalities[0]
+    context = [{"id": i, "createdBy": "alice", "content": f"message {i}"} for i in range(5)]
+    submit(integration.generate_reply_async(personality, "hello", context, thread_id=1)).result()
+    submit(integration.generate_reply_stream(personality, "hello", lambda _: None, context, thread_id=1)).result()
+    assert threads and "background-loop" not in threads
@@ -0,0 +1,79 @@
+import metrics
+from metrics import Registry
+
+
+def test_counters_and_gauges_keep_one_series_per_label_set():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests", ["method"])
+    requests.inc(method="GET")
+    requests.inc(2, method="GET")
+    requests.inc(method="POST")
+    depth = registry.gauge("queue_depth", "Queued jobs")
+    depth.set(3)
+    depth.set(1)
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{method="GET"} 3',
+        'requests_total{method="POST"} 1',
+        "# HELP queue_depth Queued jobs",
+        "# TYPE queue_depth gauge",
+        "queue_depth 1"
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    gauge = registry.gauge("files", "Files", ["name"])
+    gauge.set(1, name='say "hi"\\now\nplease')
+    assert 'files{name="say \\"hi\\"\\\\now\\nplease"} 1' in registry.render().splitlines()
+
+
+def test_histograms_render_cumulative_buckets_sum_and_count():
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency", ["op"], buckets=(0.1, 1, 0.5))
+    for value in (0.05, 0.1, 0.3, 2):
+        latency.observe(value, op="read")
+    with latency.time(op="write"):
+        pass
+    lines = registry.render().splitlines()
+    assert lines[:8] == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{op="read",le="0.1"} 2',
+        'latency_seconds_bucket{op="read",le="0.5"} 3',
+        'latency_seconds_bucket{op="read",le="1.0"} 3',
+        'latency_seconds_bucket{op="read",le="+Inf"} 4',
+        'latency_seconds_sum{op="read"} 2.45',
+        'latency_seconds_count{op="read"} 4'
+    ]
+    assert 'latency_seconds_bucket{op="write",le="0.1"} 1' in lines
+    assert 'latency_seconds_count{op="write"} 1' in lines
+
+
+def test_collectors_run_on_each_scrape_and_a_failing_one_is_skipped():
+    registry = Registry()
+    gauge = registry.gauge("scrapes", "Scrapes so far")
+    scrapes = []
+
+    def collect():
+        scrapes.append(1)
+        gauge.set(len(scrapes))
+
+    def broken():
+        raise RuntimeError("unavailable")
+
+    registry.add_collector(broken)
+    registry.add_collector(collect)
+    registry.render()
+    assert "scrapes 2" in registry.render().splitlines()
+
+
+def test_metrics_endpoint(client):
+    client.get("/api/posts")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type == metrics.CONTENT_TYPE
+    text = response.get_data(as_text=True)
+    assert "# TYPE birdieee_http_request_seconds histogram" in text
+    assert 'birdieee_http_request_seconds_count{route="/api/posts",method="GET",status="200"}' in text
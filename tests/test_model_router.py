@@ -0,0 +1,167 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+from background_loop import submit
+from llm_client import LLMClient
+from model_router import ModelRouter
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def fake_provider(latency=None, fail=None):
+    """A transport answering each model after latency[model] seconds, or failing with fail[model].
+
+    Records the models called, in order, and the ones whose call was cancelled.
+    """
+    latency = latency or {}
+    fail = fail or {}
+    calls = []
+    cancelled = []
+
+    async def transport(model, stream=False, **kwargs):
+        calls.append(model)
+        try:
+            await asyncio.sleep(latency.get(model, 0))
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        if model in fail:
+            raise fail[model]
+        if stream:
+            async def chunks():
+                for word in (model, " says", " hi"):
+                    yield word
+            return chunks()
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"{model} says hi"))])
+
+    transport.calls = calls
+    transport.cancelled = cancelled
+    return transport
+
+
+def router_for(transport, models, **kwargs):
+    client = LLMClient(transport, max_retries=0, failure_threshold=1, probe_interval=60)
+    kwargs.setdefault("default_hedge_delay", 0.1)
+    return ModelRouter(client, models, **kwargs)
+
+
+def run(coro):
+    return submit(coro).result(timeout=10)
+
+
+def test_a_slow_primary_is_hedged_after_the_delay():
+    transport = fake_provider(latency={"a": 2})
+    router = router_for(transport, ["a", "b"])
+    started = time.monotonic()
+    model, response = run(router.complete(messages=[]))
+    elapsed = time.monotonic() - started
+    assert model == "b" and response.choices[0].message.content == "b says hi"
+    assert 0.1 <= elapsed < 1
+    assert transport.calls == ["a", "b"]
+    stats = router.stats()
+    assert stats["hedged"] == 1 and stats["hedge_win_rate"] == 1.0
+    assert stats["models"]["b"]["hedge_wins"] == 1
+
+
+def test_the_losing_request_is_cancelled():
+    transport = fake_provider(latency={"a": 2})
+    router = router_for(transport, ["a", "b"])
+    run(router.complete(messages=[]))
+    run(asyncio.sleep(0.05))
+    assert transport.cancelled == ["a"]
+
+
+def test_a_prompt_primary_is_not_hedged():
+    transport = fake_provider(latency={"a": 0.01})
+    router = router_for(transport, ["a", "b"], default_hedge_delay=0.5)
+    assert run(router.complete(messages=[]))[0] == "a"
+    assert transport.calls == ["a"]
+    assert router.stats()["hedged"] == 0
+
+
+def test_hedging_can_be_turned_off():
+    transport = fake_provider(latency={"a": 0.3})
+    router = router_for(transport, ["a", "b"], hedge_percentile=0)
+    assert run(router.complete(messages=[]))[0] == "a"
+    assert transport.calls == ["a"]
+
+
+def test_the_hedge_delay_follows_observed_latency():
+    transport = fake_provider(latency={"a": 0.01})
+    router = router_for(transport, ["a", "b"], min_samples=3, default_hedge_delay=5)
+    assert router.hedge_delay("reply", "a") == 5
+    for _ in range(3):
+        run(router.complete(messages=[]))
+    assert router.hedge_delay("reply", "a") < 0.5
+
+
+def test_a_failed_model_hands_over_to_the_next_at_once():
+    transport = fake_provider(fail={"a": ProviderError(400)})
+    router = router_for(transport, ["a", "b", "c"], default_hedge_delay=5)
+    started = time.monotonic()
+    assert run(router.complete(messages=[]))[0] == "b"
+    assert time.monotonic() - started < 1
+    assert transport.calls == ["a", "b"]
+    assert router.stats()["failovers"] == 1
+
+
+def test_a_model_with_an_open_circuit_is_skipped():
+    transport = fake_provider(fail={"a": ProviderError(503)})
+    router = router_for(transport, ["a", "b"])
+    run(router.complete(messages=[]))
+    assert router.client.is_open("a")
+    transport.calls.clear()
+    assert run(router.complete(messages=[]))[0] == "b"
+    assert transport.calls == ["b"]
+
+
+def test_the_last_error_is_raised_when_every_model_fails():
+    transport = fake_provider(fail={"a": ProviderError(400), "b": ProviderError(401)})
+    router = router_for(transport, ["a", "b"])
+    with pytest.raises(ProviderError, match="401"):
+        run(router.complete(messages=[]))
+    assert router.stats()["failed"] == 1
+
+
+def test_a_stream_is_hedged_on_its_first_token():
+    transport = fake_provider(latency={"a": 2})
+    router = router_for(transport, ["a", "b"])
+
+    async def collect():
+        return [item async for item in router.stream(messages=[])]
+
+    assert run(collect()) == [("b", "b"), ("b", " says"), ("b", " hi")]
+    run(asyncio.sleep(0.05))
+    assert transport.cancelled == ["a"]
+
+
+@pytest.fixture
+def integration(monkeypatch):
+    monkeypatch.setenv("LLM_STUB", "true")
+    monkeypatch.setenv("LLM_MODELS", "main-a,main-b")
+    monkeypatch.setenv("LLM_MAX_RETRIES", "0")
+    monkeypatch.setenv("LLM_HEDGE_DEFAULT_MS", "5000")
+    monkeypatch.delenv("LLM_CACHE_DIR", raising=False)
+    from llm_integration import LLMIntegration
+    personality = LLMIntegration().personalities[0]
+    monkeypatch.setenv(f"LLM_MODELS_{personality.name.upper()}", "own-a,own-b,own-c")
+    return LLMIntegration()
+
+
+def test_failover_follows_the_personality_pool(integration):
+    own, other = integration.personalities[:2]
+    transport = fake_provider(fail={"own-a": ProviderError(500), "own-b": ProviderError(500)})
+    integration.client.transport = transport
+    assert integration.models_for(own) == ["own-a", "own-b", "own-c"]
+    assert integration.models_for(other) == ["main-a", "main-b"]
+
+    assert run(integration.generate_reply_async(own, "hello there")) == "own-c says hi"
+    assert transport.calls == ["own-a", "own-b", "own-c"]
+    transport.calls.clear()
+    assert run(integration.generate_reply_async(other, "hello there")) == "main-a says hi"
+    assert transport.calls == ["main-a"]
@@ -0,0 +1,95 @@
+import json
+from notification_store import DEFAULT_READER, NotificationStore
+
+
+def open_store(tmp_path, retention=3):
+    return NotificationStore(str(tmp_path / "notifications.jsonl"), str(tmp_path / "notifications_seen.json"),
+                             retention=retention)
+
+
+def test_only_the_latest_notifications_are_retained(tmp_path):
+    store = open_store(tmp_path)
+    for i in range(1, 6):
+        assert store.add(f"notification {i}", post_id=i)["id"] == i
+    assert [n["id"] for n in store.since(0, "alice")] == [3, 4, 5]
+    assert [n["id"] for n in store.since(4, "alice")] == [5]
+    assert store.last_id == 5
+
+
+def test_each_reader_has_a_watermark(tmp_path):
+    store = open_store(tmp_path, retention=10)
+    for i in range(4):
+        store.add(f"notification {i}")
+    assert store.mark_seen("alice", 2) == 2
+    assert store.unread_count("alice") == 2
+    assert store.unread_count("bob") == 4
+    assert [n["seen"] for n in store.since(0, "alice")] == [True, True, False, False]
+
+    # Watermarks never move back, nor past the latest notification
+    assert store.mark_seen("alice", 1) == 2
+    assert store.mark_seen("alice", 99) == 4
+    assert store.unread_count("alice") == 0
+
+    reopened = open_store(tmp_path, retention=10)
+    assert reopened.seen_up_to("alice") == 4
+    assert reopened.unread_count("bob") == 4
+
+
+def test_unread_count_is_capped_by_retention(tmp_path):
+    store = open_store(tmp_path)
+    for i in range(5):
+        store.add(f"notification {i}")
+    assert store.unread_count("alice") == 3
+    store.mark_seen("alice", 4)
+    assert store.unread_count("alice") == 1
+
+
+def test_legacy_seen_flags_become_the_default_watermark(tmp_path):
+    legacy = tmp_path / "notifications.json"
+    legacy.write_text(json.dumps([
+        {"id": 7, "message": "b", "post_id": 2, "timestamp": "2024-01-01T00:00:02", "seen": True},
+        {"id": 5, "message": "a", "post_id": 1, "timestamp": "2024-01-01T00:00:01", "seen": True},
+        {"id": 9, "message": "c", "post_id": 3, "timestamp": "2024-01-01T00:00:03", "seen": False},
+        {"id": 12, "message": "d", "post_id": 4, "timestamp": "2024-01-01T00:00:04", "seen": True}
+    ]))
+    store = open_store(tmp_path, retention=10)
+    assert store.import_legacy(str(legacy)) == 4
+
+    # Ids are renumbered in order, and only the seen prefix counts as seen
+    notifications = store.since(0, "carol")
+    assert [(n["id"], n["message"], n["post_id"]) for n in notifications] == [
+        (1, "a", 1), (2, "b", 2), (3, "c", 3), (4, "d", 4)
+    ]
+    assert notifications[0]["timestamp"] == "2024-01-01T00:00:01"
+    assert store.seen_up_to(DEFAULT_READER) == 2
+    assert [n["seen"] for n in notifications] == [True, True, False, False]
+    assert store.unread_count("carol") == 2
+    assert open_store(tmp_path).import_legacy(str(tmp_path / "missing.json")) == 0
+
+
+def test_the_log_is_rewritten_once_it_holds_twice_the_retention(tmp_path):
+    path = tmp_path / "notifications.jsonl"
+    store = open_store(tmp_path)
+    for i in range(6):
+        store.add(f"notification {i}")
+    # Not yet past twice the retention
+    assert len(open_store(tmp_path).since(0, "alice")) == 3
+    assert len(path.read_bytes().splitlines()) == 6
+
+    store = open_store(tmp_path)
+    store.add("notification 6")
+    reopened = open_store(tmp_path)
+    assert [json.loads(line)["id"] for line in path.read_bytes().splitlines()] == [5, 6, 7]
+    assert [n["id"] for n in reopened.since(0, "alice")] == [5, 6, 7]
+    assert reopened.add("after the rewrite")["id"] == 8
+
+
+def test_follow_picks_up_notifications_added_elsewhere(tmp_path):
+    mine = open_store(tmp_path, retention=10)
+    theirs = open_store(tmp_path, retention=10)
+    theirs.add("from another process")
+    theirs.mark_seen("alice")
+    assert [n["message"] for n in mine.follow()] == ["from another process"]
+    assert mine.follow() == []
+    assert mine.unread_count("alice") == 0
+    assert mine.add("and one from here")["id"] == 2
@@ -0,0 +1,212 @@
+import os
+import threading
+import pytest
+from event_log import EventLog, Checkpoints
+from notification_store import NotificationStore
+from post_store import PostStore
+from storage import Storage
+
+
+@pytest.fixture
+def failing_fsync(monkeypatch):
+    """Calling the returned function makes every fsync fail as if the disk were full, until called with False"""
+    real_fsync = os.fsync
+
+    def set_failing(failing=True):
+        def fsync(fd):
+            if failing:
+                raise OSError(28, "No space left on device")
+            real_fsync(fd)
+        monkeypatch.setattr(os, "fsync", fsync)
+
+    return set_failing
+
+
+def test_posts_replies_and_likes(tmp_path):
+    store = PostStore(EventLog(str(tmp_path / "events.jsonl")))
+    root = store.create_post("hello", "alice")
+    reply = store.create_post("hi", "bob", parent_id=root["id"])
+    store.create_post("nested", "carol", parent_id=reply["id"])
+    assert store.toggle_like(root["id"], "bob") == ("liked", 1)
+    assert store.toggle_like(root["id"], "bob") == ("unliked", 0)
+    assert store.toggle_like(99, "bob") is None
+
+    assert [p["id"] for p in store.thread(root["id"])] == [1, 2, 3]
+    tree = store.thread_tree(3)
+    assert tree["replyCount"] == 2
+    assert tree["replies"][0]["replies"][0]["id"] == 3
+    assert [p["id"] for p in store.changes_since(3)] == [1]
+    assert store.revision == 5
+
+
+def test_a_failed_commit_is_rolled_back(tmp_path, failing_fsync):
+    log = EventLog(str(tmp_path / "events.jsonl"))
+    store = PostStore(log)
+    heard = []
+    store.add_listener(lambda event, post: heard.append(event["seq"]))
+    first = store.create_post("hello", "alice")
+    size = os.path.getsize(log.path)
+
+    failing_fsync()
+    with pytest.raises(OSError):
+        store.create_post("lost", "bob")
+    with pytest.raises(OSError):
+        store.toggle_like(first["id"], "bob")
+
+    # Nothing of the failed commits is served, written or announced
+    assert store.get(2) is None
+    assert store.get(first["id"])["likeCount"] == 0
+    assert store.revision == 1
+    assert os.path.getsize(log.path) == size
+    assert (log.last_seq, log.offset) == (1, size)
+    assert heard == [1]
+
+    failing_fsync(False)
+    second = store.create_post("kept", "bob")
+    assert second["id"] == 2
+    assert heard == [1, 2]
+    reopened = EventLog(log.path)
+    assert [e["seq"] for e in reopened.events()] == [1, 2]
+    assert [p["content"] for p in PostStore(reopened).all_posts()] == ["hello", "kept"]
+
+
+def test_concurrent_callers_of_a_failed_batch_all_fail(tmp_path, failing_fsync):
+    log = EventLog(str(tmp_path / "events.jsonl"), max_latency=0.05)
+    store = PostStore(log)
+    failing_fsync()
+    errors = []
+
+    def post(i):
+        try:
+            store.create_post(f"post {i}", "alice")
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 5
+    assert store.all_posts() == []
+    failing_fsync(False)
+    assert store.create_post("after", "alice")["id"] == 1
+    assert log.last_seq == 1
+
+
+def test_no_checkpoint_records_a_rolled_back_commit(tmp_path, failing_fsync):
+    log = EventLog(str(tmp_path / "events.jsonl"))
+    checkpoints = Checkpoints(str(tmp_path / "checkpoints"))
+    store = PostStore(log, checkpoints, checkpoint_interval=1)
+    store.create_post("hello", "alice")
+    store._checkpoint_thread.join()
+    failing_fsync()
+    with pytest.raises(OSError):
+        store.create_post("lost", "bob")
+    if store._checkpoint_thread is not None:
+        store._checkpoint_thread.join()
+    failing_fsync(False)
+    assert all(entry["seq"] <= 1 and entry["offset"] <= log.offset for entry in checkpoints.index)
+    reloaded = PostStore(EventLog(log.path), Checkpoints(str(tmp_path / "checkpoints")))
+    assert [p["content"] for p in reloaded.all_posts()] == ["hello"]
+
+
+def test_a_failed_notification_is_rolled_back(tmp_path, monkeypatch):
+    store = NotificationStore(str(tmp_path / "notifications.jsonl"), str(tmp_path / "seen.json"))
+    store.add("first")
+
+    def fsync(fd):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(os, "fsync", fsync)
+    with pytest.raises(OSError):
+        store.add("lost")
+    assert store.last_id == 1
+    assert [n["message"] for n in store.since(0, "alice")] == ["first"]
+    monkeypatch.undo()
+    assert store.add("second")["id"] == 2
+    reloaded = NotificationStore(str(tmp_path / "notifications.jsonl"), str(tmp_path / "seen.json"))
+    assert [n["message"] for n in reloaded.since(0, "alice")] == ["first", "second"]
+
+
+def test_a_failed_sqlite_commit_is_rolled_back(tmp_path, monkeypatch):
+    storage = Storage("sqlite", str(tmp_path))
+    store = PostStore(storage.event_log, storage.checkpoints)
+    store.create_post("hello", "alice")
+
+    def fail(statements):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(storage.db, "write", fail)
+    with pytest.raises(OSError):
+        store.create_post("lost", "bob")
+    with pytest.raises(OSError):
+        storage.notification_store.add("lost")
+    monkeypatch.undo()
+    assert store.get(2) is None
+    assert store.create_post("kept", "bob")["id"] == 2
+    assert storage.notification_store.add("kept")["id"] == 1
+    assert [p["content"] for p in PostStore(storage.event_log).all_posts()] == ["hello", "kept"]
+
+
+@pytest.mark.parametrize("parent_id", [[1], "1", 7])
+def test_a_reply_to_a_missing_parent_never_reaches_the_log(tmp_path, parent_id):
+    path = str(tmp_path / "events.jsonl")
+    store = PostStore(EventLog(path))
+    store.create_post("hello", "alice")
+    with pytest.raises(ValueError):
+        store.create_post("orphan", "bob", parent_id=parent_id)
+    assert store.create_post("hi", "bob", parent_id=1)["id"] == 2
+
+    reloaded = PostStore(EventLog(path))
+    assert [(p["id"], p["parentId"]) for p in reloaded.all_posts()] == [(1, None), (2, 1)]
+
+
+def build_threads(store):
+    """Three threads: 1 with a reply chain, 4 alone, 5 with four replies to its root"""
+    store.create_post("first", "alice")
+    store.create_post("reply", "bob", parent_id=1)
+    store.create_post("reply to the reply", "carol", parent_id=2)
+    store.create_post("second", "alice")
+    store.create_post("third", "alice")
+    for i in range(4):
+        store.create_post(f"answer {i}", "bob", parent_id=5)
+    store.toggle_like(3, "alice")
+
+
+def page_summary(threads):
+    def replies(node):
+        return [(reply["id"], replies(reply)) for reply in node["replies"]]
+    return [(t["id"], t["replyCount"], t["lastActivity"], replies(t)) for t in threads]
+
+
+def test_threads_page_through_cursors_after_replay_and_from_a_checkpoint(tmp_path):
+    log = EventLog(str(tmp_path / "events.jsonl"))
+    checkpoints = Checkpoints(str(tmp_path / "checkpoints"))
+    store = PostStore(log, checkpoints, checkpoint_interval=4)
+    build_threads(store)
+    store._checkpoint_thread.join()
+    assert checkpoints.index
+
+    page, cursor = store.threads_page(limit=2, replies=3)
+    assert [t["id"] for t in page] == [5, 4] and cursor == 4
+    # Only the first three replies are nested, but the stats count them all
+    assert page_summary(page)[0][1] == 4
+    assert [r["id"] for r in page[0]["replies"]] == [6, 7, 8]
+    assert page[0]["lastActivity"] == store.get(9)["createdWhen"]
+    assert page[1]["replyCount"] == 0 and page[1]["replies"] == []
+    rest, cursor = store.threads_page(cursor, limit=2, replies=3)
+    assert [t["id"] for t in rest] == [1] and cursor is None
+    assert page_summary(rest) == [(1, 2, store.get(3)["createdWhen"], [(2, [(3, [])])])]
+
+    tree = store.thread_tree(3)
+    assert tree["id"] == 1 and tree["replies"][0]["replies"][0]["likeCount"] == 1
+    assert store.thread_tree(99) is None
+
+    expected = page_summary(store.threads_page(limit=10, replies=10)[0])
+    replayed = PostStore(EventLog(log.path))
+    assert page_summary(replayed.threads_page(limit=10, replies=10)[0]) == expected
+    from_checkpoint = PostStore(EventLog(log.path), Checkpoints(str(tmp_path / "checkpoints")))
+    assert from_checkpoint._checkpoint_seq > 0
+    assert page_summary(from_checkpoint.threads_page(limit=10, replies=10)[0]) == expected
+    assert from_checkpoint.thread_tree(3) == tree
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import pytest
+from background_loop import submit
+from reply_cache import ReplyCache
+
+
+def test_keys_ignore_whitespace_differences():
+    a = ReplyCache.make_key("m", [{"role": "user", "content": "hello   world "}])
+    b = ReplyCache.make_key("m", [{"role": "user", "content": "hello world"}])
+    assert a == b
+    assert a != ReplyCache.make_key("other", [{"role": "user", "content": "hello world"}])
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = ReplyCache(ttl=-1)
+    cache.put("k", "v")
+    assert cache.get("k") is None
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    ReplyCache(disk_dir=str(tmp_path)).put("k", "v")
+    cache = ReplyCache(disk_dir=str(tmp_path))
+    assert cache.get("k") == "v"
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_concurrent_identical_requests_share_one_call():
+    cache = ReplyCache()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return "reply"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while cache.stats()["coalesced"] < 3:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["reply"] * 4
+    assert len(calls) == 1
+
+
+def test_followers_get_the_leaders_error():
+    cache = ReplyCache()
+
+    async def run():
+        started = asyncio.Event()
+
+        async def fail():
+            started.set()
+            await asyncio.sleep(0.01)
+            raise RuntimeError("provider down")
+
+        async def follow():
+            await started.wait()
+            return await cache.get_or_compute_async("k", fail)
+
+        return await asyncio.gather(cache.get_or_compute_async("k", fail), follow(), return_exceptions=True)
+
+    results = submit(run()).result()
+    assert [str(result) for result in results] == ["provider down"] * 2
+    assert cache.get("k") is None
+    with pytest.raises(RuntimeError):
+        submit(cache.get_or_compute_async("k", _raise)).result()
+
+
+async def _raise():
+    raise RuntimeError("still down")
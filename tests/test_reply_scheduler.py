@@ -0,0 +1,112 @@
+import asyncio
+import time
+from reply_scheduler import ReplyScheduler
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_jobs_run_once_in_due_order(tmp_path):
+    ran = []
+
+    async def handler(job):
+        ran.append(job["post_id"])
+
+    scheduler = ReplyScheduler(str(tmp_path / "reply_queue.jsonl"), handler)
+    scheduler.start()
+    scheduler.schedule({"post_id": 2}, 0.05)
+    scheduler.schedule({"post_id": 1}, 0)
+    assert scheduler.schedule({"post_id": 1}, 0) is None
+    wait_for(lambda: scheduler.completed == 2)
+    assert ran == [1, 2]
+    assert scheduler.status()["skipped"] == 1
+
+
+def test_pending_jobs_survive_a_restart(tmp_path):
+    queue_file = str(tmp_path / "reply_queue.jsonl")
+    first = ReplyScheduler(queue_file, handler=None)
+    first.schedule({"post_id": 1}, 0.05)
+
+    ran = []
+
+    async def handler(job):
+        ran.append(job["post_id"])
+
+    second = ReplyScheduler(queue_file, handler)
+    second.start()
+    wait_for(lambda: second.completed == 1)
+    assert ran == [1]
+
+
+def test_replied_posts_are_not_scheduled_again_after_compaction(tmp_path):
+    queue_file = str(tmp_path / "reply_queue.jsonl")
+
+    async def handler(job):
+        await asyncio.sleep(0)
+
+    first = ReplyScheduler(queue_file, handler)
+    first.start()
+    first.schedule({"post_id": 1}, 0)
+    wait_for(lambda: b'"done"' in (tmp_path / "reply_queue.jsonl").read_bytes())
+    # The done job is dropped from the journal, but not the fact that post 1 has its reply
+    first.compact()
+    assert b'"done"' not in (tmp_path / "reply_queue.jsonl").read_bytes()
+
+    restarted = ReplyScheduler(queue_file, handler)
+    restarted.start()
+    assert restarted.schedule({"post_id": 1}, 0) is None
+    assert restarted.schedule({"post_id": 2}, 0) is not None
+
+
+def test_journal_errors_do_not_stop_dispatching(tmp_path, monkeypatch):
+    ran = []
+
+    async def handler(job):
+        ran.append(job["post_id"])
+
+    scheduler = ReplyScheduler(str(tmp_path / "reply_queue.jsonl"), handler, poll_interval=0.01)
+    scheduler.start()
+    journal = scheduler._journal
+    failures = []
+
+    def failing(entry=None):
+        if len(failures) < 3:
+            failures.append(entry)
+            raise OSError(5, "Input/output error")
+        return journal(entry)
+
+    monkeypatch.setattr(scheduler, "_journal", failing)
+    scheduler.schedule({"post_id": 1}, 0)
+    wait_for(lambda: scheduler.completed == 1)
+    wait_for(lambda: len(failures) == 3)
+    # The poll keeps going after the errors, and jobs scheduled later still run
+    scheduler.schedule({"post_id": 2}, 0)
+    wait_for(lambda: ran == [1, 2])
+    assert scheduler.status()["journal_errors"] == 3
+
+
+def test_only_the_latest_replied_posts_are_kept_by_id(tmp_path):
+    queue_file = str(tmp_path / "reply_queue.jsonl")
+
+    async def handler(job):
+        await asyncio.sleep(0)
+
+    scheduler = ReplyScheduler(queue_file, handler, replied_kept=3)
+    scheduler.start()
+    for post_id in range(1, 11):
+        scheduler.schedule({"post_id": post_id}, 0)
+    wait_for(lambda: scheduler.completed == 10)
+    wait_for(lambda: (tmp_path / "reply_queue.jsonl").read_bytes().count(b'"done"') == 10)
+    scheduler.compact()
+    assert len(scheduler._scheduled_posts) == 3
+
+    restarted = ReplyScheduler(queue_file, handler, replied_kept=3)
+    restarted.start()
+    assert restarted._scheduled_posts == {8, 9, 10}
+    # Older posts are still covered by the watermark
+    assert all(restarted.schedule({"post_id": post_id}, 0) is None for post_id in range(1, 11))
+    assert restarted.schedule({"post_id": 11}, 0) is not None
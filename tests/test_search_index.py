@@ -0,0 +1,143 @@
+from search_index import SearchIndex, tokenize
+
+
+def make_post(post_id, content, author="alice", personality=None):
+    return {"id": post_id, "content": content, "createdBy": author, "isAI": personality is not None,
+            "aiPersonality": personality}
+
+
+def open_index(tmp_path, **kwargs):
+    return SearchIndex(str(tmp_path / "search_index.brdv"), **kwargs)
+
+
+def ids(result):
+    return [post_id for post_id, _ in result[0]]
+
+
+def test_tokenize_lowercases_words():
+    assert tokenize("Hello, WORLD! it's 2024") == ["hello", "world", "it", "s", "2024"]
+    assert tokenize("") == []
+
+
+def test_bm25_prefers_rare_terms_repeated_terms_and_short_posts(tmp_path):
+    index = open_index(tmp_path)
+    assert index.add_all([
+        make_post(1, "coffee is good"),
+        make_post(2, "coffee coffee coffee all day"),
+        make_post(3, "coffee and a long list of other words that dilute the match a lot"),
+        make_post(4, "tea is good"),
+        make_post(5, "coffee again"),
+    ]) == 5
+    hits, total = index.search("coffee")
+    assert total == 4
+    assert [post_id for post_id, _ in hits][0] == 2
+    assert [post_id for post_id, _ in hits][-1] == 3
+    assert all(a[1] >= b[1] for a, b in zip(hits, hits[1:]))
+
+    # The rare term outweighs the common one
+    assert ids(index.search("coffee tea"))[0] == 4
+    # Authors are searchable too, and paging slices the ranking
+    assert index.search("alice")[1] == 5
+    assert ids(index.search("coffee", offset=1, limit=2)) == ids(index.search("coffee"))[1:3]
+    assert index.search("nothing here") == ([], 0)
+
+
+def test_filters_match_author_ai_and_personality(tmp_path):
+    index = open_index(tmp_path)
+    index.add_all([
+        make_post(1, "rain again today", author="Alice"),
+        make_post(2, "rain is poetry", author="bot", personality="Poet"),
+        make_post(3, "rain means umbrellas", author="bot", personality="Skeptic"),
+        make_post(4, "rain rain rain", author="bob"),
+    ])
+    assert sorted(ids(index.search("rain", author="alice"))) == [1]
+    assert sorted(ids(index.search("rain", author="BOT"))) == [2, 3]
+    assert sorted(ids(index.search("rain", is_ai=False))) == [1, 4]
+    assert sorted(ids(index.search("rain", is_ai=True))) == [2, 3]
+    assert ids(index.search("rain", personality="poet")) == [2]
+    assert ids(index.search("rain", author="bot", personality="skeptic")) == [3]
+    assert index.search("rain", author="nobody") == ([], 0)
+    assert index.search("rain", author="alice", is_ai=True) == ([], 0)
+
+
+def test_a_selective_filter_looks_up_its_newest_posts(tmp_path):
+    index = open_index(tmp_path, scan_limit=40)
+    index.add_all([make_post(i, "common words everywhere", author="carol" if i % 10 == 0 else "alice")
+                   for i in range(1, 101)])
+    hits, total = index.search("common words", author="carol")
+    # Only as many of carol's newest posts as the budget allows: 40 // (8 * 2 terms)
+    assert total == 2
+    assert sorted(post_id for post_id, _ in hits) == [90, 100]
+
+
+def test_common_terms_are_scanned_only_among_the_newest_posts(tmp_path):
+    index = open_index(tmp_path, scan_limit=10)
+    index.add_all([make_post(1, "hello unique")] + [make_post(i, "hello there") for i in range(2, 51)])
+
+    hits, total = index.search("hello")
+    # 50 posts match, but only the newest the budget reaches are scored
+    assert total == 10
+    assert sorted(post_id for post_id, _ in hits) == list(range(41, 51))
+
+    # An older post found by a rare term is still scored for the common one
+    hits, total = index.search("hello unique")
+    assert hits[0][0] == 1
+    assert total == 10
+    assert hits[0][1] > index.search("unique")[0][0][1]
+
+    unlimited = open_index(tmp_path, scan_limit=1000)
+    unlimited.add_all([make_post(1, "hello unique")] + [make_post(i, "hello there") for i in range(2, 51)])
+    assert unlimited.search("hello")[1] == 50
+
+
+def test_posts_already_indexed_are_skipped(tmp_path):
+    index = open_index(tmp_path)
+    assert index.add_all([make_post(1, "one"), make_post(2, "two")]) == 2
+    assert index.add_all([make_post(1, "one"), make_post(2, "two"), make_post(3, "three")]) == 1
+    index.add(make_post(3, "three"))
+    assert len(index) == 3
+    assert index.last_id == 3
+
+
+def test_a_saved_index_loads_and_catches_up_with_newer_posts(tmp_path):
+    posts = [make_post(i, f"post number {i} about {'cats' if i % 2 else 'dogs'}",
+                       author="bot" if i % 3 == 0 else "dave", personality="Poet" if i % 3 == 0 else None)
+             for i in range(1, 21)]
+    index = open_index(tmp_path)
+    index.add_all(posts[:15])
+    index.save()
+    assert index.stats()["saved_id"] == 15
+
+    loaded = open_index(tmp_path)
+    assert loaded.load()
+    assert (len(loaded), loaded.last_id) == (15, 15)
+    assert loaded.search("cats") == index.search("cats")
+    assert loaded.search("dogs", personality="poet") == index.search("dogs", personality="poet")
+
+    # Only the posts after the saved one are indexed again
+    assert loaded.add_all(posts) == 5
+    index.add_all(posts)
+    for query, filters in (("cats", {}), ("dogs", {"is_ai": True}), ("number", {"author": "dave"})):
+        assert loaded.search(query, **filters) == index.search(query, **filters)
+
+
+def test_save_interval_saves_in_the_background(tmp_path):
+    index = open_index(tmp_path, save_interval=3)
+    index.add_all([make_post(1, "a"), make_post(2, "b")])
+    assert index._save_thread is None
+    index.add(make_post(3, "c"))
+    index._save_thread.join()
+    assert index.stats()["saved_id"] == 3
+    assert open_index(tmp_path).load()
+
+    readonly = open_index(tmp_path / "missing", save_interval=1, write=False)
+    readonly.add(make_post(1, "a"))
+    assert readonly._save_thread is None
+
+
+def test_a_missing_or_unreadable_index_loads_empty(tmp_path):
+    index = open_index(tmp_path)
+    assert not index.load()
+    (tmp_path / "search_index.brdv").write_bytes(b"not an index")
+    assert not index.load()
+    assert len(index) == 0 and index.last_id == 0
@@ -0,0 +1,63 @@
+import json
+from compaction import Compactor
+from post_store import PostStore
+from storage import Storage
+
+
+def fill(vault_dir):
+    storage = Storage("json", vault_dir)
+    posts = PostStore(storage.event_log, storage.checkpoints)
+    first = posts.create_post("hello", "alice")
+    posts.create_post("a reply", "bob", parent_id=first["id"])
+    posts.toggle_like(first["id"], "bob")
+    posts.toggle_like(first["id"], "carol")
+    posts.toggle_like(first["id"], "bob")
+    for i in range(3):
+        storage.notification_store.add(f"notification {i}", first["id"])
+    storage.notification_store.mark_seen("alice", 2)
+    storage.settings.save({"notifications_enabled": False})
+    storage.event_log.sync()
+    return storage, posts.all_posts()
+
+
+def test_json_vault_migrates_to_sqlite(tmp_path):
+    vault_dir = str(tmp_path)
+    _, expected = fill(vault_dir)
+
+    storage = Storage("sqlite", vault_dir)
+    assert json.loads(storage.db.get_meta("migrated")) == {"events": 5, "notifications": 3, "settings": 1}
+    posts = PostStore(storage.event_log, storage.checkpoints)
+    assert posts.all_posts() == expected
+    assert posts.likers(1) == (["carol"], 1)
+    assert posts.revision == 5
+    assert [n["seen"] for n in storage.notification_store.since(0, "alice")] == [True, True, False]
+    assert storage.notification_store.unread_count("alice") == 1
+    assert storage.settings.get() == {"notifications_enabled": False}
+
+    # New writes carry on from the migrated seqs and ids
+    assert posts.create_post("after", "dave")["id"] == 3
+    assert storage.event_log.last_seq == 6
+    assert Storage("sqlite", vault_dir).db.get_meta("migrated") is not None
+
+
+def test_compacted_json_vault_migrates_from_its_checkpoint(tmp_path):
+    vault_dir = str(tmp_path)
+    storage, expected = fill(vault_dir)
+    # Everything is older than a negative retention, so the whole log is folded into a checkpoint
+    Compactor(storage.event_log, storage.checkpoints, retention_days=-1).run()
+    assert storage.event_log.base > 0
+
+    migrated = Storage("sqlite", vault_dir)
+    assert [(e["seq"], e["offset"]) for e in migrated.checkpoints.index] == [(5, 5)]
+    posts = PostStore(migrated.event_log, migrated.checkpoints)
+    assert posts.all_posts() == expected
+    assert posts.create_post("after", "dave")["id"] == 3
+
+
+def test_sqlite_history_matches_the_json_log(tmp_path):
+    storage, _ = fill(str(tmp_path / "json"))
+    sqlite = Storage("sqlite", str(tmp_path / "sqlite"))
+    sqlite.event_log.append_events(list(storage.event_log.events()))
+    assert list(sqlite.event_log.events(2)) == list(storage.event_log.events())[2:]
+    assert sqlite.event_log.replay() == storage.event_log.replay()
+    assert sqlite.event_log.snapshot()["seq"] == 5
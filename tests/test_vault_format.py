@@ -0,0 +1,140 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from event_log import Checkpoints, to_record
+from vault_format import (DOCUMENT, HEADER, LINES, LIST, MAGIC, SECTIONS, FormatError, convert, dumps,
+                          encode_record, is_framed, read_document, read_last, read_layout, read_records,
+                          split_sections, write_file)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize("layout, records, document", [
+    (LIST, [{"id": 1}, {"id": 2}], [{"id": 1}, {"id": 2}]),
+    (LINES, [{"seq": 1}, {"seq": 2}], [{"seq": 1}, {"seq": 2}]),
+    (DOCUMENT, [{"a": "é", "b": [1, 2]}], {"a": "é", "b": [1, 2]}),
+])
+def test_records_round_trip(tmp_path, layout, records, document):
+    path = str(tmp_path / "file.brdv")
+    assert write_file(path, iter(records), layout) == len(records)
+    assert is_framed(path)
+    assert read_layout(path) == layout
+    assert list(read_records(path)) == records
+    assert read_document(path) == document
+    assert read_last(path) == records[-1]
+
+
+def test_sections_are_chunked_with_the_footer_last(tmp_path):
+    document = {"posts": [{"id": i} for i in range(5)], "revisions": [], "seq": 9, "timestamp": "t"}
+    records = list(split_sections(document, chunk=2))
+    assert records == [{"posts": [{"id": 0}, {"id": 1}]}, {"posts": [{"id": 2}, {"id": 3}]},
+                       {"posts": [{"id": 4}]}, {"revisions": []}, {"seq": 9, "timestamp": "t"}]
+    path = str(tmp_path / "checkpoint.brdv")
+    write_file(path, records, SECTIONS)
+    assert read_document(path) == document
+    assert read_last(path) == {"seq": 9, "timestamp": "t"}
+
+
+def test_an_empty_file_has_no_records(tmp_path):
+    path = str(tmp_path / "empty.brdv")
+    write_file(path, [], LIST)
+    assert list(read_records(path)) == []
+    assert read_last(path) is None
+
+
+def test_read_last_skips_a_torn_tail(tmp_path):
+    path = str(tmp_path / "file.brdv")
+    write_file(path, [{"n": 1}, {"n": 2}], LIST)
+    with open(path, "ab") as f:
+        f.write(encode_record({"n": 3})[:-3])
+    assert read_last(path) == {"n": 2}
+    assert list(read_records(path)) == [{"n": 1}, {"n": 2}]
+
+
+def test_read_last_skips_a_record_that_fails_its_crc(tmp_path):
+    path = str(tmp_path / "file.brdv")
+    write_file(path, [{"n": 1}, {"n": 2}, {"n": 3}], LIST)
+    data = bytearray(open(path, "rb").read())
+    # Flip a byte inside the last payload, keeping its framing intact
+    data[-6] ^= 0xFF
+    open(path, "wb").write(bytes(data))
+    assert read_last(path) == {"n": 2}
+    assert list(read_records(path)) == [{"n": 1}, {"n": 2}]
+
+
+def test_files_in_other_formats_are_refused(tmp_path):
+    plain = tmp_path / "plain.json"
+    plain.write_text("[]")
+    assert not is_framed(str(plain))
+    with pytest.raises(FormatError):
+        list(read_records(str(plain)))
+    newer = tmp_path / "newer.brdv"
+    newer.write_bytes(HEADER.pack(MAGIC, 99, LIST))
+    with pytest.raises(FormatError):
+        read_layout(str(newer))
+
+
+@pytest.mark.parametrize("name, content", [
+    ("posts.json", [{"timestamp": "t1", "messages": [{"id": 1}]}, {"timestamp": "t2", "messages": []}]),
+    ("settings.json", {"notifications_enabled": False}),
+    ("checkpoint.json", {"posts": [{"id": 1}], "seq": 3}),
+])
+def test_convert_round_trips_json_files(tmp_path, name, content):
+    source = tmp_path / name
+    source.write_bytes(dumps(content))
+    framed = str(tmp_path / "framed.brdv")
+    convert(str(source), framed)
+    assert read_document(framed) == content
+    back = tmp_path / f"back-{name}"
+    convert(framed, str(back))
+    assert json.loads(back.read_bytes()) == content
+
+
+def test_convert_round_trips_jsonl(tmp_path):
+    source = tmp_path / "events.jsonl"
+    source.write_text('{"seq":1}\n{"seq":2}\n')
+    count, direction = convert(str(source), str(tmp_path / "events.brdv"))
+    assert (count, direction) == (2, "lines -> framed")
+    convert(str(tmp_path / "events.brdv"), str(tmp_path / "back.jsonl"))
+    assert (tmp_path / "back.jsonl").read_text() == '{"seq":1}\n{"seq":2}\n'
+
+
+def run_cli(*args):
+    return subprocess.run([sys.executable, os.path.join(ROOT, "vault_format.py"), *map(str, args)],
+                          capture_output=True, text=True, check=True).stdout
+
+
+def test_converter_cli(tmp_path):
+    source = tmp_path / "notifications.json"
+    source.write_text(json.dumps([{"id": 1}, {"id": 2}]))
+    output = run_cli(source, tmp_path / "notifications.brdv")
+    assert output.startswith("Converted 2 records (list -> framed)")
+    assert json.loads(run_cli(tmp_path / "notifications.brdv", "--last")) == {"id": 2}
+    run_cli(tmp_path / "notifications.brdv", tmp_path / "back.json")
+    assert json.loads((tmp_path / "back.json").read_text()) == [{"id": 1}, {"id": 2}]
+    with pytest.raises(subprocess.CalledProcessError):
+        run_cli(tmp_path / "notifications.brdv")
+
+
+def test_old_json_checkpoints_load_next_to_framed_ones(tmp_path):
+    directory = tmp_path / "checkpoints"
+    directory.mkdir()
+    post = {"id": 1, "parentId": None, "createdBy": "alice", "createdWhen": "2024-01-01T00:00:00Z",
+            "updatedWhen": "2024-01-01T00:00:00Z", "content": "hello", "likes": ["bob"], "isAI": False}
+    old = {"posts": [to_record(post)], "revisions": [[1, 2]], "seq": 2, "timestamp": "2024-01-01T00:00:00Z",
+           "offset": 100}
+    (directory / "checkpoint-000000000002.json").write_bytes(dumps(old))
+    (directory / "index.json").write_bytes(dumps([
+        {"seq": 2, "timestamp": old["timestamp"], "offset": 100, "file": "checkpoint-000000000002.json"}
+    ]))
+
+    checkpoints = Checkpoints(str(directory))
+    checkpoints.write(5, "2024-01-02T00:00:00Z", 250, [post], [[1, 5]])
+    assert [entry["file"] for entry in checkpoints.index] == ["checkpoint-000000000002.json",
+                                                               "checkpoint-000000000005.brdv"]
+    loaded = [checkpoints.load(entry) for entry in checkpoints.index]
+    assert [c["seq"] for c in loaded] == [2, 5]
+    assert loaded[0]["posts"] == loaded[1]["posts"]
+    assert list(loaded[0]["posts"][0]["likes"]) == ["bob"]
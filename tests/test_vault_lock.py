@@ -0,0 +1,160 @@
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+from storage import Storage
+from post_store import PostStore
+from vault_lock import LeaderElection, WriterLock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def spawn(code, *args):
+    """Run code in a separate Python process, with args as sys.argv[1:]"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.Popen([sys.executable, "-c", textwrap.dedent(code), *map(str, args)], env=env, cwd=ROOT,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+
+
+def finish(process, timeout=30):
+    out, _ = process.communicate(timeout=timeout)
+    assert process.returncode == 0
+    return out
+
+
+INCREMENT = """
+    import sys, time
+    from vault_lock import WriterLock
+    lock_path, counter_path, rounds = sys.argv[1], sys.argv[2], int(sys.argv[3])
+    lock = WriterLock(lock_path)
+    for _ in range(rounds):
+        with lock:
+            with open(counter_path) as f:
+                value = int(f.read())
+            time.sleep(0.001)
+            with open(counter_path, "w") as f:
+                f.write(str(value + 1))
+"""
+
+
+def test_writer_lock_excludes_other_processes(tmp_path):
+    counter = tmp_path / "counter"
+    counter.write_text("0")
+    workers = [spawn(INCREMENT, tmp_path / "vault.lock", counter, 40) for _ in range(3)]
+    for worker in workers:
+        finish(worker)
+    assert counter.read_text() == "120"
+
+
+def test_writer_lock_waits_for_another_process(tmp_path):
+    lock = WriterLock(str(tmp_path / "vault.lock"))
+    with lock:
+        waiter = spawn("""
+            import sys, time
+            from vault_lock import WriterLock
+            print("started", flush=True)
+            with WriterLock(sys.argv[1]):
+                print(time.time())
+        """, tmp_path / "vault.lock")
+        assert waiter.stdout.readline().strip() == "started"
+        time.sleep(0.3)
+        released = time.time()
+    assert float(finish(waiter)) >= released
+
+
+def test_on_acquire_runs_once_per_acquisition_of_the_flock(tmp_path):
+    lock = WriterLock(str(tmp_path / "vault.lock"), max_hold=5)
+    calls = []
+    lock.on_acquire.append(lambda: calls.append(threading.current_thread().name))
+    inside = threading.Event()
+    release = threading.Event()
+
+    def writer():
+        with lock:
+            inside.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=writer, name="writer")
+    thread.start()
+    inside.wait(5)
+    # Held by this process already: another thread passes straight through, as does a nested acquisition
+    with lock:
+        with lock:
+            pass
+    release.set()
+    thread.join()
+    with lock:
+        pass
+    assert calls == ["writer", "MainThread"]
+    assert lock.stats()["acquisitions"] == 2
+
+
+def test_when_idle_skips_while_a_write_is_in_progress(tmp_path):
+    lock = WriterLock(str(tmp_path / "vault.lock"))
+    calls = []
+    with lock:
+        assert not lock.when_idle(lambda: calls.append(1))
+    assert lock.when_idle(lambda: calls.append(2))
+    assert calls == [2]
+
+
+LEADER = """
+    import sys
+    from vault_lock import LeaderElection
+    election = LeaderElection(sys.argv[1], lambda: print("elected", flush=True))
+    if not election.try_acquire():
+        print("follower", flush=True)
+    sys.stdin.read()
+"""
+
+
+def test_only_one_process_is_elected(tmp_path):
+    path = tmp_path / "leader.lock"
+    first = spawn(LEADER, path)
+    assert first.stdout.readline().strip() == "elected"
+    second = spawn(LEADER, path)
+    assert second.stdout.readline().strip() == "follower"
+    elected = []
+    election = LeaderElection(str(path), lambda: elected.append(True))
+    assert not election.try_acquire()
+    assert not election.is_leader and elected == []
+    finish(first)
+    finish(second)
+
+
+def test_another_process_takes_over_when_the_leader_exits(tmp_path):
+    path = tmp_path / "leader.lock"
+    leader = spawn(LEADER, path)
+    assert leader.stdout.readline().strip() == "elected"
+    elected = threading.Event()
+    election = LeaderElection(str(path), elected.set, interval=0.05)
+    election.start()
+    assert not election.is_leader
+    leader.kill()
+    leader.communicate()
+    assert elected.wait(5)
+    assert election.is_leader
+
+
+CREATE_POSTS = """
+    import sys
+    from post_store import PostStore
+    from storage import Storage
+    storage = Storage("json", sys.argv[1], shared=True)
+    posts = PostStore(storage.event_log, storage.checkpoints, write_checkpoints=False)
+    storage.lock.on_acquire.append(posts.follow)
+    for i in range(int(sys.argv[2])):
+        posts.create_post(f"post {i}", sys.argv[3])
+"""
+
+
+def test_processes_sharing_a_vault_get_unique_post_ids(tmp_path):
+    writers = [spawn(CREATE_POSTS, tmp_path, 25, name) for name in ("alice", "bob")]
+    for writer in writers:
+        finish(writer)
+    storage = Storage("json", str(tmp_path))
+    posts = PostStore(storage.event_log, storage.checkpoints).all_posts()
+    assert sorted(post["id"] for post in posts) == list(range(1, 51))
+    assert sorted(post["createdBy"] for post in posts) == ["alice"] * 25 + ["bob"] * 25
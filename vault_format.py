@@ -0,0 +1,260 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# File header: magic, format version, layout of the records
+MAGIC = b"BRDV"
+VERSION = 1
+HEADER = struct.Struct("<4sBB2x")
+# Each record is framed as [length][crc32] payload [length]; the trailing
+# length lets a reader step backwards from the end of the file
+FRAME = struct.Struct("<II")
+TRAILER = struct.Struct("<I")
+
+# How the records map back to a plain JSON file
+LIST = 0      # a JSON array, one record per element
+DOCUMENT = 1  # a single JSON value in one record
+LINES = 2     # a JSONL file, one record per line
+SECTIONS = 3  # a JSON object: its lists in chunked records, then a footer with the other keys
+LAYOUTS = {LIST: "list", DOCUMENT: "document", LINES: "lines", SECTIONS: "sections"}
+# List items per record in the sections layout
+CHUNK = 1000
+
+
+def dumps(obj) -> bytes:
+    """Compact JSON as UTF-8 bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def loads(data):
+    """Parse JSON from bytes or str; orjson's decode errors are json.JSONDecodeError too"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def encode_record(obj) -> bytes:
+    payload = dumps(obj)
+    return FRAME.pack(len(payload), zlib.crc32(payload)) + payload + TRAILER.pack(len(payload))
+
+
+class FormatError(Exception):
+    """Raised when a file is not in the framed vault format"""
+
+
+def is_framed(path: str) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def write_file(path: str, records, layout: int = LIST) -> int:
+    """Atomically write records (any iterable of JSON values) to a framed file, returning the count"""
+    tmp_path = path + ".tmp"
+    count = 0
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, layout))
+        for record in records:
+            f.write(encode_record(record))
+            count += 1
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+def split_sections(document: Dict, chunk: int = CHUNK) -> Iterator[Dict]:
+    """Records for the sections layout; the footer comes last so read_last() finds it"""
+    footer = {}
+    for key, value in document.items():
+        if not isinstance(value, list):
+            footer[key] = value
+            continue
+        for start in range(0, max(len(value), 1), chunk):
+            yield {key: value[start:start + chunk]}
+    yield footer
+
+
+def join_sections(records) -> Dict:
+    document: Dict = {}
+    for record in records:
+        for key, value in record.items():
+            if isinstance(value, list):
+                document.setdefault(key, []).extend(value)
+            else:
+                document[key] = value
+    return document
+
+
+def _map(path: str) -> Tuple[Optional[mmap.mmap], int]:
+    """Memory-map a framed file, returning (map, layout); the map is None for an empty body"""
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+            raise FormatError(f"{path} is not a framed vault file")
+        _, version, layout = HEADER.unpack(header)
+        if version > VERSION:
+            raise FormatError(f"{path} uses format version {version}, newer than {VERSION}")
+        if os.fstat(f.fileno()).st_size == HEADER.size:
+            return None, layout
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), layout
+
+
+def _record_at(data, position: int) -> Optional[Tuple[bytes, int]]:
+    """The payload starting at position and the position after it, or None if torn or corrupt"""
+    if position + FRAME.size > len(data):
+        return None
+    length, crc = FRAME.unpack_from(data, position)
+    start = position + FRAME.size
+    end = start + length + TRAILER.size
+    if end > len(data) or TRAILER.unpack_from(data, end - TRAILER.size)[0] != length:
+        return None
+    payload = data[start:start + length]
+    if zlib.crc32(payload) != crc:
+        return None
+    return payload, end
+
+
+def read_layout(path: str) -> int:
+    data, layout = _map(path)
+    if data is not None:
+        data.close()
+    return layout
+
+
+def read_records(path: str) -> Iterator:
+    """Every record in a framed file, oldest first, stopping at a torn or corrupt one"""
+    data, _ = _map(path)
+    if data is None:
+        return
+    try:
+        position = HEADER.size
+        while position < len(data):
+            record = _record_at(data, position)
+            if record is None:
+                logger.warning(f"Stopping at an unreadable record at byte {position} of {path}")
+                return
+            payload, position = record
+            yield loads(payload)
+    finally:
+        data.close()
+
+
+def read_last(path: str):
+    """The last record of a framed file, read from the end without touching the ones before it"""
+    data, _ = _map(path)
+    if data is None:
+        return None
+    try:
+        end = len(data)
+        if end - HEADER.size >= FRAME.size + TRAILER.size:
+            length = TRAILER.unpack_from(data, end - TRAILER.size)[0]
+            start = end - TRAILER.size - length - FRAME.size
+            if start >= HEADER.size:
+                record = _record_at(data, start)
+                if record is not None and record[1] == end:
+                    return loads(record[0])
+    finally:
+        data.close()
+    # A torn tail: fall back to the last record that reads back whole
+    last = None
+    for last in read_records(path):
+        pass
+    return last
+
+
+def read_document(path: str):
+    """A framed file read back as the JSON value it holds"""
+    layout = read_layout(path)
+    records = read_records(path)
+    if layout == SECTIONS:
+        return join_sections(records)
+    if layout == DOCUMENT:
+        return next(records, None)
+    return list(records)
+
+
+def read_json_file(path: str) -> Tuple[List, int]:
+    """Records and layout of a plain JSON or JSONL file, as convert() would frame them"""
+    if path.endswith(".jsonl"):
+        records = []
+        with open(path, "rb") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(loads(line))
+        return records, LINES
+    with open(path, "rb") as f:
+        document = loads(f.read())
+    if isinstance(document, list):
+        return document, LIST
+    if isinstance(document, dict) and any(isinstance(value, list) for value in document.values()):
+        return list(split_sections(document)), SECTIONS
+    return [document], DOCUMENT
+
+
+def write_json_file(path: str, records: List, layout: int):
+    """Write records back out as the plain JSON or JSONL file they were framed from"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        if layout == LINES:
+            for record in records:
+                f.write(dumps(record) + b"\n")
+        elif layout == DOCUMENT:
+            f.write(dumps(records[0] if records else None))
+        elif layout == SECTIONS:
+            f.write(dumps(join_sections(records)))
+        else:
+            f.write(dumps(records))
+    os.replace(tmp_path, path)
+
+
+def convert(source: str, destination: str) -> Tuple[int, str]:
+    """Convert a file between the framed format and plain JSON/JSONL, returning (records, direction)"""
+    if is_framed(source):
+        layout = read_layout(source)
+        records = list(read_records(source))
+        write_json_file(destination, records, layout)
+        return len(records), f"framed -> {LAYOUTS.get(layout, 'list')}"
+    records, layout = read_json_file(source)
+    return write_file(destination, records, layout), f"{LAYOUTS[layout]} -> framed"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Convert vault files between plain JSON/JSONL and the framed format. "
+                    "The direction follows the source: a framed file is written back out as "
+                    "the JSON array, object or JSONL lines it came from."
+    )
+    parser.add_argument("source", help="file to convert")
+    parser.add_argument("destination", nargs="?", help="file to write")
+    parser.add_argument("--last", action="store_true",
+                        help="only print the last record of a framed source, read from the end")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.last:
+        print(json.dumps(read_last(args.source), indent=2))
+    elif not args.destination:
+        parser.error("a destination is required unless --last is given")
+    else:
+        count, direction = convert(args.source, args.destination)
+        print(f"Converted {count} records ({direction}): "
+              f"{os.path.getsize(args.source)} -> {os.path.getsize(args.destination)} bytes")
@@ -0,0 +1,176 @@
+import fcntl
+import os
+import threading
+import time
+import logging
+from contextlib import nullcontext
+from typing import Callable, List, Optional
+from metrics import STORAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Stands in for a WriterLock when the vault belongs to a single process
+NO_LOCK = nullcontext()
+
+
+class FileLock:
+    """A mutex across the threads of this process and every other process, via flock"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def __enter__(self):
+        self._lock.acquire()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+
+class WriterLock:
+    """Exclusive write access to a vault shared by several worker processes.
+
+    The flock is taken per process rather than per thread: the first thread
+    in takes it and runs the ``on_acquire`` callbacks, which catch this
+    process up on whatever the others wrote meanwhile; threads arriving
+    while it is held pass straight through, so their mutations still share
+    group commits; the last one out releases it. So that a busy worker
+    cannot keep it forever, once it has been held for ``max_hold`` seconds
+    new threads wait until the current ones finish and the flock is let go.
+    """
+
+    def __init__(self, path: str, max_hold: float = 0.05):
+        self.path = path
+        self.max_hold = max_hold
+        self.on_acquire: List[Callable[[], None]] = []
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._cond = threading.Condition()
+        self._holders = 0
+        self._held_since = 0.0
+        self._draining = False
+        self._local = threading.local()
+        self.acquisitions = 0
+        self.wait_seconds = 0.0
+
+    def __enter__(self):
+        depth = getattr(self._local, "depth", 0)
+        with self._cond:
+            # A thread that already holds it never waits on itself
+            while not depth and (self._draining or
+                                 (self._holders and time.monotonic() - self._held_since > self.max_hold)):
+                self._draining = True
+                self._cond.wait()
+            if self._holders == 0:
+                started = time.monotonic()
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+                self._held_since = time.monotonic()
+                waited = self._held_since - started
+                self.acquisitions += 1
+                self.wait_seconds += waited
+                STORAGE_SECONDS.observe(waited, operation="vault_lock_wait")
+                try:
+                    for callback in self.on_acquire:
+                        callback()
+                except Exception:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+                    raise
+            self._holders += 1
+        self._local.depth = depth + 1
+        return self
+
+    def __exit__(self, *exc):
+        self._local.depth -= 1
+        with self._cond:
+            self._holders -= 1
+            if self._holders == 0:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                self._draining = False
+                self._cond.notify_all()
+
+    def when_idle(self, callback: Callable[[], None]) -> bool:
+        """Run callback unless a thread of this process is writing; new writers wait for it"""
+        with self._cond:
+            if self._holders:
+                return False
+            callback()
+            return True
+
+    def stats(self) -> dict:
+        return {
+            "acquisitions": self.acquisitions,
+            "avg_wait_ms": round(self.wait_seconds / self.acquisitions * 1000, 3) if self.acquisitions else 0.0
+        }
+
+
+class LeaderElection:
+    """Elects one worker process per vault to run the singletons (reply scheduler, compaction).
+
+    Every worker polls a non-blocking flock on ``path``; the one that gets
+    it is the leader until it exits, when the kernel drops the lock and
+    another worker takes over within ``interval`` seconds.
+    """
+
+    def __init__(self, path: str, on_elected: Callable[[], None], interval: float = 1.0):
+        self.path = path
+        self.on_elected = on_elected
+        self.interval = interval
+        self.is_leader = False
+        self.elected_at: Optional[float] = None
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def try_acquire(self) -> bool:
+        if self.is_leader:
+            return True
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        self.is_leader = True
+        self.elected_at = time.time()
+        logger.info(f"Process {os.getpid()} elected leader of {os.path.dirname(self.path) or '.'}")
+        try:
+            self.on_elected()
+        except Exception as e:
+            logger.error(f"Error starting leader services: {e}")
+        return True
+
+    def start(self):
+        """Campaign now and then every interval seconds on a daemon thread until elected"""
+        if self.try_acquire():
+            return
+
+        def campaign():
+            while not self.try_acquire():
+                time.sleep(self.interval)
+
+        threading.Thread(target=campaign, name="leader-election", daemon=True).start()
+
+
+class Follower:
+    """Polls for writes made by other processes and applies them to this one's caches"""
+
+    def __init__(self, lock: WriterLock, follow: Callable[[], None], interval: float = 0.05):
+        self.lock = lock
+        self.follow = follow
+        self.interval = interval
+        self.polls = 0
+
+    def poll(self):
+        """Follow now, unless this process is in the middle of its own write"""
+        try:
+            self.lock.when_idle(self.follow)
+            self.polls += 1
+        except Exception as e:
+            logger.error(f"Error following vault changes: {e}")
+
+    def start(self):
+        def loop():
+            while True:
+                time.sleep(self.interval)
+                self.poll()
+
+        threading.Thread(target=loop, name="vault-follower", daemon=True).start()
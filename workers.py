@@ -0,0 +1,63 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import logging
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+# Set in the environment of the processes started by supervise()
+WORKER_ENV = "BIRDIEEE_WORKER"
+
+
+def is_worker() -> bool:
+    return os.getenv(WORKER_ENV) is not None
+
+
+def reuse_port_socket(host: str, port: int, backlog: int = 128) -> socket.socket:
+    """A listening socket that other processes can bind as well; the kernel spreads connections between them"""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def supervise(script: str, workers: int, restart_delay: float = 1.0) -> int:
+    """Run ``workers`` copies of script, restarting any that exit, until interrupted.
+
+    Each copy serves the same ports with SO_REUSEPORT and shares the vault
+    through file locks, so nothing else needs to be running on the host.
+    """
+    env = dict(os.environ)
+    processes: Dict[int, subprocess.Popen] = {}
+
+    def spawn(index: int):
+        env[WORKER_ENV] = str(index)
+        processes[index] = subprocess.Popen([sys.executable, os.path.abspath(script)], env=env)
+        logger.info(f"Started worker {index} as process {processes[index].pid}")
+
+    def stop(*_):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    for index in range(workers):
+        spawn(index)
+    try:
+        while True:
+            time.sleep(restart_delay)
+            for index, process in list(processes.items()):
+                if process.poll() is not None:
+                    logger.warning(f"Worker {index} (process {process.pid}) exited with {process.returncode}, restarting")
+                    spawn(index)
+    except KeyboardInterrupt:
+        logger.info(f"Stopping {len(processes)} workers")
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.wait()
+    return 0